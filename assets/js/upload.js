@@ -0,0 +1,48 @@
+// Posts the selected replays one by one to /replays/<job id>, where the
+// server queues each of them for parsing as soon as it arrives. Dash only
+// gets the job id and polls the server for the progress and result.
+(function() {
+    var CONCURRENT_UPLOADS = 4;
+
+    function post(url, data) {
+        return fetch(url, {method: 'POST', body: data, credentials: 'same-origin'});
+    }
+
+    function uploadReplays(files) {
+        var url = '/replays/' + document.getElementById('upload-job').textContent;
+        var next = 0;
+
+        function uploadNext() {
+            if (next >= files.length) {
+                return Promise.resolve();
+            }
+            var file = files[next++];
+            var data = new FormData();
+            var dates = {};
+            dates[file.name] = file.lastModified;
+            data.append('replays', file, file.name);
+            data.append('dates', JSON.stringify(dates));
+            // a failed replay must not stop the others
+            return post(url, data).then(uploadNext, uploadNext);
+        }
+
+        var start = new FormData();
+        start.append('total', files.length);
+        return post(url + '/start', start).then(function() {
+            var uploads = [];
+            for (var i = 0; i < CONCURRENT_UPLOADS; i++) {
+                uploads.push(uploadNext());
+            }
+            return Promise.all(uploads);
+        }).then(function() {
+            return post(url + '/done', new FormData());
+        });
+    }
+
+    // the input is rendered by Dash after this script ran
+    document.addEventListener('change', function(event) {
+        if (event.target.id === 'replay-files' && event.target.files.length > 0) {
+            uploadReplays(Array.prototype.slice.call(event.target.files));
+        }
+    });
+})();
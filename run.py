@@ -1,2 +1,8 @@
-from wc3stats.app import run
-run()
+from multiprocessing import freeze_support
+
+if __name__ == '__main__':
+    # replays are parsed in worker processes, which re-import this module
+    # on Windows and in the frozen desktop build
+    freeze_support()
+    from wc3stats.app import run
+    run()
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""Microbenchmark of the action dispatch loop of w3g.File.
+
+Replays the commands of synthetic replays (see replay_builder) of every
+build range through two dispatch loops:
+
+- dict: the loop of the baseline, which merged the action dicts of the
+  build into a new dict for every command and looked the ids up in it
+- table: File._parse_actions, which indexes the 256 entry list of
+  action_table() built once per build range
+
+Both create the same action objects, so the difference is the dispatch.
+Run it from the repository root:
+
+    PYTHONPATH=. python tests/bench_dispatch.py [--slots N] [--repeat N]
+"""
+import io
+import time
+import argparse
+
+from wc3stats.w3g import (File, ACTIONS, ACTIONS_LE_1_06, ACTIONS_GT_1_06, ACTIONS_LE_1_14B,
+                          ACTIONS_GT_1_14B, BUILD_1_06, BUILD_1_14B, b2i)
+from replay_builder import BUILDS, make_replay
+
+
+class RecordingFile(File):
+    """A File that keeps the commands of its time slots."""
+
+    def __init__(self, f):
+        self.commands = []
+        super(RecordingFile, self).__init__(f)
+
+    def _parse_actions(self, player_id, action_block):
+        self.commands.append((player_id, memoryview(bytes(action_block))))
+        super(RecordingFile, self)._parse_actions(player_id, action_block)
+
+
+def parse_actions_dict(f, player_id, action_block):
+    # _parse_actions before action_table
+    actions = dict(ACTIONS)
+    actions.update(ACTIONS_LE_1_06 if f.build_num <= BUILD_1_06 \
+                   else ACTIONS_GT_1_06)
+    actions.update(ACTIONS_LE_1_14B if f.build_num <= BUILD_1_14B \
+                   else ACTIONS_GT_1_14B)
+    while len(action_block) > 0:
+        aid = b2i(action_block[0])
+        action = actions.get(aid, None)
+        if action is None:
+            return
+        e = action(f, player_id, action_block)
+        f._emit(e)
+        action_block = action_block[e.size:]
+
+def run(f, parse_actions):
+    # returns the seconds it took and the number of actions
+    f._pending = []
+    start = time.perf_counter()
+    for player_id, action_block in f.commands:
+        parse_actions(player_id, action_block)
+    elapsed = time.perf_counter() - start
+    return elapsed, len(f._pending)
+
+def best(f, parse_actions, repeat):
+    results = [run(f, parse_actions) for _ in range(repeat)]
+    return min(results)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--slots', type=int, default=20000, help='time slots per replay')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per loop, the best one counts')
+    args = parser.parse_args()
+
+    print('{0:>6} {1:>8} {2:>12} {3:>12} {4:>8}'.format('build', 'actions', 'dict ns', 'table ns', 'speedup'))
+    for build in BUILDS:
+        f = RecordingFile(io.BytesIO(make_replay(args.slots, seed=build, build=build)))
+        old, n = best(f, lambda player_id, block: parse_actions_dict(f, player_id, block), args.repeat)
+        # File's own loop, the override of RecordingFile would record the commands again
+        new, m = best(f, lambda player_id, block: File._parse_actions(f, player_id, block), args.repeat)
+        assert n == m, 'the loops parsed different actions'
+        print('{0:>6} {1:>8} {2:>12.0f} {3:>12.0f} {4:>7.2f}x'.format(
+            build, n, old / n * 1e9, new / n * 1e9, old / new))
+
+if __name__ == '__main__':
+    main()
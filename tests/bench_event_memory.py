@@ -0,0 +1,77 @@
+"""Benchmark of the memory held by the events of w3g.File.
+
+Parses synthetic replays (see replay_builder) and reports:
+
+- the bytes per event traced by tracemalloc while the events of one
+  replay are alive
+- the time of a gc.collect() and the number of objects it frees after a
+  batch of 1000 parsed replays (--replays) has been dropped
+
+With --baseline REV the same is measured for wc3stats/w3g.py as of the
+git revision REV, e.g. the commit before the events were slotted, to
+compare both. Run it from the repository root:
+
+    PYTHONPATH=. python tests/bench_event_memory.py [--baseline REV]
+"""
+import io
+import gc
+import time
+import argparse
+import subprocess
+import tracemalloc
+import importlib.util
+
+from wc3stats import w3g
+from replay_builder import make_replay
+
+
+def load_w3g(rev):
+    """Returns the w3g module of the git revision rev."""
+    source = subprocess.check_output(['git', 'show', '{0}:wc3stats/w3g.py'.format(rev)])
+    # a name inside the package, so that the relative imports resolve
+    spec = importlib.util.spec_from_loader('wc3stats.w3g_' + rev.replace('^', '_').replace('~', '_'),
+                                           loader=None)
+    module = importlib.util.module_from_spec(spec)
+    exec(compile(source, 'w3g.py@' + rev, 'exec'), module.__dict__)
+    return module
+
+def bytes_per_event(module, replay):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    f = module.File(io.BytesIO(replay))
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / len(f.events)
+
+def collect_after_drop(module, replay, nreplays):
+    # returns the seconds of the collection and the objects it freed
+    gc.collect()
+    gc.disable()
+    try:
+        files = [module.File(io.BytesIO(replay)) for _ in range(nreplays)]
+        del files
+        start = time.perf_counter()
+        freed = gc.collect()
+        return time.perf_counter() - start, freed
+    finally:
+        gc.enable()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--slots', type=int, default=2000, help='time slots per replay')
+    parser.add_argument('--replays', type=int, default=1000, help='replays dropped before the collection')
+    parser.add_argument('--baseline', metavar='REV', help='git revision of w3g.py to compare with')
+    args = parser.parse_args()
+
+    replay = make_replay(args.slots)
+    modules = [('current', w3g)]
+    if args.baseline:
+        modules.insert(0, (args.baseline, load_w3g(args.baseline)))
+    print('{0:>12} {1:>12} {2:>10} {3:>10}'.format('', 'B/event', 'gc ms', 'freed'))
+    for name, module in modules:
+        size = bytes_per_event(module, replay)
+        elapsed, freed = collect_after_drop(module, replay, args.replays)
+        print('{0:>12} {1:>12.0f} {2:>10.1f} {3:>10}'.format(name, size, elapsed * 1e3, freed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark of the block decompression of w3g.File.
+
+Reads the data blocks of a synthetic replay (see replay_builder) in two
+ways, without parsing the events:
+
+- concat: the loop of the baseline, which appended every decompressed
+  block to a growing bytes object
+- buffer: File._read_blocks, which writes the blocks into one bytearray
+  sized from the header
+
+and reports the best time of several reads and the peak memory traced by
+tracemalloc during one read. Run it from the repository root:
+
+    PYTHONPATH=. python tests/bench_read_blocks.py [--slots N] [--repeat N]
+"""
+import io
+import time
+import argparse
+import tracemalloc
+
+from wc3stats.w3g import File
+from replay_builder import make_replay
+
+
+class BlockFile(File):
+    """A File that keeps the decompressed data instead of parsing it."""
+
+    def _parse_blocks(self, data):
+        self.data = data
+
+
+class ConcatFile(BlockFile):
+    """A BlockFile that reads the blocks like the baseline did."""
+
+    def _read_blocks(self):
+        data = b''
+        for dat in self._iter_blocks():
+            data += dat
+        self._parse_blocks(data)
+
+
+def best(cls, replay, repeat):
+    # returns the best time of repeat reads and the size of the data
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f = cls(io.BytesIO(replay))
+        times.append(time.perf_counter() - start)
+    return min(times), len(f.data)
+
+def peak(cls, replay):
+    # returns the peak traced memory of one read in bytes
+    tracemalloc.start()
+    f = cls(io.BytesIO(replay))
+    _, result = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del f
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--slots', type=int, default=60000, help='time slots of the replay')
+    parser.add_argument('--repeat', type=int, default=5, help='reads per loop, the best one counts')
+    args = parser.parse_args()
+
+    replay = make_replay(args.slots)
+    old, n = best(ConcatFile, replay, args.repeat)
+    new, m = best(BlockFile, replay, args.repeat)
+    assert n == m, 'the loops read different data'
+    print('{0:.1f} MB decompressed in {1} blocks'.format(n / 1e6, File(io.BytesIO(replay), events=False).nblocks))
+    print('{0:>8} {1:>10} {2:>10}'.format('', 'time ms', 'peak MB'))
+    print('{0:>8} {1:>10.1f} {2:>10.1f}'.format('concat', old * 1e3, peak(ConcatFile, replay) / 1e6))
+    print('{0:>8} {1:>10.1f} {2:>10.1f}'.format('buffer', new * 1e3, peak(BlockFile, replay) / 1e6))
+
+if __name__ == '__main__':
+    main()
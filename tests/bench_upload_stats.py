@@ -0,0 +1,74 @@
+"""Benchmark of the upload-to-stats pipeline of the Flask app.
+
+Turns batches of synthetic 1on1 replays (see replay_builder) into the
+statistics and the replay list in two ways, serially and without Flask:
+
+- rerun: the upload route of the baseline, which parsed the replays one
+  by one and recomputed the statistics of all replays so far after each
+- single: get_statistics over iter_parse_many, which folds every replay
+  in once and finalizes the statistics at the end
+
+The parse cache is turned off, so both parse every replay. Run it from
+the repository root:
+
+    PYTHONPATH=. python tests/bench_upload_stats.py [--sizes N ...]
+"""
+import io
+import os
+import time
+import argparse
+
+from wc3stats_flask.replay_helper import (load_single_replay, enrich_replay_data, compute_stats,
+                                          stats_post_processing, get_replay_list, iter_parse_many)
+from wc3stats_flask.replay_handler import get_statistics
+from replay_builder import make_replay
+
+ALIASES = ['Alice']
+
+
+def rerun(sources):
+    # the loop of the upload route before the stats were folded in once
+    replays = []
+    stats, rep_list = None, None
+    for data, filename, date in sources:
+        replays.append(load_single_replay(io.BytesIO(data), filename, date))
+        er = enrich_replay_data([r for r in replays if r is not None], ALIASES)
+        rep_list = get_replay_list(er)
+        stats = compute_stats(er)
+        stats_post_processing(stats)
+    return stats, rep_list
+
+def single(sources):
+    return get_statistics(iter_parse_many(sources, workers=1), ALIASES)
+
+def timed(pipeline, sources):
+    start = time.perf_counter()
+    result = pipeline(sources)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500, 2000],
+                        help='numbers of replays per upload')
+    parser.add_argument('--slots', type=int, default=300, help='time slots per replay')
+    parser.add_argument('--max-rerun', type=int, default=500,
+                        help='largest upload the rerun pipeline is timed for')
+    args = parser.parse_args()
+
+    os.environ['REPLAY_CACHE_PATH'] = ''
+    replay = make_replay(args.slots)
+    print('{0:>8} {1:>20} {2:>20}'.format('replays', 'rerun', 'single'))
+    for n in args.sizes:
+        sources = [(replay, '{0}.w3g'.format(i), 1.5e9 + 3600 * i) for i in range(n)]
+        new, result = timed(single, sources)
+        if n <= args.max_rerun:
+            old, expected = timed(rerun, sources)
+            assert result == expected, 'the pipelines computed different stats'
+            before = '{0:7.2f}s {1:6.1f}ms/rep'.format(old, old / n * 1e3)
+        else:
+            before = '-'
+        after = '{0:7.2f}s {1:6.1f}ms/rep'.format(new, new / n * 1e3)
+        print('{0:>8} {1:>20} {2:>20}'.format(n, before, after))
+
+if __name__ == '__main__':
+    main()
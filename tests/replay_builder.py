@@ -0,0 +1,189 @@
+"""Builds synthetic w3g replays for the tests.
+
+The replays are 1on1 Battle.net games of Alice (night elf) against Bob
+(orc) on Echo Isles with random actions of both players, chat messages and
+the LeftGame records at the end. They are close enough to real replays
+for the parser in w3g.py, not for Warcraft III.
+
+make_enriched_replays builds the dicts of enrich_single_replay directly,
+for the statistics tests that do not need to parse anything.
+"""
+import random
+import struct
+import zlib
+import datetime
+
+# 1.xx build numbers of the action formats the parser tells apart
+BUILDS = (6059, 6040, 4600)
+
+
+def dword(x):
+    return struct.pack('<I', x)
+
+def word(x):
+    return struct.pack('<H', x)
+
+def single(x):
+    return struct.pack('<f', x)
+
+def encode_settings(data):
+    # the game settings are stored with every seventh byte a mask of the zeros
+    out = bytearray()
+    for i in range(0, len(data), 7):
+        chunk = data[i:i+7]
+        mask = 1
+        encoded = bytearray()
+        for j, c in enumerate(chunk):
+            if c == 0:
+                encoded.append(1)
+            else:
+                mask |= 1 << (j + 1)
+                encoded.append(c)
+        out.append(mask)
+        out += encoded
+    out.append(0)
+    return bytes(out)
+
+def player_record(record_id, player_id, name, race):
+    return bytes([record_id, player_id]) + name.encode() + b'\0' + b'\x08' + dword(1234) + dword(race)
+
+ABILITIES = [b'ewsp'[::-1], b'hpea'[::-1], b'AEbl'[::-1], b'\x03\x00\r\x00']
+
+def random_action(rng, build):
+    old = build <= 6040
+    kind = rng.randrange(22)
+    flags = word(0x40) if build >= 6037 else b'\x40'
+    ability = rng.choice(ABILITIES)
+    extra = dword(0xFFFFFFFF) * 2 if build >= 6031 else b''
+    obj = struct.pack('<II', rng.randrange(1 << 30), rng.randrange(1 << 30))
+    if kind == 0:
+        return b'\x10' + flags + ability + extra
+    if kind == 1:
+        return b'\x11' + flags + ability + extra + single(rng.uniform(-9e3, 9e3)) + single(rng.uniform(-9e3, 9e3))
+    if kind == 2:
+        return b'\x12' + flags + ability + extra + single(1.5) + single(-2.5) + obj
+    if kind == 3:
+        return b'\x13' + flags + ability + extra + single(1.5) + single(-2.5) + obj + obj
+    if kind == 4:
+        return (b'\x14' + flags + ability + extra + single(1.5) + single(-2.5) + rng.choice(ABILITIES)
+                + b'\0' * 9 + single(3.0) + single(4.0))
+    if kind in (5, 6, 7):
+        n = rng.randrange(1, 4)
+        return b'\x16' + bytes([rng.choice([1, 2])]) + word(n) + obj * n
+    if kind == 8:
+        n = rng.randrange(1, 4)
+        return b'\x17' + bytes([rng.randrange(10)]) + word(n) + obj * n
+    if kind == 9:
+        return b'\x18' + bytes([rng.randrange(10)]) + b'\x03'
+    if kind == 10:
+        if build < 6040:
+            return b'\x19' + bytes([rng.choice([0, 1, 0xFF])])
+        return b'\x19' + ability + obj
+    if kind == 11:
+        return b'\x1A' if not old else b'\x61'
+    if kind == 12:
+        return (b'\x1C' if not old else b'\x1B') + b'\x00' + obj
+    if kind == 13:
+        return (b'\x1D' if not old else b'\x1C') + obj
+    if kind == 14:
+        return (b'\x1E' if not old else b'\x1D') + bytes([1]) + ability
+    if kind == 15:
+        return b'\x61'
+    if kind == 16:
+        return b'\x51' + b'\x02' + dword(100) + dword(50)
+    if kind == 17:
+        return b'\x50' + b'\x02' + b'\x1f\x00\x04\x00'
+    if kind == 18:
+        return b'\x67' if build > 4656 else b'\x66'
+    if kind == 19:
+        return b'\x60' + dword(1) + dword(2) + b'hello\0'
+    if kind == 20:
+        return b'\x03\x02'
+    return b'\x62' + b'\0' * (12 if build >= 6031 else 8)
+
+def make_replay(nslots=300, seed=0, build=6059, leave=True, gg_left=False, game_type=1, block_size=8192,
+                left_result=0x08):
+    """Returns the bytes of a replay with nslots time slots of 100 ms.
+
+    Bob leaves first and Alice wins, with gg_left Bob only says gg and
+    leaves, which is a win of Alice as well. Without leave nobody leaves
+    and the winner cannot be found. left_result is the result flag of
+    Bob's LeftGame, its meaning depends on the LeftGame after it.
+    """
+    rng = random.Random(seed)
+    d = bytearray(b'\0' * 4)
+    d += player_record(0, 1, 'Alice', 0x04)
+    d += b'BNet\0' + b'\0'
+    settings = bytes([2, 0x40 | 0x8, 0x6, 0x1, 0x1, 0x1, 0x1, 0x1, 0x1, 0x1, 0x1, 0x1, 0x1])
+    d += encode_settings(settings + b'Maps\\FrozenThrone\\(2)EchoIsles.w3x\0' + b'Battle.net\0')
+    d += dword(2) + bytes([game_type]) + b'\x00' + word(0) + dword(0x1234)
+    d += player_record(0x16, 2, 'Bob', 0x02) + dword(0)
+    slots = [bytes([1, 100, 2, 0, 0, 0, 0x04, 1, 100]), bytes([2, 100, 2, 0, 1, 1, 0x02, 1, 100])]
+    d += b'\x19' + word(4 + 3 + 9 * len(slots)) + bytes([len(slots)]) + b''.join(slots)
+    d += dword(0xdeadbeef) + b'\xcc' + b'\x02'
+    d += b'\x1A' + dword(1)
+    d += b'\x1B' + dword(1)
+    d += b'\x1C' + dword(1)
+    d += b'\x2F' + dword(0) + dword(5)
+    d += b'\x20' + b'\x01' + word(len(b'\x10glhf\0')) + b'\x10glhf\0'
+    clock = 0
+    for s in range(nslots):
+        commands = bytearray()
+        for player_id in rng.sample([1, 2], rng.randrange(0, 3)):
+            actions = b''.join(random_action(rng, build) for _ in range(rng.randrange(1, 4)))
+            commands += bytes([player_id]) + word(len(actions)) + actions
+        d += b'\x1F' + word(len(commands) + 2) + word(100) + commands
+        if s % 97 == 0:
+            chat = b'\x20' + dword(0) + b'gg\0'
+            d += b'\x20' + bytes([rng.choice([1, 2])]) + word(len(chat)) + chat
+        if s % 251 == 0:
+            d += b'\x22' + b'\x04' + dword(0)
+        clock += 100
+    if gg_left:
+        chat = b'\x20' + dword(0) + b'gg\0'
+        d += b'\x20' + b'\x02' + word(len(chat)) + chat
+        d += b'\x17' + dword(0x01) + b'\x02' + dword(0x01) + dword(5)
+    elif leave:
+        d += b'\x17' + dword(0x0C) + b'\x02' + dword(left_result) + dword(5)
+        d += b'\x17' + dword(0x01) + b'\x01' + dword(0x09) + dword(6)
+
+    nblocks = (len(d) + block_size - 1) // block_size
+    d += b'\0' * (nblocks * block_size - len(d))
+    blocks = bytearray()
+    for i in range(nblocks):
+        raw = zlib.compress(bytes(d[i*block_size:(i+1)*block_size]))
+        blocks += word(len(raw)) + word(block_size) + dword(0) + raw
+    header = bytearray(b'Warcraft III recorded game\x1A\0')
+    header += dword(0x44) + dword(0x44 + len(blocks)) + dword(1) + dword(len(d)) + dword(nblocks)
+    header += b'PX3W' + dword(26) + word(build) + word(0x8000) + dword(clock) + dword(0)
+    return bytes(header + blocks)
+
+
+RACES = ('human', 'orc', 'nightelf', 'undead', 'random')
+MAPS = ('EchoIsles', 'TurtleRock', 'TwistedMeadows', 'Amazonia')
+
+def make_enriched_replays(n, seed=0):
+    """Returns n enriched replays with random races, maps, results and times.
+
+    The apm values are multiples of 0.25, so their sums are exact in any
+    order.
+    """
+    rng = random.Random(seed)
+    replays = []
+    for i in range(n):
+        team = rng.choice([1, 1, 1, 2])
+        when = datetime.datetime(2018, 1, 1) + datetime.timedelta(minutes=rng.randrange(60 * 24 * 365))
+        replays.append({
+            'filename': '{0}.w3g'.format(i),
+            'datetime': when,
+            'hour': when.hour,
+            'weekday': when.weekday(),
+            'map': rng.choice(MAPS),
+            'length': rng.randrange(60000, 3600000),
+            'apm': rng.randrange(800) / 4,
+            'won': rng.random() < 0.5,
+            'race': rng.choice(RACES),
+            'ally_race': set(rng.sample(RACES, team - 1)),
+            'enemy_race': set(rng.sample(RACES, team)),
+        })
+    return replays
@@ -0,0 +1,74 @@
+import datetime
+
+import pytest
+
+from wc3stats import fragment_cache as dash_cache
+from wc3stats_flask import fragment_cache as flask_cache
+
+
+@pytest.fixture(params=[dash_cache, flask_cache], ids=['dash', 'flask'])
+def cache(request):
+    return request.param
+
+
+def test_stable_hash_ignores_the_insertion_order(cache):
+    races = ['orc', 'human', 'undead', 'nightelf']
+    first = {'enemy_race': set(races), 'w': 1, 'l': 2}
+    second = {'l': 2, 'w': 1, 'enemy_race': set(reversed(races))}
+    assert list(first) != list(second)
+    assert cache.stable_hash(first, 'orc') == cache.stable_hash(second, 'orc')
+    assert cache.stable_hash(first, 'orc') != cache.stable_hash(first, 'human')
+    when = datetime.datetime(2018, 9, 14)
+    assert cache.stable_hash(frozenset(races), when) == cache.stable_hash(frozenset(reversed(races)), when)
+
+
+def test_stable_hash_refuses_objects_without_a_stable_form(cache):
+    with pytest.raises(TypeError):
+        cache.stable_hash(object())
+
+
+def test_a_new_version_misses_the_cache(cache):
+    calls = []
+    def panel(stats):
+        calls.append(stats)
+        return '<div>{0}</div>'.format(stats['w'])
+
+    fragments = cache.FragmentCache(1)
+    memoized = fragments.memoize(panel)
+    memoized({'w': 1})
+    memoized({'w': 1})
+    assert len(calls) == 1
+    fragments.version = 2
+    assert memoized({'w': 1}) == '<div>1</div>'
+    assert len(calls) == 2
+    assert len(fragments) == 2
+
+def test_least_recently_used_entries_are_evicted(cache):
+    fragments = cache.FragmentCache(1, max_entries=3)
+    for key in 'abc':
+        fragments.get(key, lambda: key.upper())
+    # a is used again, b is now the least recently used
+    assert fragments.get('a', lambda: 'new') == 'A'
+    fragments.get('d', lambda: 'D')
+    assert len(fragments) == 3
+    assert list(fragments.fragments) == ['c', 'a', 'd']
+    assert fragments.get('b', lambda: 'new') == 'new'
+    assert len(fragments) == 3
+
+
+def test_a_memoized_panel_is_rendered_once(cache):
+    calls = []
+    fragments = cache.FragmentCache(1)
+
+    @fragments.memoize
+    def race_panel(stats, racekey):
+        calls.append(racekey)
+        return {'element_id': 'race-' + racekey, 'content': str(stats['w'])}
+
+    first = race_panel({'w': 3, 'enemy_race': {'orc', 'human'}}, 'nightelf')
+    again = race_panel({'enemy_race': {'human', 'orc'}, 'w': 3}, 'nightelf')
+    assert again == first
+    assert calls == ['nightelf']
+    race_panel({'w': 4, 'enemy_race': {'orc', 'human'}}, 'nightelf')
+    assert calls == ['nightelf', 'nightelf']
+    assert race_panel.__name__ == 'race_panel'
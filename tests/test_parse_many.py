@@ -0,0 +1,45 @@
+import pytest
+
+from wc3stats import replay_helper
+from replay_builder import make_replay
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.setenv('REPLAY_CACHE_PATH', '')
+
+@pytest.fixture
+def sources():
+    return [(make_replay(seed=i), '{0}.w3g'.format(i), 1500000000 + i) for i in range(4)]
+
+
+def strip(rep):
+    return {k: v for k, v in rep.items() if k != 'datetime'}
+
+
+def test_parse_many_keeps_the_order(sources):
+    sources.insert(2, (b'not a replay', 'broken.w3g', 0))
+    reps = replay_helper.parse_many(sources, workers=1)
+    assert [rep and rep['filename'] for rep in reps] == ['0.w3g', '1.w3g', None, '2.w3g', '3.w3g']
+
+
+def test_workers_match_a_single_process(sources):
+    expected = [strip(rep) for rep in replay_helper.parse_many(sources, workers=1)]
+    assert [strip(rep) for rep in replay_helper.parse_many(sources, workers=2)] == expected
+
+
+def test_parse_pool_reads_replay_workers_when_it_starts(monkeypatch, sources):
+    monkeypatch.setattr(replay_helper, '_parse_pool', None)
+    monkeypatch.setenv('REPLAY_WORKERS', '2')
+    pool = replay_helper.get_parse_pool()
+    try:
+        assert pool._max_workers == 2
+        assert replay_helper.get_parse_pool() is pool
+        expected = [strip(rep) for rep in replay_helper.parse_many(sources, workers=1)]
+        assert [strip(rep) for rep in replay_helper.parse_many(sources)] == expected
+        assert replay_helper.get_parse_pool() is pool
+        new = replay_helper.get_parse_pool(pool)
+        assert new is not pool
+        new.shutdown()
+    finally:
+        pool.shutdown()
@@ -0,0 +1,156 @@
+import io
+import os
+import sqlite3
+import types
+import itertools
+
+import pytest
+
+from wc3stats import replay_helper, sqlite_store
+from wc3stats.replay_cache import ReplayCache
+from replay_builder import make_replay
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    # every record is used at a later time, whatever the resolution of the timer
+    ticks = itertools.count(1)
+    monkeypatch.setattr(sqlite_store, 'time', types.SimpleNamespace(time=lambda: next(ticks)))
+
+@pytest.fixture
+def cache_path(tmpdir):
+    return os.path.join(str(tmpdir), 'cache', 'replays.sqlite')
+
+
+def test_get_put(cache_path):
+    cache = ReplayCache(cache_path, 1)
+    key = cache.key(b'replay')
+    with pytest.raises(KeyError):
+        cache.get(key)
+    cache.put(key, {'winner': 1, 'apm_all': {'1': 100.5}})
+    assert cache.get(key) == {'winner': 1, 'apm_all': {'1': 100.5}}
+    assert len(cache) == 1
+
+
+def test_records_survive_reopening(cache_path):
+    cache = ReplayCache(cache_path, 1)
+    cache.put('a', {'winner': 1})
+    cache.close()
+    assert ReplayCache(cache_path, 1).get('a') == {'winner': 1}
+
+
+def test_other_version_is_dropped(cache_path):
+    cache = ReplayCache(cache_path, 1)
+    cache.put('a', {'winner': 1})
+    cache.close()
+    cache = ReplayCache(cache_path, 2)
+    assert len(cache) == 0
+    with pytest.raises(KeyError):
+        cache.get('a')
+
+
+def test_replacing_a_record_keeps_the_size(cache_path):
+    cache = ReplayCache(cache_path, 1)
+    for i in range(5):
+        cache.put('a', {'name': 'x' * 100})
+    assert cache.size == cache._stored_size() == len('{"name":"' + 'x' * 100 + '"}')
+
+
+RECORD = {'name': 'x' * 100}
+SIZE = len('{"name":"' + 'x' * 100 + '"}')
+
+def test_least_recently_used_are_evicted(cache_path):
+    cache = ReplayCache(cache_path, 1, max_size=3 * SIZE)
+    for key in 'abc':
+        cache.put(key, RECORD)
+    cache.get('a')
+    cache.put('d', RECORD)
+    # evicted down to the low-water mark, 2.7 records
+    assert len(cache) == 2
+    for key in 'bc':
+        with pytest.raises(KeyError):
+            cache.get(key)
+    for key in 'ad':
+        assert cache.get(key) == RECORD
+    assert cache.size == cache._stored_size() == 2 * SIZE
+
+
+def test_eviction_runs_in_batches(cache_path, monkeypatch):
+    monkeypatch.setattr(sqlite_store, 'EVICT_BATCH', 2)
+    cache = ReplayCache(cache_path, 1, max_size=10 * SIZE)
+    for i in range(10):
+        cache.put(str(i), RECORD)
+    cache.max_size = 4 * SIZE
+    cache.put('10', RECORD)
+    # down to 3.6 records, the oldest first
+    assert len(cache) == 3
+    for key in ('8', '9', '10'):
+        assert cache.get(key) == RECORD
+
+
+def test_no_eviction_below_the_cap(cache_path, monkeypatch):
+    cache = ReplayCache(cache_path, 1, max_size=3 * SIZE)
+    cache.put('a', RECORD)
+    cache.put('b', RECORD)
+    monkeypatch.setattr(cache, '_evict', None)
+    cache.put('c', RECORD)
+    assert len(cache) == 3
+
+
+def test_stores_sharing_a_database_keep_its_cap(cache_path):
+    # e.g. the parse workers, each with its own connection
+    caches = [ReplayCache(cache_path, 1, max_size=4 * SIZE) for _ in range(3)]
+    for i in range(12):
+        caches[i % 3].put(str(i), RECORD)
+        assert caches[0]._stored_size() <= 4 * SIZE
+    # the last puts evicted the records the other stores wrote
+    assert len(caches[0]) == 4
+    for key in ('8', '9', '10', '11'):
+        assert caches[1].get(key) == RECORD
+
+
+def test_older_table_is_dropped(cache_path):
+    os.makedirs(os.path.dirname(cache_path))
+    conn = sqlite3.connect(cache_path)
+    conn.execute('CREATE TABLE replays (key TEXT PRIMARY KEY, version INTEGER, '
+                 'record TEXT, size INTEGER, used REAL)')
+    conn.execute("INSERT INTO replays VALUES ('a', 1, '{}', 2, 0)")
+    conn.commit()
+    conn.close()
+    cache = ReplayCache(cache_path, 1)
+    assert len(cache) == 0
+    cache.put('a', {'winner': 1})
+    assert cache.get('a') == {'winner': 1}
+
+
+def test_locked_database_misses(cache_path):
+    cache = ReplayCache(cache_path, 1)
+    cache.put('a', {'winner': 1})
+    cache.conn.execute('PRAGMA busy_timeout = 0')
+    other = sqlite3.connect(cache_path)
+    other.execute('BEGIN EXCLUSIVE')
+    with pytest.raises(KeyError):
+        cache.get('a')
+    assert cache.put('b', {'winner': 2}) is False
+    other.rollback()
+    other.close()
+    assert cache.get('a') == {'winner': 1}
+    assert cache.put('b', {'winner': 2}) is True
+
+
+def test_load_single_replay_uses_the_cache(cache_path, monkeypatch):
+    monkeypatch.setenv('REPLAY_CACHE_PATH', cache_path)
+    monkeypatch.setattr(replay_helper, '_replay_cache', None)
+    data = make_replay()
+    rep = replay_helper.load_single_replay(io.BytesIO(data), 'a.w3g', 0)
+    assert rep['winner'] == 1
+
+    def parse_single_replay(file):
+        raise AssertionError('parsed although it is cached')
+    monkeypatch.setattr(replay_helper, 'parse_single_replay', parse_single_replay)
+    cached = replay_helper.load_single_replay(io.BytesIO(data), 'b.w3g', 0)
+    assert cached['filename'] == 'b.w3g'
+    assert {k: v for k, v in cached.items() if k != 'filename'} == \
+           {k: v for k, v in rep.items() if k != 'filename'}
+    key = ReplayCache.key(data)
+    assert replay_helper.load_single_replay(None, 'c.w3g', 0, key)['winner'] == 1
@@ -0,0 +1,166 @@
+import os
+import sqlite3
+
+import pytest
+
+from wc3stats import replay_index
+from wc3stats.replay_index import ReplayIndex, hash_file
+
+
+def write(path, data):
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def names(files):
+    return sorted(os.path.basename(f.path) for f in files)
+
+
+@pytest.fixture
+def folder(tmpdir):
+    root = os.path.join(str(tmpdir), 'replays')
+    write(os.path.join(root, 'a.w3g'), b'a')
+    write(os.path.join(root, 'b.w3g'), b'b')
+    write(os.path.join(root, 'season', 'c.w3g'), b'c')
+    write(os.path.join(root, 'notes.txt'), b'not a replay')
+    return root
+
+@pytest.fixture
+def index(tmpdir):
+    index = ReplayIndex(os.path.join(str(tmpdir), 'index.sqlite'))
+    yield index
+    index.close()
+
+@pytest.fixture
+def hashed(monkeypatch):
+    # paths of the files hashed by the index
+    paths = []
+    def counting_hash_file(path):
+        paths.append(path)
+        return hash_file(path)
+    monkeypatch.setattr(replay_index, 'hash_file', counting_hash_file)
+    return paths
+
+
+def test_first_scan_reports_all_replays(folder, index):
+    changes = index.scan(folder)
+    assert names(changes.changed) == ['a.w3g', 'b.w3g', 'c.w3g']
+    assert changes.deleted == []
+    assert len(index) == 3
+    for f in changes.changed:
+        assert f.hash == hash_file(f.path)
+
+
+def test_rescan_only_hashes_changed_files(folder, index, hashed):
+    index.scan(folder)
+    del hashed[:]
+    assert index.scan(folder) == ([], [])
+    assert hashed == []
+
+    write(os.path.join(folder, 'a.w3g'), b'new a')
+    write(os.path.join(folder, 'd.w3g'), b'd')
+    os.remove(os.path.join(folder, 'season', 'c.w3g'))
+    changes = index.scan(folder)
+    assert names(changes.changed) == ['a.w3g', 'd.w3g']
+    assert names(changes.deleted) == ['c.w3g']
+    assert sorted(os.path.basename(path) for path in hashed) == ['a.w3g', 'd.w3g']
+    assert names(index.files(folder)) == ['a.w3g', 'b.w3g', 'd.w3g']
+
+
+def test_touched_file_with_same_content_is_not_reported(folder, index):
+    index.scan(folder)
+    path = os.path.join(folder, 'a.w3g')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert index.scan(folder) == ([], [])
+
+
+def test_young_files_are_left_for_the_next_scan(folder, index):
+    index.scan(folder)
+    write(os.path.join(folder, 'e.w3g'), b'still written')
+    write(os.path.join(folder, 'a.w3g'), b'still written too')
+    assert index.scan(folder, min_age=60) == ([], [])
+    assert names(index.scan(folder).changed) == ['a.w3g', 'e.w3g']
+
+
+def test_unreadable_file_is_kept(folder, index, monkeypatch):
+    index.scan(folder)
+    path = os.path.join(folder, 'a.w3g')
+    write(path, b'locked by the game')
+
+    def locked_hash_file(p):
+        if p == path:
+            raise OSError('locked')
+        return hash_file(p)
+    monkeypatch.setattr(replay_index, 'hash_file', locked_hash_file)
+    assert index.scan(folder) == ([], [])
+    assert names(index.files(folder)) == ['a.w3g', 'b.w3g', 'c.w3g']
+
+    monkeypatch.setattr(replay_index, 'hash_file', hash_file)
+    assert names(index.scan(folder).changed) == ['a.w3g']
+
+
+def test_scans_are_committed_in_batches(folder, index, monkeypatch):
+    monkeypatch.setattr(replay_index, 'HASH_BATCH', 2)
+    visible = []
+    def peeking_hash_file(path):
+        conn = sqlite3.connect(index.path)
+        visible.append(conn.execute('SELECT COUNT(*) FROM files').fetchone()[0])
+        conn.close()
+        return hash_file(path)
+    monkeypatch.setattr(replay_index, 'hash_file', peeking_hash_file)
+    index.scan(folder)
+    assert visible == [0, 0, 2]
+
+
+def test_failed_scan_is_reported_again(folder, index, monkeypatch):
+    monkeypatch.setattr(replay_index, 'HASH_BATCH', 1)
+    def failing_hash_file(path):
+        if path.endswith('c.w3g'):
+            raise RuntimeError('scan failed')
+        return hash_file(path)
+    monkeypatch.setattr(replay_index, 'hash_file', failing_hash_file)
+    with pytest.raises(RuntimeError):
+        index.scan(folder)
+
+    monkeypatch.setattr(replay_index, 'hash_file', hash_file)
+    assert names(index.scan(folder).changed) == ['a.w3g', 'b.w3g', 'c.w3g']
+
+
+def test_folders_are_scanned_separately(folder, index, tmpdir):
+    other = os.path.join(str(tmpdir), 'other')
+    write(os.path.join(other, 'x.w3g'), b'x')
+    index.scan(folder)
+    assert names(index.scan(other).changed) == ['x.w3g']
+    # the replays of the first folder are not deleted by the scan of the other
+    assert index.scan(folder) == ([], [])
+    assert len(index) == 4
+
+
+def test_files_of_an_unlisted_folder_are_kept(folder, index, monkeypatch):
+    index.scan(folder)
+    season = os.path.join(folder, 'season')
+    scandir = os.scandir
+    def failing_scandir(path):
+        if path == season:
+            raise PermissionError('access denied')
+        return scandir(path)
+    monkeypatch.setattr(os, 'scandir', failing_scandir)
+    os.remove(os.path.join(folder, 'b.w3g'))
+    changes = index.scan(folder)
+    assert names(changes.deleted) == ['b.w3g']
+    assert names(index.files(folder)) == ['a.w3g', 'c.w3g']
+
+    monkeypatch.setattr(os, 'scandir', scandir)
+    assert index.scan(folder) == ([], [])
+
+
+def test_unlisted_root_keeps_all_files(folder, index, monkeypatch):
+    index.scan(folder)
+    def failing_scandir(path):
+        raise PermissionError('access denied')
+    monkeypatch.setattr(os, 'scandir', failing_scandir)
+    assert index.scan(folder) == ([], [])
+    assert len(index) == 3
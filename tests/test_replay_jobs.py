@@ -0,0 +1,113 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from wc3stats import replay_jobs as dash_jobs, replay_helper as dash_helper
+from wc3stats_flask import replay_jobs as flask_jobs, replay_helper as flask_helper
+from replay_builder import make_replay
+
+
+@pytest.fixture(params=[(dash_jobs, dash_helper), (flask_jobs, flask_helper)], ids=['dash', 'flask'])
+def jobs(request, monkeypatch):
+    # a pool of one worker for each test, the shared one is left alone
+    jobs, helper = request.param
+    monkeypatch.setenv('REPLAY_CACHE_PATH', '')
+    monkeypatch.setenv('REPLAY_WORKERS', '1')
+    monkeypatch.setattr(helper, '_parse_pool', None)
+    yield jobs
+    if helper._parse_pool is not None:
+        helper._parse_pool.shutdown()
+
+def wait(job, timeout=30):
+    end = time.time() + timeout
+    while not job.done:
+        assert time.time() < end, 'the job did not finish'
+        time.sleep(0.01)
+
+
+def test_a_replay_of_an_earlier_start_is_ignored(jobs, monkeypatch):
+    futures = []
+    def submit(source):
+        futures.append(Future())
+        return futures[-1]
+    monkeypatch.setattr(jobs, '_submit', submit)
+    job = jobs.ReplayJob('job')
+    job.add(b'replay', 'old.w3g', 0)
+    job.start(total=1)
+    assert job.generation == 2
+    job.add(b'replay', 'new.w3g', 0)
+    job.close()
+    futures[1].set_result({'filename': 'new.w3g'})
+    # the late result of the first upload
+    futures[0].set_result({'filename': 'old.w3g'})
+    assert job.done
+    assert job.replays == [{'filename': 'new.w3g'}]
+    assert (job.received, job.parsed, job.failed) == (1, 1, 0)
+
+
+def test_unparsable_uploads_count_as_failed(jobs):
+    job = jobs.ReplayJob('job')
+    job.add(make_replay(), 'good.w3g', 1500000000)
+    job.add(b'not a replay', 'broken.w3g', 1500000000)
+    job.close()
+    wait(job)
+    assert (job.parsed, job.failed) == (2, 1)
+    assert [rep['filename'] for rep in job.replays] == ['good.w3g']
+
+
+def test_done_after_close_and_all_parses(jobs):
+    job = jobs.ReplayJob('job')
+    job.add(make_replay(seed=1), '1.w3g', 1500000000)
+    job.add(make_replay(seed=2), '2.w3g', 1500000000)
+    end = time.time() + 30
+    while job.parsed < 2:
+        assert time.time() < end, 'the replays were not parsed'
+        time.sleep(0.01)
+    # more files of the upload may come
+    assert not job.done
+    job.close()
+    assert job.done
+    assert len(job.replays) == 2
+
+
+def test_take_update_once_per_version_or_view(jobs):
+    job = jobs.ReplayJob('job')
+    assert not job.take_update()
+    job.close()
+    assert job.take_update()
+    assert not job.take_update()
+    assert job.take_update(('Alice',))
+    assert not job.take_update(('Alice',))
+    assert job.take_update(('Bob',))
+    job._parsed(job.generation, None)
+    assert job.take_update(('Bob',))
+    assert not job.take_update(('Bob',))
+
+
+def test_status_eta_and_done(jobs, monkeypatch):
+    futures = []
+    def submit(source):
+        futures.append(Future())
+        return futures[-1]
+    monkeypatch.setattr(jobs, '_submit', submit)
+    job = jobs.ReplayJob('job')
+    job.start(total=4)
+    status = job.status()
+    assert status['eta'] is None and not status['done']
+
+    for i in range(4):
+        job.add(b'replay', '{0}.w3g'.format(i), 0)
+    job.started -= 10
+    futures[0].set_result({'filename': '0.w3g'})
+    status = job.status()
+    # ten seconds for one replay, three to go
+    assert status['eta'] == pytest.approx(30, abs=0.5)
+    assert (status['total'], status['received'], status['parsed'], status['done']) == (4, 4, 1, False)
+
+    job.close()
+    for future in futures[1:]:
+        future.set_result(None)
+    status = job.status()
+    assert status['eta'] == 0 and status['done']
+    assert status['failed'] == 3
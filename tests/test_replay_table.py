@@ -0,0 +1,126 @@
+import pytest
+
+from wc3stats.replay_handler import ShownStats
+from wc3stats.replay_helper import StatsAggregator, compute_stats, replay_match
+from wc3stats.replay_table import ReplayTable, bitmap_rows, length_bucket
+from replay_builder import make_enriched_replays
+
+
+FILTERS = [
+    {},
+    {'race': {'orc'}},
+    {'race': {'human', 'undead'}, 'won': True},
+    {'maps': {'EchoIsles'}},
+    {'maps': {'TurtleRock', 'Amazonia'}, 'won': False},
+    {'enemy_race': {'nightelf'}},
+    {'enemy_race': {'orc', 'human'}},
+    {'ally_race': {'random'}},
+    {'ally_race': set(), 'enemy_race': set()},
+    {'race': {'nightelf'}, 'maps': {'EchoIsles'}, 'enemy_race': {'undead'}, 'won': True},
+    {'race': {'nobody'}},
+]
+
+
+@pytest.fixture
+def replays():
+    return make_enriched_replays(400)
+
+
+def matching(replays, race=None, maps=None, ally_race=None, enemy_race=None, won=None):
+    return [i for i, rep in enumerate(replays) if replay_match(rep, race, maps, ally_race, enemy_race, won)]
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_select_matches_replay_match(replays, filters):
+    table = ReplayTable(replays)
+    assert list(table.select(**filters)) == matching(replays, **filters)
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_bitmaps_match_replay_match(replays, filters):
+    table = ReplayTable(replays)
+    expected = matching(replays, **filters)
+    assert bitmap_rows(table.select_bitmap(**filters)) == expected
+    assert table.count(**filters) == len(expected)
+
+
+def test_bitmap_index_has_one_bitset_per_code(replays):
+    table = ReplayTable(replays)
+    bitsets = table.bitmaps('map')
+    assert len(bitsets) == len(table.labels['map'])
+    for mapname, bitset in zip(table.labels['map'], bitsets):
+        assert bitmap_rows(bitset) == [i for i, rep in enumerate(replays) if rep['map'] == mapname]
+    assert [bitmap_rows(b) for b in table.bitmaps('won')] == \
+           [[i for i, rep in enumerate(replays) if rep['won'] == won] for won in (False, True)]
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_appended_rows_are_indexed(replays, filters):
+    table = ReplayTable(replays[:100])
+    # builds the bitmap indexes of the first rows
+    table.select(race={'orc'}, maps={'EchoIsles'}, ally_race=set(), enemy_race={'human'}, won=True)
+    for rep in replays[100:]:
+        table.append(rep)
+    expected = matching(replays, **filters)
+    assert list(table.select(**filters)) == expected
+    assert table.count(**filters) == len(expected)
+
+
+def test_group_by_sums_the_rows_of_every_group(replays):
+    table = ReplayTable(replays)
+    columns = ('race', 'map', 'won', 'length_bucket')
+    expected = {}
+    for rep in replays:
+        key = (rep['race'], rep['map'], int(rep['won']), length_bucket(rep['length']))
+        g = expected.setdefault(key, [0, 0, 0.0])
+        g[0] += 1
+        g[1] += rep['length']
+        g[2] += rep['apm']
+    groups = table.group_by(columns)
+    assert groups == expected
+    # in the order of their first row
+    assert list(groups) == list(expected)
+
+
+def test_group_by_of_selected_rows(replays):
+    table = ReplayTable(replays)
+    rows = table.select(race={'orc'}, won=False)
+    groups = table.group_by(('enemy_race', 'hour'), rows)
+    assert sum(n for n, length, apm in groups.values()) == len(rows)
+    for (enemy_race, hour), (n, length, apm) in groups.items():
+        reps = [replays[i] for i in rows if replays[i]['enemy_race'] == enemy_race and replays[i]['hour'] == hour]
+        assert [n, length, apm] == [len(reps), sum(r['length'] for r in reps), sum(r['apm'] for r in reps)]
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_from_table_matches_adding_row_by_row(replays, filters):
+    agg = StatsAggregator()
+    for i in matching(replays, **filters):
+        agg.add(replays[i])
+    expected = agg.to_dict()
+    table = ReplayTable(replays)
+    assert StatsAggregator.from_table(table, table.select(**filters)).to_dict() == expected
+    assert compute_stats(replays, **filters) == expected
+
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'race': 'orc'},
+    {'enemy_race': 'human', 'result': 'won'},
+    {'race': 'nightelf', 'mapname': 'TurtleRock', 'result': 'lost'},
+    {'mapname': 'EchoIsles', 'enemy_race': 'undead'},
+])
+def test_shown_stats_select_matches_replay_match(replays, filters):
+    shown = ShownStats({}, replays)
+    race, enemy_race = filters.get('race'), filters.get('enemy_race')
+    mapname, result = filters.get('mapname'), filters.get('result')
+    expected = [replays[i] for i in matching(
+        replays,
+        race={race} if race else None,
+        maps={mapname} if mapname else None,
+        enemy_race={enemy_race} if enemy_race else None,
+        won=(result == 'won') if result else None,
+    )]
+    assert shown.select(**filters) == expected
+    # the second time from the table built by the first
+    assert shown.select(**filters) == expected
@@ -0,0 +1,16 @@
+import os
+
+from wc3stats_flask.session_store import SessionStore
+
+
+def test_sessions_are_evicted_but_the_one_just_written(tmpdir):
+    store = SessionStore(os.path.join(str(tmpdir), 'sessions.sqlite'), max_size=100)
+    assert store.put('a', {'player_name': 'x' * 40})
+    assert store.put('b', {'player_name': 'x' * 40})
+    # over the cap alone, it is kept anyway
+    assert store.put('c', {'player_name': 'x' * 200})
+    assert len(store) == 1
+    assert store.get('c') == {'player_name': 'x' * 200}
+    store.delete('c')
+    assert len(store) == 0
+    assert store.size == 0
@@ -0,0 +1,156 @@
+import pytest
+
+from wc3stats.replay_helper import StatsAggregator, get_empty_stats_dict, format_length, replay_match
+from replay_builder import make_enriched_replays
+
+
+@pytest.fixture
+def replays():
+    return make_enriched_replays(500)
+
+
+def aggregate(replays):
+    agg = StatsAggregator()
+    for rep in replays:
+        agg.add(rep)
+    return agg
+
+
+# compute_stats before StatsAggregator, it keeps floored averages and
+# floors them again with every replay; the enemy races are joined sorted
+# as in StatsAggregator, it joined them in the order of the set
+def baseline_compute_stats_single_replay(rep, stats):
+    n = stats['w'] + stats['l']
+    hour = stats['hours'][str(rep['hour'])]
+    day = stats['days'][str(rep['weekday'])]
+    temp_length = stats['avg_len'] * n + rep['length']
+    temp_apm = stats['apm'] * n + rep['apm']
+    temp_apm_hour = hour['apm'] * (hour['w'] + hour['l']) + rep['apm']
+    temp_apm_day = day['apm'] * (day['w'] + day['l']) + rep['apm']
+
+    wl_string = 'w' if rep['won'] else 'l'
+    stats[wl_string] += 1
+    hour[wl_string] += 1
+    day[wl_string] += 1
+    if rep['length'] < 600000:
+        bucket = stats['0to10']
+    elif rep['length'] < 1200000:
+        bucket = stats['10to20']
+    elif rep['length'] < 1800000:
+        bucket = stats['20to30']
+    else:
+        bucket = stats['30up']
+    bucket[wl_string] += 1
+    bucket['p'] = round(bucket['w'] / (bucket['w'] + bucket['l']), 2)
+
+    stats['avg_len'] = temp_length // (stats['w'] + stats['l'])
+    stats['avg_length'] = format_length(stats['avg_len'])
+    stats['p'] = round(stats['w'] / (stats['w'] + stats['l']), 2)
+    hour['p'] = round(hour['w'] / (hour['w'] + hour['l']), 2)
+    day['p'] = round(day['w'] / (day['w'] + day['l']), 2)
+    stats['apm'] = temp_apm // (stats['w'] + stats['l'])
+    hour['apm'] = temp_apm_hour // (hour['w'] + hour['l'])
+    day['apm'] = temp_apm_day // (day['w'] + day['l'])
+
+    enemy_race_string = ', '.join(sorted(rep['enemy_race']))
+    if 'race' in stats:
+        if enemy_race_string not in stats['race']:
+            stats['race'][enemy_race_string] = get_empty_stats_dict(True)
+            stats['race'][enemy_race_string]['enemy_race'] = rep['enemy_race']
+        baseline_compute_stats_single_replay(rep, stats['race'][enemy_race_string])
+    if 'map' in stats and not isinstance(stats['map'], str):
+        if rep['map'] not in stats['map']:
+            stats['map'][rep['map']] = get_empty_stats_dict(True)
+        baseline_compute_stats_single_replay(rep, stats['map'][rep['map']])
+    if 'race_on_map' in stats:
+        race_on_map_string = enemy_race_string + " on " + rep['map']
+        if race_on_map_string not in stats['race_on_map']:
+            stats['race_on_map'][race_on_map_string] = get_empty_stats_dict(True)
+            stats['race_on_map'][race_on_map_string]['map'] = rep['map']
+            stats['race_on_map'][race_on_map_string]['enemy_race'] = rep['enemy_race']
+        baseline_compute_stats_single_replay(rep, stats['race_on_map'][race_on_map_string])
+
+def baseline_compute_stats(replays):
+    stats = {}
+    for rep in replays:
+        if rep['race'] not in stats:
+            stats[rep['race']] = get_empty_stats_dict()
+        baseline_compute_stats_single_replay(rep, stats[rep['race']])
+    return stats
+
+
+AVERAGES = ('apm', 'avg_len', 'avg_length')
+
+def without_averages(stats):
+    if not isinstance(stats, dict):
+        return stats
+    return {k: without_averages(v) for k, v in stats.items() if k not in AVERAGES}
+
+def stats_dicts(stats):
+    # every stats dict of compute_stats with a filter of its replays
+    def enemies(rep):
+        return ', '.join(sorted(rep['enemy_race']))
+    for race, d in stats.items():
+        yield d, lambda rep, race=race: rep['race'] == race
+        for name, sub in d['race'].items():
+            yield sub, lambda rep, race=race, e=name: rep['race'] == race and enemies(rep) == e
+        for name, sub in d['map'].items():
+            yield sub, lambda rep, race=race, m=name: rep['race'] == race and rep['map'] == m
+        for name, sub in d['race_on_map'].items():
+            yield sub, lambda rep, race=race, e=name: rep['race'] == race and enemies(rep) + ' on ' + rep['map'] == e
+
+
+def test_matches_the_baseline_but_for_the_averages(replays):
+    stats = aggregate(replays).to_dict()
+    assert without_averages(stats) == without_averages(baseline_compute_stats(replays))
+
+
+def test_averages_are_floored_once(replays):
+    # the baseline floored the running averages with every replay
+    for stats, match in stats_dicts(aggregate(replays).to_dict()):
+        reps = [rep for rep in replays if match(rep)]
+        assert stats['w'] + stats['l'] == len(reps)
+        assert stats['apm'] == sum(rep['apm'] for rep in reps) // len(reps)
+        assert stats['avg_len'] == sum(rep['length'] for rep in reps) // len(reps)
+        assert stats['avg_length'] == format_length(stats['avg_len'])
+        for hour in range(24):
+            apms = [rep['apm'] for rep in reps if rep['hour'] == hour]
+            assert stats['hours'][str(hour)]['apm'] == (sum(apms) // len(apms) if apms else 0)
+        for day in range(7):
+            apms = [rep['apm'] for rep in reps if rep['weekday'] == day]
+            assert stats['days'][str(day)]['apm'] == (sum(apms) // len(apms) if apms else 0)
+
+
+def test_merged_parts_match_a_single_pass(replays):
+    expected = aggregate(replays).to_dict()
+    parts = [aggregate(replays[i::3]) for i in range(3)]
+    assert parts[0].merge(parts[1]).merge(parts[2]).to_dict() == expected
+    assert StatsAggregator().merge(aggregate(replays)).to_dict() == expected
+
+
+def test_removed_replays_match_a_recompute(replays):
+    agg = aggregate(replays)
+    for rep in replays[::4]:
+        agg.remove(rep)
+    kept = [rep for i, rep in enumerate(replays) if i % 4]
+    assert agg.to_dict() == aggregate(kept).to_dict()
+
+
+def test_equal_enemy_races_share_their_stats():
+    # equal sets, they may iterate in different orders
+    first, second = {'undead', 'random'}, {'random', 'undead'}
+    replays = make_enriched_replays(2)
+    replays[0].update(race='orc', enemy_race=first)
+    replays[1].update(race='orc', enemy_race=second)
+    stats = aggregate(replays).to_dict()
+    assert list(stats['orc']['race']) == ['random, undead']
+
+
+def test_removing_every_replay_of_a_race_drops_it(replays):
+    agg = aggregate(replays)
+    for rep in replays:
+        if replay_match(rep, {'orc'}, None, None, None, None):
+            agg.remove(rep)
+    stats = agg.to_dict()
+    assert 'orc' not in stats
+    assert stats == aggregate([rep for rep in replays if rep['race'] != 'orc']).to_dict()
@@ -0,0 +1,159 @@
+import io
+import sys
+import itertools
+
+import pytest
+
+from wc3stats import w3g
+from wc3stats.w3g import File, LeftGame
+from replay_builder import BUILDS, make_replay
+
+
+def parse(data, **kwargs):
+    return File(io.BytesIO(data), **kwargs)
+
+def event_rows(events):
+    return [(str(e), e.time, e.apm, getattr(e, 'player_id', 0)) for e in events]
+
+
+@pytest.fixture(params=BUILDS)
+def replay(request):
+    # small blocks, so events and actions are split over several of them
+    return make_replay(600, seed=request.param, build=request.param, block_size=1024)
+
+
+def test_events_false_reads_startup_only(replay):
+    full = parse(replay)
+    f = parse(replay, events=False)
+    assert f.events == []
+    assert f.clock == 0
+    assert (f.game_name, f.map_name, f.game_type) == (full.game_name, full.map_name, full.game_type)
+    assert [p.name for p in f.players] == [p.name for p in full.players]
+    assert [(sr.player_id, sr.team, sr.race) for sr in f.slot_records] == \
+           [(sr.player_id, sr.team, sr.race) for sr in full.slot_records]
+
+
+@pytest.mark.parametrize('kwargs', [{'events': False}, {'lazy': True}])
+def test_startup_record_split_over_tiny_blocks(kwargs):
+    # every block boundary falls somewhere inside the startup record once
+    for block_size in range(8, 160):
+        replay = make_replay(20, block_size=block_size)
+        full = parse(replay)
+        f = parse(replay, **kwargs)
+        assert [(p.name, p.race) for p in f.players] == [(p.name, p.race) for p in full.players]
+        assert (f.map_name, f.num_start_positions) == (full.map_name, full.num_start_positions)
+        assert f.slot_records == full.slot_records
+
+
+def test_lazy_matches_full_parse(replay):
+    full = parse(replay)
+    f = parse(replay, lazy=True)
+    assert f.events is None
+    assert event_rows(f.iter_events()) == event_rows(full.events)
+    assert f.clock == full.clock == full.replay_length
+    assert f.player_apm() == full.player_apm()
+    assert f.winner() == full.winner()
+    assert f.timeseries_actions() == full.timeseries_actions()
+
+
+def test_lazy_clock_after_partial_iteration(replay):
+    full = parse(replay)
+    f = parse(replay, lazy=True)
+    list(itertools.islice(f.iter_events(), 50))
+    assert f.clock == 0
+    list(f.iter_events())
+    assert f.clock == full.clock
+
+
+@pytest.mark.parametrize('left_result', [0x07, 0x08, 0x0A, 0x0B])
+def test_lazy_left_game_results(left_result):
+    # the result of a LeftGame is only final once the next one was read
+    replay = make_replay(left_result=left_result)
+    full = parse(replay)
+    f = parse(replay, lazy=True)
+    results = [e.result() for e in list(f.iter_events()) if isinstance(e, LeftGame)]
+    assert results == [e.result() for e in full.events if isinstance(e, LeftGame)]
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'lazy': True}])
+def test_winner(kwargs):
+    assert parse(make_replay(), **kwargs).winner() == 1
+    assert parse(make_replay(gg_left=True), **kwargs).winner() == 1
+    with pytest.raises(RuntimeError):
+        parse(make_replay(leave=False), **kwargs).winner()
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'gg_left': True}, {'left_result': 0x07}, {'left_result': 0x0A}])
+def test_main_prints_the_events_of_a_full_parse(tmpdir, monkeypatch, capsys, kwargs):
+    data = make_replay(**kwargs)
+    path = tmpdir.join('replay.w3g')
+    path.write_binary(data)
+    monkeypatch.setattr(sys, 'argv', ['w3g', str(path)])
+    parses = []
+    iter_parse = File._iter_parse
+    def counting_iter_parse(f):
+        parses.append(f)
+        return iter_parse(f)
+    monkeypatch.setattr(File, '_iter_parse', counting_iter_parse)
+    w3g.main()
+    lines = capsys.readouterr()[0].splitlines()
+    assert len(parses) == 1
+    full = parse(data)
+    events = [str(e) for e in full.events]
+    # a LeftGame comes out once the next one has been read
+    left = [str(e) for e in full.events if isinstance(e, LeftGame)]
+    assert sorted(lines[:len(events)]) == sorted(events)
+    assert [l for l in lines[:len(events)] if l in left] == left
+    assert [l for l in lines[:len(events)] if l not in left] == [e for e in events if e not in left]
+    full.print_apm()
+    apm = capsys.readouterr()[0].splitlines()
+    assert lines[len(events):-2] == apm
+    assert lines[-1] == 'The winner is Alice'
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'lazy': True}])
+def test_counted_iteration_matches_apm_only(replay, kwargs):
+    f = parse(replay, **kwargs)
+    events = list(f.iter_events(count=True))
+    assert [str(e) for e in events] == [str(e) for e in parse(replay).events]
+    expected = parse(replay, apm_only=True)
+    assert f.apm_counts == expected.apm_counts
+    assert f.player_apm() == expected.player_apm()
+    assert f.winner() == expected.winner()
+
+
+def test_columnar_matches_full_parse(replay):
+    full = parse(replay)
+    f = parse(replay, columnar=True)
+    assert f.events is None
+    columns = f.columns
+    assert len(columns) == len(full.events)
+    assert list(columns.time) == [e.time for e in full.events]
+    assert list(columns.player_id) == [getattr(e, 'player_id', 0) for e in full.events]
+    assert [bool(apm) for apm in columns.apm] == [bool(e.apm) for e in full.events]
+    assert [columns.ability_id(i) for i in range(len(columns))] == \
+           [getattr(e, 'ability', None) for e in full.events]
+    assert f.clock == full.clock
+
+
+def test_columnar_files_keep_no_events():
+    with pytest.raises(ValueError):
+        parse(make_replay(), columnar=True).iter_events()
+
+
+def test_apm_only_matches_full_parse(replay):
+    full = parse(replay)
+    f = parse(replay, apm_only=True)
+    assert f.events is None
+    assert f.clock == full.clock
+    assert f.player_apm() == full.player_apm()
+    assert f.winner() == full.winner()
+
+
+def test_apm_only_winner():
+    assert parse(make_replay(), apm_only=True).winner() == 1
+    assert parse(make_replay(gg_left=True), apm_only=True).winner() == 1
+    with pytest.raises(RuntimeError):
+        parse(make_replay(leave=False), apm_only=True).winner()
+    with pytest.raises(ValueError):
+        parse(make_replay(), apm_only=True).iter_events()
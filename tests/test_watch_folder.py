@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+
+import pytest
+
+from wc3stats import replay_handler, replay_helper, replay_watcher
+from wc3stats.replay_watcher import ReplayWatcher, LAST_REPLAY
+from replay_builder import make_replay
+
+
+@pytest.fixture(autouse=True)
+def index(tmpdir, monkeypatch):
+    monkeypatch.setenv('REPLAY_CACHE_PATH', '')
+    monkeypatch.setenv('REPLAY_INDEX_PATH', os.path.join(str(tmpdir), 'index.sqlite'))
+    monkeypatch.setattr(replay_helper, '_replay_index', None)
+    monkeypatch.setattr(replay_handler, 'folder_watchers', {})
+    yield
+    for watcher in replay_handler.folder_watchers.values():
+        watcher.stop()
+
+
+def test_switching_folders_stops_the_previous_watcher(tmpdir):
+    first, second = str(tmpdir.mkdir('first')), str(tmpdir.mkdir('second'))
+    watcher = replay_handler.watch_folder(first, ['Alice'])
+    assert replay_handler.watch_folder(first, ['Alice']) is watcher
+    assert watcher._thread is not None
+
+    other = replay_handler.watch_folder(second, ['Alice'])
+    assert other is not watcher
+    assert watcher._thread is None
+    assert replay_handler.get_folder_watcher(first) is None
+    assert replay_handler.get_folder_watcher(second) is other
+
+
+def test_the_first_scan_runs_outside_the_folder_lock(tmpdir, monkeypatch):
+    folder = str(tmpdir.mkdir('replays'))
+    scanning, release = threading.Event(), threading.Event()
+    def slow_load_folder(root, index, replays, min_age, progress):
+        progress(1, 3)
+        scanning.set()
+        assert release.wait(10)
+        return {}, [], []
+    monkeypatch.setattr(replay_watcher, 'load_folder', slow_load_folder)
+
+    watcher = replay_handler.watch_folder(folder, ['Alice'])
+    assert scanning.wait(10)
+    # the polls of the page find the watcher while it is still scanning
+    assert replay_handler.get_folder_watcher(folder) is watcher
+    assert not watcher.loaded
+    assert watcher.progress == (1, 3)
+    release.set()
+    end = time.time() + 10
+    while not watcher.loaded:
+        assert time.time() < end, 'the first scan was not applied'
+        time.sleep(0.01)
+    # an empty folder is shown as well
+    assert watcher.take_update()
+
+
+def write_replay(folder, name, seed, mtime):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(make_replay(seed=seed))
+    # a new mtime, the index may not see a rewrite within the same tick
+    os.utime(path, (mtime, mtime))
+    return path
+
+@pytest.fixture
+def watcher(tmpdir, monkeypatch):
+    monkeypatch.setenv('REPLAY_WORKERS', '1')
+    folder = str(tmpdir.mkdir('replays'))
+    watcher = ReplayWatcher(folder, ['Alice'], min_age=0)
+    yield watcher
+    watcher.index.close()
+
+def games(watcher):
+    _, rep_list = watcher.stats()
+    return len(rep_list)
+
+
+def test_adding_and_deleting_a_file_updates_the_stats(watcher):
+    assert not watcher.update()
+    assert games(watcher) == 0
+
+    first = write_replay(watcher.root, 'first.w3g', 1, 1500000000)
+    write_replay(watcher.root, 'second.w3g', 2, 1500000100)
+    assert watcher.update()
+    assert games(watcher) == 2
+    assert watcher.progress == (2, 2)
+    assert not watcher.update()
+
+    os.remove(first)
+    assert watcher.update()
+    stats, rep_list = watcher.stats()
+    assert [rep['filename'] for rep in rep_list] == ['second.w3g']
+    assert stats['nightelf']['w'] == 1
+
+
+def test_overwriting_the_last_replay_keeps_the_earlier_game(watcher):
+    write_replay(watcher.root, LAST_REPLAY, 1, 1500000000)
+    watcher.update()
+    write_replay(watcher.root, LAST_REPLAY, 2, 1500000100)
+    assert watcher.update()
+    assert games(watcher) == 2
+
+    # every earlier game stays in the stats
+    write_replay(watcher.root, LAST_REPLAY, 3, 1500000200)
+    watcher.update()
+    assert games(watcher) == 3
+
+
+def test_identical_content_under_two_names_is_counted_once(watcher):
+    write_replay(watcher.root, LAST_REPLAY, 1, 1500000000)
+    watcher.update()
+    # the user saves the last game under its own name
+    write_replay(watcher.root, 'saved.w3g', 1, 1500000050)
+    watcher.update()
+    assert games(watcher) == 1
+
+    write_replay(watcher.root, LAST_REPLAY, 2, 1500000100)
+    watcher.update()
+    assert games(watcher) == 2
+    os.remove(os.path.join(watcher.root, 'saved.w3g'))
+    watcher.update()
+    assert games(watcher) == 1
+
+
+def test_take_update_stats_match_compute_stats(watcher):
+    paths = [write_replay(watcher.root, '{0}.w3g'.format(i), i, 1500000000 + 3600 * i) for i in range(5)]
+    watcher.update()
+    assert watcher.take_update()
+    assert not watcher.take_update()
+
+    os.remove(paths[0])
+    watcher.update()
+    assert watcher.take_update()
+    sources = [(p, os.path.basename(p), os.stat(p).st_mtime_ns / 1e9) for p in paths[1:]]
+    er = replay_helper.enrich_replay_data(replay_helper.parse_many(sources, workers=1), ['Alice'])
+    expected = replay_helper.compute_stats(er)
+    replay_helper.stats_post_processing(expected)
+    stats, rep_list = watcher.stats()
+    assert stats == expected
+    assert rep_list == replay_helper.get_replay_list(er)
@@ -1,15 +1,19 @@
 import os
+import json
+import time
 import random, threading, webbrowser
-from .replay_handler import load_replay, get_statistics
-from .stats_layouter import get_stats_layout, ALL_RACES, ALL_MAPS
-from .callbacks import create_full_game_list_tab_callback, create_mainrace_tab_callback, create_total_tab_callback, create_race_tab_callback, create_map_tab_callback, create_race_tab_dropdown_callback, create_map_tab_dropdown_callback
+from .replay_handler import get_statistics, watch_folder, get_folder_watcher, store_stats, parse_aliases
+from .replay_jobs import create_job, get_job
+from .stats_layouter import get_stats_layout
+from .callbacks import render_tab, render_race_tab, render_race_panel, render_map_panel, render_game_list
 import dash_core_components as dcc
 import dash_html_components as html
 import plotly.plotly as py
 import plotly.graph_objs as go
-from flask import Flask
+from flask import Flask, request, abort, jsonify
 from dash import Dash
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from dotenv import load_dotenv
 from .exceptions import ImproperlyConfigured
 
@@ -37,6 +41,41 @@ try:
 except KeyError:
     raise ImproperlyConfigured("SECRET KEY not set in .env:")
 
+# replays are uploaded one per request
+server.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+
+@server.route('/replays/<job_id>', methods=['POST'])
+def upload_replays(job_id):
+    # replays of the page's job, parsed in the background
+    job = get_job(job_id)
+    if job is None:
+        abort(404)
+    dates = json.loads(request.form.get('dates', '{}'))
+    for replay_file in request.files.getlist('replays'):
+        timestamp = dates.get(replay_file.filename, time.time() * 1000)
+        job.add(replay_file.read(), replay_file.filename, timestamp/1000.0)
+    return jsonify(job.status())
+
+@server.route('/replays/<job_id>/<action>', methods=['POST'])
+def upload_replays_action(job_id, action):
+    job = get_job(job_id)
+    if job is None:
+        abort(404)
+    if action == 'start':
+        # the number of replays to come, sent by upload.js
+        try:
+            total = int(request.form['total'])
+        except (KeyError, ValueError):
+            abort(400)
+        if total < 0:
+            abort(400)
+        job.start(total)
+    elif action == 'done':
+        job.close()
+    else:
+        abort(404)
+    return jsonify(job.status())
+
 metas = [
    {'name': 'viewport', 'content': 'width=device-width, initial-scale=1, shrink-to-fit=no'},
 ]
@@ -66,6 +105,10 @@ external_css = [
 
 theme = {"font-family": "Raleway", "background-color": "#e0e0e0"}
 
+# set by run() when the app runs on the user's machine, replays are then
+# read from a folder on disk instead of being uploaded by the browser
+local_mode = False
+
 def create_header():
     header_style = {"background-color": theme["background-color"], "padding": "1.5rem"}
     header = html.Header(html.H3(children=app_name + " - Analyze your Warcraft 3 Replays", style=header_style))
@@ -88,30 +131,12 @@ def create_content():
                     html.Div(
                         children=[
                             #html.Label("Player Name", htmlFor="aliases"),
-                            html.Small("Please enter name of the main player in the replays", className="form-text, text-muted"),
+                            html.Small("Please enter name of the main player in the replays, separate several names with commas", className="form-text, text-muted"),
                             dcc.Input(id='aliases', value='', type='text', placeholder='',className="form-control"),
                         ],
                         className="form-group",
                     ),
-                    dcc.Upload(
-                        id='replayUpload',
-                        children=html.Div([
-                            'Drag and Drop or ', html.A('Select Replays')
-                        ]),
-                        accept='.w3g',
-                        style={
-                            'height': '60px',
-                            'lineHeight': '60px',
-                            'borderWidth': '1px',
-                            'borderStyle': 'dashed',
-                            'borderRadius': '5px',
-                            'textAlign': 'center',
-                            'margin': '10px'
-                        },
-                        # Allow multiple files to be uploaded
-                        multiple=True,
-                        disabled=True,
-                    ),
+                    create_replay_input(),
                     # html.Div(
                     #     id="confirm-content",
                     #     children=[
@@ -122,13 +147,49 @@ def create_content():
                 ],
                 style={"margin-bottom": 20},
             ),
-            html.Div(id='stats-container')
+            html.Div(id='folder-stats-container' if local_mode else 'stats-container')
         ],
         id="content",
         style={"width": "100%", "height": "100%"},
     )
     return content
 
+def create_replay_input():
+    if local_mode:
+        return html.Div(
+            children=[
+                html.Small("Please enter the folder with your replays", className="form-text, text-muted"),
+                html.Div(
+                    children=[
+                        dcc.Input(id='replay-folder', value='', type='text', placeholder='', className="form-control"),
+                        html.Button('Load Replays', id='replay-folder-button', disabled=True, className="btn btn-secondary"),
+                    ],
+                    style={'display': 'flex'},
+                ),
+                # the folder being watched, set when the button is clicked
+                html.Div(id='folder-status', children=create_folder_status('')),
+                dcc.Interval(id='folder-poll', interval=1000),
+            ],
+            className="form-group",
+        )
+    # the files are posted to /replays/<job id> by assets/js/upload.js,
+    # the callbacks only ever see the id
+    return html.Div(
+        children=[
+            html.Small("Please select your replays", className="form-text, text-muted"),
+            html.Input(id='replay-files', type='file', accept='.w3g', multiple=True, disabled=True, className="form-control-file"),
+            html.Div(id='upload-job', children=create_job().id, style={'display': 'none'}),
+            dcc.Interval(id='upload-poll', interval=1000),
+        ],
+        className="form-group",
+    )
+
+def create_folder_status(folder, message=None):
+    return [
+        message,
+        html.Div(id='watched-folder', children=folder, style={'display': 'none'}),
+    ]
+
 def serve_layout():
     layout = html.Div(
         children=[
@@ -146,11 +207,11 @@ for js in external_js:
 for css in external_css:
     app.css.append_css({"external_url": css})
 
-# create layout
-app.layout = serve_layout()
+# create layout, on every page load since it depends on local_mode
+app.layout = serve_layout
 
 # callbacks
-@app.callback(Output('replayUpload', 'disabled'),
+@app.callback(Output('replay-files', 'disabled'),
               [Input('aliases', 'value')])
 def update_upload(aliases):
     if aliases != '':
@@ -158,6 +219,11 @@ def update_upload(aliases):
     else:
         return True
 
+@app.callback(Output('replay-folder-button', 'disabled'),
+              [Input('aliases', 'value')])
+def update_folder_button(aliases):
+    return update_upload(aliases)
+
 
 # @app.callback(Output('upload-confirm-markdown', 'children'),
 #               [Input('replayUpload', 'filename')])
@@ -172,47 +238,108 @@ def update_upload(aliases):
 #                State('replayUpload', 'filename'),
 #                State('replayUpload', 'last_modified')])
 
+# the parsed replays stay with the job, another alias only enriches and
+# aggregates them again; the aliases are read on the next poll, not on
+# every keystroke
 @app.callback(Output('stats-container', 'children'),
-               [Input('replayUpload', 'contents'),
-                Input('replayUpload', 'filename'),
-                Input('replayUpload', 'last_modified')],
-               [State('aliases', 'value')])
-
-def update_output_div(list_of_contents, list_of_names, list_of_dates, aliases):
-    # if(n_clicks > 0):
-    if(list_of_names):
-        replays = [load_replay(c, n, d) for c, n, d in zip(list_of_contents, list_of_names, list_of_dates)]
-        (stats, rep_list) = get_statistics(replays, [aliases])
-        return get_stats_layout(stats, rep_list)
-
-app.callback(Output('full-game-list-content', 'style'),
-            [Input('tabs', 'value')])(
-create_full_game_list_tab_callback())
-for race in list(ALL_RACES.keys()):
-    app.callback(Output(f'{race}-content', 'style'),
-              [Input('tabs', 'value')])(
-    create_mainrace_tab_callback(race))
-    app.callback(Output(f'{race}-content-total', 'style'),
-              [Input(f'{race}-tabs', 'value')])(
-    create_total_tab_callback(race))
-    app.callback(Output(f'{race}-content-race', 'style'),
-              [Input(f'{race}-tabs', 'value')])(
-    create_race_tab_callback(race))
-    app.callback(Output(f'{race}-content-map', 'style'),
-              [Input(f'{race}-tabs', 'value')])(
-    create_map_tab_callback(race))
-    for enemy_race in list(ALL_RACES.keys()):
-        app.callback(Output(f'{race}-content-{enemy_race}', 'style'),
-              [Input(f'{race}-race-dropdown', 'value')])(
-        create_race_tab_dropdown_callback(enemy_race))
-
-    for mapname in list(ALL_MAPS.keys()):
-        app.callback(Output(f'{race}-content-{mapname}', 'style'),
-              [Input(f'{race}-map-dropdown', 'value')])(
-        create_map_tab_dropdown_callback(mapname))
+               [Input('upload-poll', 'n_intervals')],
+               [State('upload-job', 'children'),
+                State('aliases', 'value')])
+
+def update_output_div(n_intervals, job_id, aliases):
+    job = get_job(job_id)
+    if job is None:
+        raise PreventUpdate()
+    status = job.status()
+    aliases = parse_aliases(aliases)
+    if (status['received'] == 0 and not status['done']) or not job.take_update(aliases):
+        raise PreventUpdate()
+    if not status['done']:
+        return html.P(format_progress(status))
+    (stats, rep_list) = get_statistics(job.replays, aliases)
+    return get_stats_layout(stats, store_stats(stats, rep_list))
+
+def format_progress(status):
+    progress = f"{status['parsed']} of {status['total']} replays parsed"
+    if status['failed']:
+        progress += f", {status['failed']} failed"
+    if status['eta']:
+        progress += f", about {int(status['eta']) + 1} seconds left"
+    return progress
+
+def format_folder_progress(folder, parsed, total):
+    if not total:
+        return f"Looking for replays in {folder}"
+    return f"{parsed} of {total} replays parsed"
+
+@app.callback(Output('folder-status', 'children'),
+              [Input('replay-folder-button', 'n_clicks')],
+              [State('replay-folder', 'value'),
+               State('aliases', 'value')])
+def update_watched_folder(n_clicks, folder, aliases):
+    # a ReplayWatcher reads the folder in the background and keeps it up to
+    # date from then on, update_folder_stats shows its progress
+    aliases = parse_aliases(aliases)
+    if not (n_clicks and folder and aliases):
+        raise PreventUpdate()
+    if not os.path.isdir(os.path.expanduser(folder)):
+        return create_folder_status('', html.P(f"{folder} is not a folder", className="text-danger"))
+    watch_folder(folder, aliases)
+    return create_folder_status(folder, html.Small(f"New replays in {folder} show up automatically", className="form-text, text-muted"))
+
+@app.callback(Output('folder-stats-container', 'children'),
+              [Input('folder-poll', 'n_intervals')],
+              [State('watched-folder', 'children'),
+               State('aliases', 'value')])
+def update_folder_stats(n_intervals, folder, aliases):
+    # another alias only enriches the watcher's parsed replays again, it is
+    # read on the next poll like the upload's
+    aliases = parse_aliases(aliases)
+    watcher = get_folder_watcher(folder) if folder else None
+    if watcher is None or not aliases:
+        raise PreventUpdate()
+    watcher.set_aliases(aliases)
+    if not watcher.loaded:
+        # the first scan of the folder is still running
+        return html.P(format_folder_progress(folder, *watcher.progress))
+    if not watcher.take_update():
+        raise PreventUpdate()
+    (stats, rep_list) = watcher.stats()
+    return get_stats_layout(stats, store_stats(stats, rep_list))
+
+# only the open tab and panels are in the page, they are rendered on demand
+app.callback(Output('tabs-content', 'children'),
+          [Input('tabs', 'value')],
+          [State('stats-id', 'children')])(
+render_tab)
+app.callback(Output('race-tab-content', 'children'),
+          [Input('race-tabs', 'value')],
+          [State('tabs', 'value'),
+           State('stats-id', 'children')])(
+render_race_tab)
+app.callback(Output('race-panel', 'children'),
+          [Input('race-dropdown', 'value')],
+          [State('tabs', 'value'),
+           State('stats-id', 'children')])(
+render_race_panel)
+app.callback(Output('map-panel', 'children'),
+          [Input('map-dropdown', 'value')],
+          [State('tabs', 'value'),
+           State('stats-id', 'children')])(
+render_map_panel)
+app.callback(Output('game-list', 'children'),
+          [Input('list-race-dropdown', 'value'),
+           Input('list-enemy-race-dropdown', 'value'),
+           Input('list-map-dropdown', 'value'),
+           Input('list-result-dropdown', 'value')],
+          [State('stats-id', 'children')])(
+render_game_list)
 
 def run():
+    global local_mode
     debug = False
+    # the server reads folders of the machine it runs on, never do that online
+    local_mode = not on_heroku
 
     if debug == False and on_heroku == False:
         port = 5000 + random.randint(0, 999)
@@ -1,64 +1,40 @@
-def create_full_game_list_tab_callback():
-    def render_content(tab):
-        if tab == 'list':
-            return {'display': 'block'}
-        else:
-            return {'display': 'none'}
-    return render_content
+from .replay_handler import get_stored_stats
+from .stats_layouter import get_race_content, get_race_tab_content, get_game_list_content, get_full_game_list_content, get_enemy_race_panel, get_map_panel
 
-def create_mainrace_tab_callback(race):
-    def render_content(tab):
-        if tab == f'{race}':
-            return {'display': 'block'}
-        else:
-            return {'display': 'none'}
-    return render_content
+# the content of a tab or panel is rendered the first time it is opened and
+# then taken from the page's ShownStats
 
-def create_total_tab_callback(race):
-    def render_content_total(tab):
-        if tab == f'{race}-tab-total':
-            return {
-                'display': 'block',
-                'margin': 10,
-            }
-        else:
-            return {'display': 'none'}
-    return render_content_total
+def render_tab(tab, stats_id):
+    shown = get_stored_stats(stats_id)
+    if shown is None:
+        return None
+    if tab == 'list':
+        return shown.panel(('list',), lambda: get_game_list_content(shown.stats))
+    if tab not in shown.stats:
+        return None
+    return get_race_content()
 
-def create_race_tab_callback(race):
-    def render_content_race(tab):
-        if tab == f'{race}-tab-race':
-            return {
-                'display': 'block',
-                'margin': 10,
-            }
-        else:
-            return {'display': 'none'}
-    return render_content_race
+def render_race_tab(tab, mainrace, stats_id):
+    shown = get_stored_stats(stats_id)
+    if shown is None or mainrace not in shown.stats:
+        return None
+    return shown.panel(('tab', mainrace, tab), lambda: get_race_tab_content(shown.stats[mainrace], tab))
 
-def create_map_tab_callback(race):
-    def render_content_map(tab):
-        if tab == f'{race}-tab-map':
-            return {
-                'display': 'block',
-                'margin': 10,
-            }
-        else:
-            return {'display': 'none'}
-    return render_content_map
+def render_race_panel(race, mainrace, stats_id):
+    shown = get_stored_stats(stats_id)
+    if shown is None or mainrace not in shown.stats or race not in shown.stats[mainrace]['race']:
+        return None
+    return shown.panel(('race', mainrace, race), lambda: get_enemy_race_panel(shown.stats[mainrace], race))
 
-def create_race_tab_dropdown_callback(race):
-    def render_content_race(value):
-        if value == f'{race}':
-            return {'display': 'block'}
-        else:
-            return {'display': 'none'}
-    return render_content_race
+def render_map_panel(mapname, mainrace, stats_id):
+    shown = get_stored_stats(stats_id)
+    if shown is None or mainrace not in shown.stats or mapname not in shown.stats[mainrace]['map']:
+        return None
+    return shown.panel(('map', mainrace, mapname), lambda: get_map_panel(shown.stats[mainrace], mapname))
 
-def create_map_tab_dropdown_callback(mapname):
-    def render_content_map(value):
-        if value == f'{mapname}':
-            return {'display': 'block'}
-        else:
-            return {'display': 'none'}
-    return render_content_map
+def render_game_list(race, enemy_race, mapname, result, stats_id):
+    shown = get_stored_stats(stats_id)
+    if shown is None:
+        return None
+    return shown.panel(('list', race, enemy_race, mapname, result),
+                       lambda: get_full_game_list_content(shown.select(race, enemy_race, mapname, result)))
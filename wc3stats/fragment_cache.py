@@ -0,0 +1,81 @@
+"""Cache of rendered stats fragments.
+
+The tables and figures of the stats pages only depend on the stats they
+show. FragmentCache memoizes the functions rendering them by a hash of
+their arguments, so showing the same stats again (a reload, another page
+with the same replays) takes the fragments from memory instead of
+building them again. The least recently used fragments are dropped once
+the cache is full.
+"""
+import json
+import datetime
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+
+def _default(o):
+    # sets (the enemy races of a replay) in a stable order
+    if isinstance(o, (set, frozenset)):
+        return sorted(o, key=repr)
+    if isinstance(o, datetime.datetime):
+        return o.isoformat()
+    # anything else might only have a repr with its address in it
+    raise TypeError('{0} is not a stable key'.format(type(o).__name__))
+
+def stable_hash(*args):
+    """Returns a hash of args that does not depend on the order of dicts and sets."""
+    s = json.dumps(args, sort_keys=True, default=_default, separators=(',', ':'))
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+class FragmentCache(object):
+    """LRU cache of the results of layout functions.
+
+    Parameters
+    ----------
+    version : int
+        Layout version, part of every key so fragments of an older layout
+        are never returned.
+    max_entries : int, optional
+        Number of fragments kept.
+    """
+
+    def __init__(self, version, max_entries=1024):
+        self.version = version
+        self.max_entries = max_entries
+        self.fragments = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, render):
+        """Returns the fragment stored under key, render()s and stores it if there is none."""
+        with self.lock:
+            if key in self.fragments:
+                self.fragments.move_to_end(key)
+                return self.fragments[key]
+        fragment = render()
+        with self.lock:
+            self.fragments[key] = fragment
+            while len(self.fragments) > self.max_entries:
+                self.fragments.popitem(last=False)
+        return fragment
+
+    def memoize(self, func):
+        """Decorator caching func by the hash of its arguments."""
+        @functools.wraps(func)
+        def wrapper(*args):
+            try:
+                key = stable_hash(self.version, func.__name__, args)
+            except (TypeError, ValueError):
+                # arguments that cannot be hashed are rendered every time
+                return func(*args)
+            return self.get(key, lambda: func(*args))
+        return wrapper
+
+    def clear(self):
+        with self.lock:
+            self.fragments.clear()
+
+    def __len__(self):
+        return len(self.fragments)
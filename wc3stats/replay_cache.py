@@ -0,0 +1,33 @@
+"""Persistent cache of parsed replays.
+
+Records are keyed by a hash of the raw replay bytes, so a replay that is
+uploaded again (under any name) is not parsed a second time. They live in
+a SQLiteStore, the least recently used ones are evicted once the database
+grows over its size cap. Records written by another parser version are
+dropped when the cache is opened.
+"""
+import hashlib
+
+from .sqlite_store import SQLiteStore
+
+
+class ReplayCache(SQLiteStore):
+    """Maps replay hashes to JSON serializable parse results.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database, created if it does not exist.
+    version : int
+        Parser version; records of any other version are discarded.
+    max_size : int, optional
+        Size cap of the stored records in bytes.
+    """
+
+    def __init__(self, path, version, max_size=100 * 1024 * 1024):
+        super(ReplayCache, self).__init__(path, 'replays', max_size, version)
+
+    @staticmethod
+    def key(data):
+        """Returns the cache key of the raw replay bytes."""
+        return hashlib.sha1(data).hexdigest()
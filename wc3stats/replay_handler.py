@@ -1,20 +1,113 @@
-from .replay_helper import enrich_replay_data, compute_stats, stats_post_processing, load_single_replay, get_replay_list
-import base64
-import io
-import re
+from .replay_helper import enrich_single_replay, StatsAggregator, stats_post_processing, get_replay_list
+from .replay_table import ReplayTable
+from .replay_watcher import ReplayWatcher
+import os
+import time
+import uuid
+import threading
 
 def get_statistics(replays, aliases):
-    replays = [r for r in replays if r is not None]
+    # replays can be a generator; the enriched replays go into a ReplayTable
+    # and the stats are grouped from its columns instead of replay by replay
+    er = []
+    for rep in replays:
+        if rep is not None:
+            new_rep = enrich_single_replay(rep, aliases)
+            if new_rep is not None:
+                er.append(new_rep)
 
-    er = enrich_replay_data(replays,aliases)
     rep_list = get_replay_list(er)
-    stats = compute_stats(er)
+    stats = StatsAggregator.from_table(ReplayTable(rep_list)).to_dict()
     stats_post_processing(stats)
     return (stats, rep_list)
 
-def load_replay(contents, filename, date):
-    try:
-        f = io.BytesIO(base64.b64decode(contents[contents.find(";base64")+7:]))
-        return load_single_replay(f, filename, date)
-    except:
-        print(contents)
+def parse_aliases(text):
+    # several names of the player (smurfs) are separated by commas
+    return [alias.strip() for alias in (text or '').split(',') if alias.strip()]
+
+# the watcher of the folder loaded in local mode, by folder; it keeps the
+# statistics of its folder up to date in the background
+folder_watchers = {}
+folder_lock = threading.Lock()
+
+def watch_folder(folder, aliases):
+    # reads the replays straight from disk, the first call for a folder
+    # starts a watcher that parses them in its thread (see its loaded and
+    # progress), later calls reuse the watcher and its parsed replays;
+    # the watcher of the folder loaded before is stopped
+    folder = os.path.abspath(os.path.expanduser(folder))
+    with folder_lock:
+        watcher = folder_watchers.get(folder)
+        stopped = [w for f, w in folder_watchers.items() if f != folder]
+        if watcher is None:
+            watcher = ReplayWatcher(folder, aliases)
+            watcher.start()
+        folder_watchers.clear()
+        folder_watchers[folder] = watcher
+    for w in stopped:
+        w.stop()
+    watcher.set_aliases(aliases)
+    return watcher
+
+def get_folder_watcher(folder):
+    with folder_lock:
+        return folder_watchers.get(os.path.abspath(os.path.expanduser(folder)))
+
+# statistics shown on a page, the tab and panel callbacks render from them;
+# they are dropped an hour after they were last used
+STATS_TIMEOUT = 3600
+
+shown_stats = {}
+shown_stats_lock = threading.Lock()
+
+class ShownStats(object):
+    """Statistics of a page and the panels already rendered from them."""
+
+    def __init__(self, stats, rep_list):
+        self.stats = stats
+        self.rep_list = rep_list
+        # rep_list by column, built when the game list is filtered first
+        self.table = None
+        self.panels = {}
+        self.lock = threading.Lock()
+        self.used = time.time()
+
+    def panel(self, key, render):
+        # render is only called the first time a panel is opened
+        with self.lock:
+            panel = self.panels.get(key)
+        if panel is None:
+            panel = render()
+            with self.lock:
+                self.panels[key] = panel
+        return panel
+
+    def select(self, race=None, enemy_race=None, mapname=None, result=None):
+        """Returns the replays of rep_list matching the filters of the game list, None matches all."""
+        with self.lock:
+            if self.table is None:
+                self.table = ReplayTable(self.rep_list)
+            # answered from the bitmap indexes of the table
+            rows = self.table.select(
+                race={race} if race else None,
+                maps={mapname} if mapname else None,
+                enemy_race={enemy_race} if enemy_race else None,
+                won=(result == 'won') if result else None,
+            )
+        return [self.rep_list[i] for i in rows]
+
+def store_stats(stats, rep_list):
+    stats_id = uuid.uuid4().hex
+    with shown_stats_lock:
+        now = time.time()
+        for key in [k for k, s in shown_stats.items() if now - s.used > STATS_TIMEOUT]:
+            del shown_stats[key]
+        shown_stats[stats_id] = ShownStats(stats, rep_list)
+    return stats_id
+
+def get_stored_stats(stats_id):
+    with shown_stats_lock:
+        shown = shown_stats.get(stats_id)
+        if shown is not None:
+            shown.used = time.time()
+        return shown
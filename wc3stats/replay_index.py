@@ -0,0 +1,161 @@
+"""Persistent index of the replay files in a folder.
+
+For every replay below a folder the index stores its path, size,
+modification time and a hash of its content. A rescan only stats the
+files, so it can tell which replays were added, changed or deleted since
+the last scan without reading the ones that were left alone. The content
+hash is the key of the ReplayCache, which makes parse results of unchanged
+files available without touching them.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import namedtuple
+
+IndexedFile = namedtuple('IndexedFile', ['path', 'size', 'mtime', 'hash'])
+IndexedFile.__doc__ = """A replay file of the index, mtime is in nanoseconds."""
+
+FolderChanges = namedtuple('FolderChanges', ['changed', 'deleted'])
+FolderChanges.__doc__ = """Lists of the IndexedFiles that are new or changed, and deleted."""
+
+# the rows of a scan are committed every this many hashed files, the first
+# scan of a large folder would otherwise hold one write transaction while
+# it reads every replay
+HASH_BATCH = 200
+
+
+def scan_replays(root, onerror=None):
+    """Yields a DirEntry for every .w3g file below root.
+
+    A folder that cannot be listed is skipped, onerror is called with its
+    path and the OSError then, like the onerror of os.walk.
+    """
+    try:
+        entries = list(os.scandir(root))
+    except OSError as e:
+        if onerror is not None:
+            onerror(root, e)
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from scan_replays(entry.path, onerror)
+        elif entry.name.endswith('.w3g') and entry.is_file():
+            yield entry
+
+def _below(root):
+    # query parameters of the paths inside root, LIKE would be case insensitive
+    prefix = os.path.join(os.path.abspath(root), '')
+    return (len(prefix), prefix)
+
+def hash_file(path):
+    # same key as ReplayCache.key of the file's content
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ReplayIndex(object):
+    """Tracks the replays below one or more folders in a SQLite database.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database, created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                              'path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                              'hash TEXT, seen INTEGER)')
+
+    def scan(self, root, min_age=0):
+        """Rescans root and updates the index.
+
+        Returns the FolderChanges since the last scan of root. A file whose
+        size or modification time changed but whose content did not is not
+        reported. Files modified less than min_age seconds ago are taken to
+        be still written and are left as they were for the next scan, so
+        are files that cannot be read at the moment and everything below a
+        folder that cannot be listed.
+        """
+        root = os.path.abspath(root)
+        changed = []
+        settled = time.time() - min_age
+        with self.lock, self.conn:
+            generation = self.conn.execute('SELECT COALESCE(MAX(seen), 0) + 1 FROM files').fetchone()[0]
+            hashed = 0
+
+            def unlisted(path, error):
+                # the files below it are not deleted, just not seen this time
+                self.conn.execute('UPDATE files SET seen = ? WHERE substr(path, 1, ?) = ?',
+                                  (generation,) + _below(path))
+            try:
+                for entry in scan_replays(root, unlisted):
+                    path = entry.path
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        self.conn.execute('UPDATE files SET seen = ? WHERE path = ?', (generation, path))
+                        continue
+                    if min_age and st.st_mtime > settled:
+                        self.conn.execute('UPDATE files SET seen = ? WHERE path = ?', (generation, path))
+                        continue
+                    # the common case, an unchanged file, is a single statement
+                    if self.conn.execute('UPDATE files SET seen = ? WHERE path = ? AND size = ? AND mtime = ?',
+                                         (generation, path, st.st_size, st.st_mtime_ns)).rowcount:
+                        continue
+                    try:
+                        h = hash_file(path)
+                    except OSError:
+                        self.conn.execute('UPDATE files SET seen = ? WHERE path = ?', (generation, path))
+                        continue
+                    row = self.conn.execute('SELECT hash FROM files WHERE path = ?', (path,)).fetchone()
+                    self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                      (path, st.st_size, st.st_mtime_ns, h, generation))
+                    if row is None or row[0] != h:
+                        changed.append(IndexedFile(path, st.st_size, st.st_mtime_ns, h))
+                    hashed += 1
+                    if hashed % HASH_BATCH == 0:
+                        self.conn.commit()
+            except BaseException:
+                # batches of this scan may be committed already, forget the
+                # changed files so the next scan reports them again
+                self.conn.executemany('DELETE FROM files WHERE path = ?', [(f.path,) for f in changed])
+                self.conn.commit()
+                raise
+
+            deleted = [IndexedFile(*row) for row in self.conn.execute(
+                'SELECT path, size, mtime, hash FROM files WHERE substr(path, 1, ?) = ? AND seen != ?',
+                _below(root) + (generation,))]
+            self.conn.executemany('DELETE FROM files WHERE path = ?', [(f.path,) for f in deleted])
+        return FolderChanges(changed, deleted)
+
+    def files(self, root=None):
+        """Returns the IndexedFiles below root, all of them by default."""
+        with self.lock:
+            if root is None:
+                rows = self.conn.execute('SELECT path, size, mtime, hash FROM files').fetchall()
+            else:
+                rows = self.conn.execute('SELECT path, size, mtime, hash FROM files WHERE substr(path, 1, ?) = ?',
+                                         _below(root)).fetchall()
+        return [IndexedFile(*row) for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
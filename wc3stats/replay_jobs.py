@@ -0,0 +1,163 @@
+"""Background parsing of uploaded replays.
+
+A ReplayJob collects the replays of one upload. Every replay added to it is
+handed to the process pool of get_parse_pool, shared by all jobs and the
+folder loads, and parsed there, so an upload request returns as soon as its
+files are read. The client then polls the job by its id for the progress
+(replays parsed, failures, time left) and fetches the statistics once it is
+done.
+
+Jobs live in memory and are dropped an hour after they were last asked
+about. That is enough for the single server process the app runs in.
+"""
+import time
+import uuid
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from .replay_helper import load_replay_isolated, get_parse_pool
+
+# jobs are dropped an hour after they were last used
+JOB_TIMEOUT = 3600
+
+jobs = {}
+jobs_lock = threading.Lock()
+
+
+def _submit(source):
+    pool = get_parse_pool()
+    for attempt in range(2):
+        try:
+            return pool.submit(load_replay_isolated, source)
+        except BrokenProcessPool:
+            # a worker died, e.g. killed for its memory, start over
+            pool = get_parse_pool(pool)
+    raise BrokenProcessPool('the replay workers keep dying')
+
+
+class ReplayJob(object):
+    """The replays of one upload, parsed in the background.
+
+    Parameters
+    ----------
+    job_id : str
+        Id the client asks for the job with.
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.lock = threading.Lock()
+        self.used = time.time()
+        self.generation = 0
+        self.start()
+
+    def start(self, total=0):
+        """Forgets all replays, total is the number of replays to come if known."""
+        with self.lock:
+            # replays of an earlier start still being parsed are ignored
+            self.generation += 1
+            self.replays = []
+            self.total = total
+            self.received = 0
+            self.parsed = 0
+            self.failed = 0
+            self.closed = False
+            self.started = None
+            self.finished = None
+            self.version = 0
+            self.shown_version = 0
+            self.shown_view = None
+
+    def add(self, data, filename, date):
+        """Queues the raw bytes of a replay for parsing, date is a timestamp."""
+        with self.lock:
+            generation = self.generation
+            self.received += 1
+            self.total = max(self.total, self.received)
+            if self.started is None:
+                self.started = time.time()
+            self.used = time.time()
+        try:
+            future = _submit((data, filename, date))
+        except BrokenProcessPool:
+            self._parsed(generation, None)
+        else:
+            future.add_done_callback(lambda f: self._parsed(generation, f))
+
+    def close(self):
+        """Marks the upload as complete, the job is done once all replays are parsed."""
+        with self.lock:
+            self.closed = True
+            self._update()
+
+    def _parsed(self, generation, future):
+        # runs in the pool's thread, the replay is None if it could not be parsed
+        rep = None
+        if future is not None and not future.cancelled() and future.exception() is None:
+            rep = future.result()
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.parsed += 1
+            if rep is None:
+                self.failed += 1
+            else:
+                self.replays.append(rep)
+            self._update()
+
+    def _update(self):
+        self.version += 1
+        if self.closed and self.parsed == self.received and self.finished is None:
+            self.finished = time.time()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    def take_update(self, view=None):
+        """Returns True once for every change since the last call.
+
+        view is what the caller shows the job with (e.g. the player
+        aliases), a different view counts as a change as well.
+        """
+        with self.lock:
+            self.used = time.time()
+            if self.version == self.shown_version and view == self.shown_view:
+                return False
+            self.shown_version = self.version
+            self.shown_view = view
+            return True
+
+    def status(self):
+        """Returns the progress of the job as a JSON serializable dict."""
+        with self.lock:
+            self.used = time.time()
+            eta = None
+            if self.finished is not None:
+                eta = 0
+            elif self.parsed:
+                # the replays parsed so far are the best guess for the rest
+                elapsed = time.time() - self.started
+                eta = round(elapsed / self.parsed * (self.total - self.parsed), 1)
+            return {
+                'id': self.id,
+                'total': self.total,
+                'received': self.received,
+                'parsed': self.parsed,
+                'failed': self.failed,
+                'done': self.finished is not None,
+                'eta': eta,
+            }
+
+
+def create_job():
+    job_id = uuid.uuid4().hex
+    with jobs_lock:
+        now = time.time()
+        for key in [k for k, j in jobs.items() if now - j.used > JOB_TIMEOUT]:
+            del jobs[key]
+        job = jobs[job_id] = ReplayJob(job_id)
+    return job
+
+def get_job(job_id):
+    with jobs_lock:
+        return jobs.get(job_id)
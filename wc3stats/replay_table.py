@@ -0,0 +1,182 @@
+"""Columnar table of enriched replays.
+
+The statistics only need a handful of fields per replay. ReplayTable keeps
+them in flat arrays, one per field, with the categorical ones (race, enemy
+race, ally race, map) dictionary-encoded to small ints. Filtering and
+grouping then work on ints and never touch the replay dicts again.
+
+Filters are answered from bitmap indexes: for every code of a column there
+is a bitset (a Python int) with bit i set if row i has that code. A filter
+is the OR of the bitsets of the matching codes, several filters are ANDed.
+"""
+from array import array
+
+
+def length_bucket(length):
+    if length < 600000:
+        return 0
+    elif length < 1200000:
+        return 1
+    elif length < 1800000:
+        return 2
+    return 3
+
+
+# the set bits of every byte value
+_BYTE_BITS = [tuple(j for j in range(8) if b >> j & 1) for b in range(256)]
+
+def bitmap_rows(bitmap):
+    """Returns the indices of the set bits of bitmap in ascending order."""
+    rows = []
+    for k, b in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')):
+        if b:
+            base = k * 8
+            rows.extend([base + j for j in _BYTE_BITS[b]])
+    return rows
+
+def bitmap_count(bitmap):
+    return bin(bitmap).count('1')
+
+
+class ReplayTable(object):
+    """Enriched replays (see enrich_replay_data) stored by column.
+
+    Parameters
+    ----------
+    replays : iterable of dict, optional
+        Enriched replays to append.
+    """
+
+    # columns holding codes, labels[name][code] is the original value
+    ENCODED = ('race', 'enemy_race', 'ally_race', 'map')
+
+    def __init__(self, replays=()):
+        self.race = array('B')
+        self.enemy_race = array('H')
+        self.ally_race = array('H')
+        self.map = array('H')
+        self.won = array('B')
+        self.length_bucket = array('B')
+        self.hour = array('B')
+        self.weekday = array('B')
+        self.length = array('q')
+        self.apm = array('d')
+        self.filename = []
+        self.labels = {name: [] for name in self.ENCODED}
+        self.codes = {name: {} for name in self.ENCODED}
+        # column name -> (number of rows, bitsets), built on first use
+        self._bitmaps = {}
+        for rep in replays:
+            self.append(rep)
+
+    def __len__(self):
+        return len(self.won)
+
+    def encode(self, name, value):
+        """Returns the code of value in the encoded column name, adding it if needed."""
+        # the enemy and ally races are sets (lists in the Flask app), they
+        # are stored as frozensets
+        if isinstance(value, (set, list)):
+            value = frozenset(value)
+        codes = self.codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            self.labels[name].append(value)
+        return code
+
+    def append(self, rep):
+        self.race.append(self.encode('race', rep['race']))
+        self.enemy_race.append(self.encode('enemy_race', rep['enemy_race']))
+        self.ally_race.append(self.encode('ally_race', rep['ally_race']))
+        self.map.append(self.encode('map', rep['map']))
+        self.won.append(1 if rep['won'] else 0)
+        self.length_bucket.append(length_bucket(rep['length']))
+        self.hour.append(rep['hour'])
+        self.weekday.append(rep['weekday'])
+        self.length.append(rep['length'])
+        self.apm.append(rep['apm'])
+        self.filename.append(rep['filename'])
+
+    def select(self, race=None, maps=None, ally_race=None, enemy_race=None, won=None):
+        """Returns the indices of the rows matching the filters of replay_match."""
+        if race is None and maps is None and ally_race is None and enemy_race is None and won is None:
+            return range(len(self))
+        return bitmap_rows(self.select_bitmap(race, maps, ally_race, enemy_race, won))
+
+    def count(self, race=None, maps=None, ally_race=None, enemy_race=None, won=None):
+        """Returns the number of rows matching the filters of replay_match."""
+        return bitmap_count(self.select_bitmap(race, maps, ally_race, enemy_race, won))
+
+    def select_bitmap(self, race=None, maps=None, ally_race=None, enemy_race=None, won=None):
+        """Returns the bitset of the rows matching the filters of replay_match."""
+        selected = (1 << len(self)) - 1
+        if race is not None:
+            selected &= self._bitmap_of('race', lambda r: r in race)
+        if maps is not None:
+            selected &= self._bitmap_of('map', lambda m: m in maps)
+        if ally_race is not None:
+            selected &= self._bitmap_of('ally_race', lambda r: not ally_race - r)
+        if enemy_race is not None:
+            selected &= self._bitmap_of('enemy_race', lambda r: not enemy_race - r)
+        if won is not None:
+            selected &= self.bitmaps('won')[1 if won else 0]
+        return selected
+
+    def bitmaps(self, name):
+        """Returns the bitmap index of an encoded column or of won, one bitset per code."""
+        n, bitsets = self._bitmaps.get(name, (None, None))
+        if n != len(self):
+            # (re)build after rows were appended
+            column = getattr(self, name)
+            ncodes = len(self.labels[name]) if name in self.labels else 2
+            size = (len(column) + 7) // 8
+            maps = [bytearray(size) for _ in range(ncodes)]
+            for i, code in enumerate(column):
+                maps[code][i >> 3] |= 1 << (i & 7)
+            bitsets = [int.from_bytes(m, 'little') for m in maps]
+            self._bitmaps[name] = (len(self), bitsets)
+        return bitsets
+
+    def _bitmap_of(self, name, match):
+        # OR of the bitsets of all codes whose value matches
+        bitsets = self.bitmaps(name)
+        selected = 0
+        for code, value in enumerate(self.labels[name]):
+            if match(value):
+                selected |= bitsets[code]
+        return selected
+
+    def group_by(self, columns, rows=None):
+        """Groups rows by columns and sums them up per group.
+
+        Returns a dict mapping the tuple of column values of every non-empty
+        group (decoded for the encoded columns) to a list of the number of
+        replays, their length sum and their apm sum. Groups appear in the
+        order of their first row.
+        """
+        if rows is None:
+            rows = range(len(self))
+        cols = [getattr(self, name) for name in columns] + [self.length, self.apm]
+        if len(rows) < len(self):
+            cols = [[column[i] for i in rows] for column in cols]
+
+        # the codes of a row are its group key
+        groups = {}
+        for i, values in zip(rows, zip(*cols)):
+            key = values[:-2]
+            g = groups.get(key)
+            if g is None:
+                g = groups[key] = [0, 0, 0.0, i]
+            g[0] += 1
+            g[1] += values[-2]
+            g[2] += values[-1]
+
+        result = {}
+        for n, length_sum, apm_sum, first in groups.values():
+            result[self.row_values(columns, first)] = [n, length_sum, apm_sum]
+        return result
+
+    def row_values(self, columns, i):
+        return tuple(self.labels[name][getattr(self, name)[i]] if name in self.labels
+                     else getattr(self, name)[i] for name in columns)
@@ -0,0 +1,210 @@
+"""Live statistics of a replay folder.
+
+ReplayWatcher polls a folder (e.g. the game's Replays folder) through a
+ReplayIndex, parses new and changed replays in a worker pool and patches
+its StatsAggregator with them, so the statistics are always ready without
+an upload and without recomputing them over all replays.
+
+The game overwrites LastReplay.w3g after every game. The previous game in
+it stays in the statistics for as long as the watcher runs. Games are told
+apart by the content hash of their files, so a game that is also saved
+under its own name is counted once.
+
+Run it with
+
+    python -m wc3stats.replay_watcher <replay folder> <player name> [<alias> ...]
+"""
+import os
+import sys
+import time
+import threading
+from .replay_helper import load_folder, enrich_single_replay, StatsAggregator, stats_post_processing, get_replay_list, get_replay_index
+
+LAST_REPLAY = 'LastReplay.w3g'
+
+
+class ReplayWatcher(object):
+    """Keeps the statistics of the replays below root up to date.
+
+    Parameters
+    ----------
+    root : str
+        The replay folder.
+    aliases : list of str
+        Names of the player the statistics are for.
+    index : ReplayIndex, optional
+        Index of root, by default the one of get_replay_index.
+    interval : float, optional
+        Seconds between two scans of root.
+    min_age : float, optional
+        Seconds a replay file has to be left alone before it is parsed, the
+        game is still writing it before that.
+    """
+
+    def __init__(self, root, aliases, index=None, interval=5.0, min_age=10.0):
+        self.root = os.path.abspath(root)
+        self.aliases = list(aliases)
+        self.index = index if index is not None else get_replay_index()
+        self.interval = interval
+        self.min_age = min_age
+        self.replays = None
+        # every game is counted once by the hash of its file, however many
+        # files hold it: hashes maps the paths to their hash, keys the
+        # hashes to their paths and games to the parsed replay
+        self.hashes = {}
+        self.keys = {}
+        self.games = {}
+        # enriched replays by hash, None for games without the player
+        self.enriched = {}
+        self.aggregator = StatsAggregator()
+        self.lock = threading.Lock()
+        self.version = 0
+        self.shown_version = 0
+        # replays parsed and to parse by the running scan, and whether the
+        # first scan has been applied
+        self.progress = (0, 0)
+        self.loaded = False
+        self._stats = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def update(self):
+        """Scans root once and applies the changes, returns whether there were any."""
+        replays, added, removed = load_folder(self.root, self.index, self.replays, self.min_age,
+                                              self._progress)
+        hashes = {f.path: f.hash for f in self.index.files(self.root)} if added else {}
+        with self.lock:
+            self.replays = replays
+            for rep in removed:
+                path = os.path.join(self.root, rep['filename'])
+                h = self.hashes.pop(path, None)
+                if h is None:
+                    continue
+                keys = self.keys[h]
+                keys.discard(path)
+                if not keys and os.path.basename(path) == LAST_REPLAY:
+                    # overwritten by the next game, the old one still counts
+                    keys.add((path, rep['datetime']))
+                if not keys:
+                    self._drop(h)
+            for rep in added:
+                path = os.path.join(self.root, rep['filename'])
+                h = hashes.get(path)
+                if h is None:
+                    continue
+                self.hashes[path] = h
+                if h in self.keys:
+                    # the same game in another file, e.g. an earlier
+                    # LastReplay the user saved under its own name
+                    self.keys[h] = {k for k in self.keys[h] if not isinstance(k, tuple)}
+                    self.keys[h].add(path)
+                else:
+                    self.keys[h] = {path}
+                    self.games[h] = rep
+                    self._enrich(h)
+            if added or removed or not self.loaded:
+                # the first scan is shown even if the folder is empty
+                self.loaded = True
+                self._changed()
+        return bool(added or removed)
+
+    def _progress(self, parsed, total):
+        self.progress = (parsed, total)
+
+    def set_aliases(self, aliases):
+        """Computes the statistics for other player names, without parsing again."""
+        with self.lock:
+            if list(aliases) == self.aliases:
+                return
+            self.aliases = list(aliases)
+            self.aggregator = StatsAggregator()
+            self.enriched = {}
+            for h in self.games:
+                self._enrich(h)
+            self._changed()
+
+    def _enrich(self, h):
+        er = enrich_single_replay(self.games[h], self.aliases)
+        self.enriched[h] = er
+        if er is not None:
+            self.aggregator.add(er)
+
+    def _drop(self, h):
+        del self.keys[h]
+        del self.games[h]
+        er = self.enriched.pop(h)
+        if er is not None:
+            self.aggregator.remove(er)
+
+    def _changed(self):
+        self.version += 1
+        self._stats = None
+
+    def take_update(self):
+        """Returns True once for every change since the last call."""
+        with self.lock:
+            if self.version == self.shown_version:
+                return False
+            self.shown_version = self.version
+            return True
+
+    def stats(self):
+        """Returns (stats, rep_list) like get_statistics, computed once per change."""
+        with self.lock:
+            if self._stats is None:
+                stats = self.aggregator.to_dict()
+                stats_post_processing(stats)
+                enriched = [er for er in self.enriched.values() if er is not None]
+                self._stats = (stats, get_replay_list(enriched))
+            return self._stats
+
+    def run(self, callback=None):
+        """Scans root every interval seconds until stop() is called.
+
+        callback is called with the watcher after every scan that changed
+        the statistics.
+        """
+        while not self._stop.is_set():
+            try:
+                changed = self.update()
+            except Exception as e:
+                # a broken scan must not end the watcher, try again later
+                print(e)
+                changed = False
+            if changed and callback is not None:
+                callback(self)
+            self._stop.wait(self.interval)
+
+    def start(self, callback=None):
+        """Runs the watcher in a daemon thread, its first scan included."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(callback,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def print_summary(watcher):
+    stats, rep_list = watcher.stats()
+    print('{0}: {1} games'.format(time.strftime('%H:%M:%S'), len(rep_list)))
+    for race, s in stats.items():
+        print('  {0}: {1}-{2} ({3:.0%}), {4} apm, {5} avg length'.format(
+            race, s['w'], s['l'], s['p'], int(s['apm']), s['avg_length']))
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__.strip().splitlines()[-1].strip())
+        sys.exit(1)
+    watcher = ReplayWatcher(sys.argv[1], sys.argv[2:])
+    try:
+        watcher.run(print_summary)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Size capped key-value store in SQLite.
+
+SQLiteStore keeps JSON serializable values in one table of a SQLite
+database, with the size of every value and the time it was last used.
+Once the stored values grow over the size cap, the least recently used
+ones are evicted in batches down to LOW_WATER of the cap, so the puts
+after it do not have to evict again. The parse cache and the session
+store of the Flask app are both built on it.
+
+The stores are caches of data that can be had again, a database that is
+locked or broken is treated like one that misses the value: get raises
+KeyError and put returns False.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# a full store is evicted down to this share of its size cap
+LOW_WATER = 0.9
+# values deleted per query while evicting
+EVICT_BATCH = 100
+
+
+class SQLiteStore(object):
+    """Maps string keys to JSON serializable values, least recently used evicted first.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database, created if it does not exist.
+    table : str
+        Name of the table holding the values.
+    max_size : int
+        Size cap of the stored values in bytes.
+    version : int, optional
+        Version of the values; the values of any other version are
+        discarded when the store is opened.
+    """
+
+    def __init__(self, path, table, max_size, version=None):
+        self.path = path
+        self.table = table
+        self.max_size = max_size
+        self.version = version
+        self.lock = threading.Lock()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            if version is not None and self.conn.execute('PRAGMA user_version').fetchone()[0] != version:
+                # written by another version, or by an older layout of the table
+                self.conn.execute('DROP TABLE IF EXISTS {0}'.format(table))
+                self.conn.execute('PRAGMA user_version = {0:d}'.format(version))
+            self.conn.execute('CREATE TABLE IF NOT EXISTS {0} ('
+                              'key TEXT PRIMARY KEY, value TEXT, size INTEGER, used REAL)'.format(table))
+            self.conn.execute('CREATE INDEX IF NOT EXISTS {0}_used ON {0} (used)'.format(table))
+        self.size = self._stored_size()
+
+    def get(self, key):
+        """Returns the value stored under key, raises KeyError if there is none."""
+        try:
+            with self.lock, self.conn:
+                row = self.conn.execute('SELECT value FROM {0} WHERE key = ?'.format(self.table),
+                                        (key,)).fetchone()
+                if row is not None:
+                    self.conn.execute('UPDATE {0} SET used = ? WHERE key = ?'.format(self.table),
+                                      (time.time(), key))
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """Stores value under key and evicts old values if the store is full.
+
+        Returns False if the value could not be written.
+        """
+        s = json.dumps(value, separators=(',', ':'))
+        try:
+            with self.lock, self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO {0} VALUES (?, ?, ?, ?)'.format(self.table),
+                                  (key, s, len(s), time.time()))
+                # other processes may write to the same database, a total
+                # kept by this connection alone would never reach the cap
+                self.size = self._stored_size()
+                if self.size > self.max_size:
+                    self._evict(key)
+        except sqlite3.Error:
+            return False
+        return True
+
+    def delete(self, key):
+        try:
+            with self.lock, self.conn:
+                row = self.conn.execute('SELECT size FROM {0} WHERE key = ?'.format(self.table),
+                                        (key,)).fetchone()
+                if row is not None:
+                    self.conn.execute('DELETE FROM {0} WHERE key = ?'.format(self.table), (key,))
+                    self.size -= row[0]
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM {0}'.format(self.table))
+            self.size = 0
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM {0}'.format(self.table)).fetchone()[0]
+
+    def _stored_size(self):
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM {0}'.format(self.table)).fetchone()[0]
+
+    def _evict(self, keep):
+        # the value just written is kept even if it is over the cap alone
+        low_water = self.max_size * LOW_WATER
+        while self.size > low_water:
+            rows = self.conn.execute('SELECT key, size FROM {0} WHERE key != ? ORDER BY used LIMIT ?'.format(
+                self.table), (keep, EVICT_BATCH)).fetchall()
+            if not rows:
+                break
+            keys = []
+            for key, size in rows:
+                if self.size <= low_water:
+                    break
+                keys.append((key,))
+                self.size -= size
+            self.conn.executemany('DELETE FROM {0} WHERE key = ?'.format(self.table), keys)
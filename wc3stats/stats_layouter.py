@@ -1,6 +1,7 @@
 import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objs as go
+from .fragment_cache import FragmentCache
 
 ALL_RACES = {
     'random': {
@@ -63,50 +64,57 @@ WEEKDAYS = {
     '6': 'Sun'
 }
 
-def get_stats_layout(stats, rep_list):
+# bump whenever the output of the memoized layout functions changes
+LAYOUT_VERSION = 1
+fragments = FragmentCache(LAYOUT_VERSION)
+
+def get_stats_layout(stats, stats_id):
+    # only the tabs, their content is rendered by a callback when a tab is
+    # opened, from the stats stored as stats_id
+    layout = html.P("There are no 1on1 ladder games of this player in the replays")
     tabs = []
-    content = [] 
     races = sorted(list(stats.keys()))
     if(len(races)>0):
         for race in races:
             tabs.append(
                 dcc.Tab(label=race.title(), value=race)
             )
-            content.append(
-                html.Div(id=race + '-content',
-                    children=get_race_content(stats[race], race)
-                )
-            )
 
         tabs.append(
             dcc.Tab(label="Full Game List", value="list")
         )
-        content.append(
-            html.Div(id='full-game-list-content',
-                children=get_full_game_list_content(rep_list)
-            )
-        )
 
         layout = html.Div([
             dcc.Tabs(id="tabs", value=races[0], children=tabs),
-            html.Div(id='tabs-content',children=content)
+            html.Div(id='tabs-content'),
+            html.Div(id='stats-id', children=stats_id, style={'display': 'none'}),
         ])
 
     return layout
 
-def get_race_content(stats, mainrace):
-    content = [
+def get_race_content():
+    # the same for every race, the content of the sub tabs is rendered by a
+    # callback as well
+    return [
         dcc.Tabs(
-            id=mainrace + "-tabs", 
-            value=mainrace + "-tab-total", 
+            id="race-tabs", 
+            value="total", 
             children=[
-                dcc.Tab(label="Total", value=mainrace + "-tab-total"),
-                dcc.Tab(label="By Enemy Race", value=mainrace + "-tab-race"),
-                dcc.Tab(label="By Map", value=mainrace + "-tab-map"),
+                dcc.Tab(label="Total", value="total"),
+                dcc.Tab(label="By Enemy Race", value="race"),
+                dcc.Tab(label="By Map", value="map"),
             ],
-        )
+        ),
+        html.Div(id="race-tab-content", style={'margin': 10}),
     ]
-    content.append(html.Div(id=mainrace + "-content-total", children=[
+
+@fragments.memoize
+def get_race_tab_content(stats, tab):
+    if tab == 'race':
+        return get_enemy_race_content(stats)
+    elif tab == 'map':
+        return get_map_content(stats)
+    return [
         generate_table_by_race(stats, "race"),
         generate_table_by_map(stats, "map"),
         html.Div(children=[
@@ -115,66 +123,72 @@ def get_race_content(stats, mainrace):
             ],
             style={'width':"100%", "display": "inline-block"},
         )
-    ]))
-    content_race = []
+    ]
+
+def get_enemy_race_content(stats):
     dropdownValues = []
     for race in list(ALL_RACES.keys()):
         if(race in stats['race']):
             dropdownValues.append({'label': race.title(), 'value': race})
-            content_race.append(html.Div(id=mainrace + "-content-" + race, children=[
-                generate_table_by_map(stats['race'][race], "maps"),
-                html.Div(children=[
-                        html.Div(generate_lengths(stats['race'][race], 'graph-lengths-' + race),style={"display": "inline-block"}),
-                        html.Div(generate_hours(stats['race'][race], 'graph-hours-' + race),style={"display": "inline-block"}),
-                        html.Div(generate_days(stats['race'][race], 'graph-days-' + race),style={"display": "inline-block"}),
-                    ],
-                    style={'width':"100%", "display": "inline-block"},
-                )
-            ]))
 
-    if(len(dropdownValues)>0):
-        race_dropdown = dcc.Dropdown(
-                id=mainrace + '-race-dropdown',
-                options=dropdownValues,
-                value=dropdownValues[0]['value'],
-                clearable=False,
-                searchable=False,
-                style={"margin":2},
-        )
-        content_race = [race_dropdown] + content_race
-
-    content.append(html.Div(id=mainrace+"-content-race", children=content_race))
+    if(len(dropdownValues)==0):
+        return []
+    race_dropdown = dcc.Dropdown(
+            id='race-dropdown',
+            options=dropdownValues,
+            value=dropdownValues[0]['value'],
+            clearable=False,
+            searchable=False,
+            style={"margin":2},
+    )
+    return [race_dropdown, html.Div(id="race-panel")]
 
-    content_map = []
+def get_map_content(stats):
     dropdownValues = []
     for mapname in stats['map']:
         dropdownValues.append({'label': ALL_MAPS[mapname], 'value': mapname})
-        content_map.append(html.Div(id=mainrace + "-content-" + mapname, children=[
-            generate_table_by_race(stats['map'][mapname], "enemy_races"),
-            html.Div(children=[
-                    html.Div(generate_lengths(stats['map'][mapname], 'graph-lengths-' + mapname),style={"display": "inline-block"}),
-                    html.Div(generate_hours(stats['map'][mapname], 'graph-hours-' + mapname),style={"display": "inline-block"}),
-                    html.Div(generate_days(stats['map'][mapname], 'graph-days-' + mapname),style={"display": "inline-block"}),
-                ],
-                style={'width':"100%", "display": "inline-block"},
-            )
-        ]))
 
-    if(len(dropdownValues)>0):
-        map_dropdown = dcc.Dropdown(
-                id=mainrace + '-map-dropdown',
-                options=dropdownValues,
-                value=dropdownValues[0]['value'],
-                clearable=False,
-                searchable=False,
-                style={"margin":2},
-        )
-        content_map = [map_dropdown] + content_map
+    if(len(dropdownValues)==0):
+        return []
+    map_dropdown = dcc.Dropdown(
+            id='map-dropdown',
+            options=dropdownValues,
+            value=dropdownValues[0]['value'],
+            clearable=False,
+            searchable=False,
+            style={"margin":2},
+    )
+    return [map_dropdown, html.Div(id="map-panel")]
 
-    content.append(html.Div(id=mainrace+"-content-map", children=content_map))
+@fragments.memoize
+def get_enemy_race_panel(stats, race):
+    # stats of the main race, the panel shows the games against race
+    return html.Div(children=[
+        generate_table_by_map(stats['race'][race], "maps"),
+        html.Div(children=[
+                html.Div(generate_lengths(stats['race'][race], 'graph-lengths-' + race),style={"display": "inline-block"}),
+                html.Div(generate_hours(stats['race'][race], 'graph-hours-' + race),style={"display": "inline-block"}),
+                html.Div(generate_days(stats['race'][race], 'graph-days-' + race),style={"display": "inline-block"}),
+            ],
+            style={'width':"100%", "display": "inline-block"},
+        )
+    ])
 
-    return content
+@fragments.memoize
+def get_map_panel(stats, mapname):
+    # stats of the main race, the panel shows the games on mapname
+    return html.Div(children=[
+        generate_table_by_race(stats['map'][mapname], "enemy_races"),
+        html.Div(children=[
+                html.Div(generate_lengths(stats['map'][mapname], 'graph-lengths-' + mapname),style={"display": "inline-block"}),
+                html.Div(generate_hours(stats['map'][mapname], 'graph-hours-' + mapname),style={"display": "inline-block"}),
+                html.Div(generate_days(stats['map'][mapname], 'graph-days-' + mapname),style={"display": "inline-block"}),
+            ],
+            style={'width':"100%", "display": "inline-block"},
+        )
+    ])
 
+@fragments.memoize
 def generate_table_by_race(stats, racekey):
     header = [html.Tr([
         html.Th('vs'),
@@ -221,6 +235,7 @@ def generate_table_by_race(stats, racekey):
         className="table",
     )
 
+@fragments.memoize
 def generate_table_by_map(stats, mapkey):
     header = [html.Tr([
         html.Th('Map'),
@@ -263,6 +278,7 @@ def generate_table_by_map(stats, mapkey):
         className="table",
     )
 
+@fragments.memoize
 def generate_lengths(stats, id):
     x = ['0-10 min', '10-20 min', '20-30 min', '> 30 min']
     p = []
@@ -302,6 +318,7 @@ def generate_lengths(stats, id):
         style={'height':200, 'width': 500},
     )
 
+@fragments.memoize
 def generate_hours(stats, id):
     x = list(stats['hours'].keys())
     p = []
@@ -368,6 +385,7 @@ def generate_hours(stats, id):
         style={'height':200, 'width': 500},
     )
 
+@fragments.memoize
 def generate_days(stats, id):
     x = []
     p = []
@@ -435,6 +453,35 @@ def generate_days(stats, id):
         style={'height':200, 'width': 500},
     )
 
+def get_game_list_content(stats):
+    # the filters of the game list, the list itself is rendered by a callback
+    # whenever one of them changes
+    races = sorted(list(stats.keys()))
+    maps = sorted(set(mapname for race in races for mapname in stats[race]['map']))
+    enemy_races = [race for race in ALL_RACES if any(race in stats[r]['race'] for r in races)]
+    filters = html.Div(children=[
+            generate_filter_dropdown('list-race-dropdown', 'Race', [{'label': race.title(), 'value': race} for race in races]),
+            generate_filter_dropdown('list-enemy-race-dropdown', 'Enemy Race', [{'label': race.title(), 'value': race} for race in enemy_races]),
+            generate_filter_dropdown('list-map-dropdown', 'Map', [{'label': ALL_MAPS[mapname], 'value': mapname} for mapname in maps]),
+            generate_filter_dropdown('list-result-dropdown', 'Result', [{'label': 'Win', 'value': 'won'}, {'label': 'Loss', 'value': 'lost'}]),
+        ],
+        style={'display': 'flex'},
+    )
+    return [filters, html.Div(id='game-list')]
+
+def generate_filter_dropdown(id, placeholder, options):
+    return html.Div(
+        dcc.Dropdown(
+            id=id,
+            options=options,
+            placeholder=placeholder,
+            clearable=True,
+            searchable=False,
+        ),
+        style={'flex': 1, 'margin': 2},
+    )
+
+# not memoized, hashing the whole replay list costs as much as rendering it
 def get_full_game_list_content(rep_list):
     header = [html.Tr([
         html.Th('Game Date'),
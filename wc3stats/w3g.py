@@ -10,7 +10,9 @@ import sys
 import base64
 import zlib
 import struct
-from collections import namedtuple
+import itertools
+from array import array
+from collections import namedtuple, deque
 from .w3g_rs import RACES, SPEEDS, OBSERVER, FIXED_TEAMS, GAME_TYPES, STATUS, COLORS, AI_STRENGTH, SELECT_MODES, CHAT_MODES, NUMERIC_ITEM, ITEMS, ABILITY_FLAGS, ITEMS_TO_RACE
 
 WORD = 2   # bytes
@@ -46,15 +48,19 @@ if sys.version_info[0] < 3:
             f(*uo, **kw)
         return uprint
     print = umake(print)
-
-    # fake lru_cache
-    lru_cache = lambda maxsize=128, typed=False: lambda f: f
 else:
     b2i = lambda b: b if isinstance(b, int) else int.from_bytes(b, 'little')
-    from functools import lru_cache
 
 def nulltermstr(b):
-    """Returns the next null terminated string from bytes and its length."""
+    """Returns the next null terminated string from bytes and its length.
+    b may also be a memoryview, which is scanned in place rather than copied.
+    """
+    if isinstance(b, memoryview):
+        i = 0
+        while b[i] != 0:
+            i += 1
+        s = b[:i].tobytes().decode('utf-8')
+        return s, i
     i = b.find(NULLSTR)
     s = b[:i].decode('utf-8')
     return s, i
@@ -135,7 +141,7 @@ class Player(namedtuple('Player', ['id', 'name', 'race', 'ishost',
         else:
             raise ValueError("Player not recognized custom or ladder.")
         kw['size'] = n
-        kw['raw'] = data[:n]
+        kw['raw'] = bytes(data[:n])
         return cls(**kw)
 
 class SlotRecord(namedtuple('Player', ['player_id', 'status', 'ishuman', 'team', 
@@ -159,20 +165,32 @@ class SlotRecord(namedtuple('Player', ['player_id', 'status', 'ishuman', 'team',
               'race': RACES.get(b2i(data[6]), 'none'),
               }
         kw['size'] = size = len(data)
-        kw['raw'] = data
+        kw['raw'] = bytes(data)
         if 8 <= size:
             kw['ai'] = AI_STRENGTH[b2i(data[7])]
         if 9 <= size:
             kw['handicap'] = b2i(data[8])
         return cls(**kw)
 
+class EventContext(namedtuple('EventContext', ['build_num', 'names'])):
+    """The parts of a replay that events need to describe themselves: the
+    build number and a player id to name map. All events of a File share one
+    context instead of referencing the File itself.
+    """
+    __slots__ = ()
+
+    def player_name(self, pid):
+        return self.names.get(pid, 'unknown')
+
 class Event(object):
     """An event base class."""
 
+    __slots__ = ('ctx', 'time')
+
     apm = False
 
     def __init__(self, f):
-        self.f = f
+        self.ctx = f.context
         self.time = f.clock
 
     def strtime(self):
@@ -190,6 +208,8 @@ class Event(object):
 
 class Chat(Event):
 
+    __slots__ = ('player_id', 'mode', 'msg')
+
     apm = False
 
     def __init__(self, f, player_id, mode, msg):
@@ -200,7 +220,7 @@ class Chat(Event):
 
     def __str__(self):
         t = self.strtime()
-        p = self.f.player_name(self.player_id)
+        p = self.ctx.player_name(self.player_id)
         m = self.strmode()
         return "[{t}] <{m}> {p}: {msg}".format(t=t, p=p, m=m, msg=self.msg)
 
@@ -209,10 +229,12 @@ class Chat(Event):
         if not mode.startswith('player'):
             return mode
         pid = int(mode[6:])
-        return self.f.player_name(pid)
+        return self.ctx.player_name(pid)
 
 class LeftGame(Event):
 
+    __slots__ = ('player_id', 'closedby', 'resultflag', 'inc', 'unknownflag', 'next')
+
     apm = False
 
     remote_results = {
@@ -250,7 +272,7 @@ class LeftGame(Event):
 
     def __str__(self):
         t = self.strtime()
-        p = self.f.player_name(self.player_id)
+        p = self.ctx.player_name(self.player_id)
         r = self.result()
         rtn = "[{t}] <{cb}> {p} left game, {r}"
         return rtn.format(t=t, p=p, cb=self.closedby, r=r)
@@ -274,6 +296,8 @@ class LeftGame(Event):
 
 class Countdown(Event):
 
+    __slots__ = ('mode', 'secs')
+
     apm = False
 
     def __init__(self, f, mode, secs):
@@ -288,6 +312,8 @@ class Countdown(Event):
 
 class Action(Event):
 
+    __slots__ = ('player_id',)
+
     le = -1
     id = -1
     size = 1
@@ -297,9 +323,16 @@ class Action(Event):
         super(Action, self).__init__(f)
         self.player_id = player_id
 
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        """Returns the size of the action at the start of action_block
+        without decoding it.
+        """
+        return cls.size
+
     def __str__(self):
         t = self.strtime()
-        p = self.f.player_name(self.player_id)
+        p = self.ctx.player_name(self.player_id)
         rtn = "[{t}] <{c}> {p}"
         return rtn.format(t=t, c=self.__class__.__name__, p=p)
 
@@ -310,6 +343,8 @@ class Action(Event):
 
 class Pause(Action):
 
+    __slots__ = ()
+
     id = 0x01
     apm = False
 
@@ -318,6 +353,8 @@ class Pause(Action):
 
 class Resume(Action):
 
+    __slots__ = ()
+
     id = 0x02
     apm = False
 
@@ -326,6 +363,8 @@ class Resume(Action):
 
 class SetGameSpeed(Action):
 
+    __slots__ = ('speed',)
+
     id = 0x03
     size = 2
     apm = False
@@ -340,6 +379,8 @@ class SetGameSpeed(Action):
 
 class IncreaseGameSpeed(Action):
 
+    __slots__ = ()
+
     id = 0x04
     apm = False
 
@@ -348,6 +389,8 @@ class IncreaseGameSpeed(Action):
 
 class DecreaseGameSpeed(Action):
 
+    __slots__ = ()
+
     id = 0x05
     apm = False
 
@@ -356,8 +399,9 @@ class DecreaseGameSpeed(Action):
 
 class SaveGame(Action):
 
+    __slots__ = ('name', 'size')
+
     id = 0x06
-    size = None
     apm = False
 
     def __init__(self, f, player_id, action_block):
@@ -365,12 +409,19 @@ class SaveGame(Action):
         self.name, n = nulltermstr(action_block[1:])
         self.size = 1 + n + 1
 
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        _, n = nulltermstr(action_block[1:])
+        return 1 + n + 1
+
     def __str__(self):
         s = super(SaveGame, self).__str__()
         return '{0} - {1}'.format(s, self.name)
 
 class SaveGameFinished(Action):
 
+    __slots__ = ()
+
     id = 0x07
     size = 5
     apm = False
@@ -380,6 +431,8 @@ class SaveGameFinished(Action):
 
 class Ability(Action):
 
+    __slots__ = ('flags', 'ability', 'size')
+
     id = 0x10
     apm = True
 
@@ -389,13 +442,18 @@ class Ability(Action):
         o = 1 if f.build_num < BUILD_1_13 else WORD
         self.flags = b2i(action_block[offset:offset+o])
         offset += o
-        self.ability = ability = action_block[offset:offset+DWORD]
+        self.ability = ability = bytes(action_block[offset:offset+DWORD])
         if ability[-2:] != NUMERIC_ITEM:
             self.ability = ability[::-1]
         offset += DWORD
         offset += 2 * DWORD if f.build_num >= BUILD_1_07 else 0
         self.size = offset
 
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        size = 1 + (1 if build_num < BUILD_1_13 else WORD) + DWORD
+        return size + (2 * DWORD if build_num >= BUILD_1_07 else 0)
+
     def __str__(self):
         s = super(Ability, self).__str__()
         aflgs = ABILITY_FLAGS.get(self.flags, None)
@@ -404,6 +462,8 @@ class Ability(Action):
 
 class AbilityPosition(Ability):
 
+    __slots__ = ('loc',)
+
     id = 0x11
     apm = True
 
@@ -417,6 +477,10 @@ class AbilityPosition(Ability):
         self.loc = (x, y)
         self.size = offset
 
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        return super(AbilityPosition, cls).block_size(build_num, action_block) + 2*DWORD
+
     def __str__(self):
         s = super(AbilityPosition, self).__str__()
         return '{0} at ({1:.3%}, {2:.3%})'.format(s, self.loc[0]/MAXPOS, 
@@ -424,16 +488,22 @@ class AbilityPosition(Ability):
 
 class AbilityPositionObject(AbilityPosition):
 
+    __slots__ = ('object',)
+
     id = 0x12
     apm = True
 
     def __init__(self, f, player_id, action_block):
         super(AbilityPositionObject, self).__init__(f, player_id, action_block)
         offset = self.size
-        self.object = action_block[offset:offset+2*DWORD]
+        self.object = bytes(action_block[offset:offset+2*DWORD])
         offset += 2*DWORD
         self.size = offset
 
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        return super(AbilityPositionObject, cls).block_size(build_num, action_block) + 2*DWORD
+
     def _super_str(self):
         return super(AbilityPositionObject, self).__str__()
 
@@ -443,16 +513,22 @@ class AbilityPositionObject(AbilityPosition):
 
 class GiveItem(AbilityPositionObject):
 
+    __slots__ = ('item',)
+
     id = 0x13
     apm = True
 
     def __init__(self, f, player_id, action_block):
         super(GiveItem, self).__init__(f, player_id, action_block)
         offset = self.size
-        self.item = action_block[offset:offset+2*DWORD]
+        self.item = bytes(action_block[offset:offset+2*DWORD])
         offset += 2*DWORD
         self.size = offset
 
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        return super(GiveItem, cls).block_size(build_num, action_block) + 2*DWORD
+
     def __str__(self):
         s = super(GiveItem, self)._super_str()
         return '{0} {1} -> {2}'.format(s, self.obj(self.item), 
@@ -460,6 +536,8 @@ class GiveItem(AbilityPositionObject):
 
 class DoubleAbility(AbilityPosition):
 
+    __slots__ = ('ability1', 'loc1', 'ability2', 'loc2')
+
     id = 0x14
     apm = True
 
@@ -468,7 +546,7 @@ class DoubleAbility(AbilityPosition):
         self.ability1 = self.ability
         self.loc1 = self.loc
         offset = self.size
-        self.ability2 = ability2 = action_block[offset:offset+DWORD]
+        self.ability2 = ability2 = bytes(action_block[offset:offset+DWORD])
         offset += DWORD
         if ability2[-2:] != NUMERIC_ITEM:
             self.ability2 = ability2[::-1]
@@ -480,6 +558,11 @@ class DoubleAbility(AbilityPosition):
         self.loc2 = (x2, y2)
         self.size = offset
 
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        size = super(DoubleAbility, cls).block_size(build_num, action_block)
+        return size + DWORD + 9 + 2*DWORD
+
     def __str__(self):
         s = super(DoubleAbility, self).__str__()
         loc2str = ''
@@ -491,8 +574,10 @@ class DoubleAbility(AbilityPosition):
 
 class ChangeSelection(Action):
 
+    __slots__ = ('mode', 'objects', 'size', 'apm')
+
     id = 0x16
-    apm = True
+    # apm is set per instance, a select right after a deselect is not counted
 
     modes = {0x01: 'Select', 0x02: 'Deselect'}
 
@@ -502,15 +587,20 @@ class ChangeSelection(Action):
         n = b2i(action_block[2:2+WORD])
         self.size = 4 + 8*n
         objs = action_block[4:]
-        self.objects = [objs[i:i+8] for i in range(n)]
-        self.calc_apm()
+        self.objects = [bytes(objs[i:i+8]) for i in range(n)]
+        self.apm = True
+        self.calc_apm(f)
+
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        return 4 + 8*b2i(action_block[2:2+WORD])
 
-    def calc_apm(self):
+    def calc_apm(self, f):
         if self.mode == 0x02:
             return
-        if len(self.f.events) == 0:
+        last = f._lastevent
+        if last is None:
             return
-        last = self.f.events[-1]
         if last.player_id != self.player_id:
             return
         if not isinstance(last, ChangeSelection):
@@ -526,6 +616,8 @@ class ChangeSelection(Action):
 
 class AssignGroupHotkey(Action):
 
+    __slots__ = ('hotkey', 'objects', 'size')
+
     id = 0x17
     apm = True
 
@@ -535,7 +627,11 @@ class AssignGroupHotkey(Action):
         n = b2i(action_block[2:2+WORD])
         self.size = 4 + 8*n
         objs = action_block[4:]
-        self.objects = [objs[i:i+8] for i in range(n)]
+        self.objects = [bytes(objs[i:i+8]) for i in range(n)]
+
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        return 4 + 8*b2i(action_block[2:2+WORD])
 
     def __str__(self):
         s = super(AssignGroupHotkey, self).__str__()
@@ -544,6 +640,8 @@ class AssignGroupHotkey(Action):
 
 class SelectGroupHotkey(Action):
 
+    __slots__ = ('hotkey',)
+
     id = 0x18
     size = 3
     apm = True
@@ -558,11 +656,14 @@ class SelectGroupHotkey(Action):
 
 class SelectSubgroup(Action):
 
+    __slots__ = ('subgroup', 'ability', 'object', 'size', 'apm')
+
     id = 0x19
-    apm = False
+    # apm is set per instance, it depends on the build and the subgroup
 
     def __init__(self, f, player_id, action_block):
         super(SelectSubgroup, self).__init__(f, player_id, action_block)
+        self.apm = False
         if f.build_num < BUILD_1_14B:
             self.size = 2 
             self.subgroup = b2i(action_block[1])
@@ -571,16 +672,20 @@ class SelectSubgroup(Action):
         else:
             self.size = 13
             offset = 1
-            self.ability = ability = action_block[offset:offset+DWORD]
+            self.ability = ability = bytes(action_block[offset:offset+DWORD])
             offset += DWORD
             if ability[-2:] != NUMERIC_ITEM:
                 self.ability = ability[::-1]
-            self.object = action_block[offset:offset+2*DWORD]
+            self.object = bytes(action_block[offset:offset+2*DWORD])
             offset += 2*DWORD
 
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        return 2 if build_num < BUILD_1_14B else 13
+
     def __str__(self):
         s = super(SelectSubgroup, self).__str__()
-        if self.f.build_num < BUILD_1_14B:
+        if self.ctx.build_num < BUILD_1_14B:
             return '{0} - #{1}'.format(s, self.subgroup)
         else:
             return '{0} - {1} {2}'.format(s, 
@@ -588,6 +693,8 @@ class SelectSubgroup(Action):
 
 class PreSubselect(Action):
 
+    __slots__ = ()
+
     id = 0x1A
     apm = False
 
@@ -596,6 +703,8 @@ class PreSubselect(Action):
 
 class UnknownAction(Action):
 
+    __slots__ = ()
+
     #  <=1.14b, >1.14b
     le = BUILD_1_14B
     id = (0x1A, 0x1B)
@@ -607,6 +716,8 @@ class UnknownAction(Action):
 
 class SelectGroundItem(Action):
 
+    __slots__ = ('item',)
+
     #  <=1.14b, >1.14b
     le = BUILD_1_14B
     id = (0x1B, 0x1C)
@@ -615,7 +726,7 @@ class SelectGroundItem(Action):
 
     def __init__(self, f, player_id, action_block):
         super(SelectGroundItem, self).__init__(f, player_id, action_block)
-        self.item = action_block[2:10]
+        self.item = bytes(action_block[2:10])
 
     def __str__(self):
         s = super(SelectGroundItem, self).__str__()
@@ -623,6 +734,8 @@ class SelectGroundItem(Action):
 
 class CancelHeroRevival(Action):
 
+    __slots__ = ('hero',)
+
     #  <=1.14b, >1.14b
     le = BUILD_1_14B
     id = (0x1C, 0x1D)
@@ -631,7 +744,7 @@ class CancelHeroRevival(Action):
 
     def __init__(self, f, player_id, action_block):
         super(CancelHeroRevival, self).__init__(f, player_id, action_block)
-        self.hero = action_block[1:9]
+        self.hero = bytes(action_block[1:9])
 
     def __str__(self):
         s = super(CancelHeroRevival, self).__str__()
@@ -639,6 +752,8 @@ class CancelHeroRevival(Action):
 
 class RemoveUnitFromBuildingQueue(Action):
 
+    __slots__ = ('pos', 'unit')
+
     #  <=1.14b, >1.14b
     le = BUILD_1_14B
     id = (0x1D, 0x1E)
@@ -648,7 +763,7 @@ class RemoveUnitFromBuildingQueue(Action):
     def __init__(self, f, player_id, action_block):
         super(RemoveUnitFromBuildingQueue, self).__init__(f, player_id, action_block)
         self.pos = b2i(action_block[1])
-        self.unit = unit = action_block[2:2+DWORD]
+        self.unit = unit = bytes(action_block[2:2+DWORD])
         if unit[-2:] != NUMERIC_ITEM:
             self.unit = unit[::-1]
 
@@ -659,6 +774,8 @@ class RemoveUnitFromBuildingQueue(Action):
 
 class RareUnknownAction(Action):
 
+    __slots__ = ()
+
     id = 0x21
     size = 9
     apm = False
@@ -668,6 +785,8 @@ class RareUnknownAction(Action):
 
 class TheDudeAbides(Action):
 
+    __slots__ = ()
+
     id = 0x20
     size = 1
     apm = False
@@ -677,6 +796,8 @@ class TheDudeAbides(Action):
 
 class SomebodySetUpUsTheBomb(Action):
 
+    __slots__ = ()
+
     id = 0x22
     size = 1
     apm = False
@@ -686,6 +807,8 @@ class SomebodySetUpUsTheBomb(Action):
 
 class WarpTen(Action):
 
+    __slots__ = ()
+
     id = 0x23
     size = 1
     apm = False
@@ -695,6 +818,8 @@ class WarpTen(Action):
 
 class IocainePowder(Action):
 
+    __slots__ = ()
+
     id = 0x24
     size = 1
     apm = False
@@ -704,6 +829,8 @@ class IocainePowder(Action):
 
 class PointBreak(Action):
 
+    __slots__ = ()
+
     id = 0x25
     size = 1
     apm = False
@@ -713,6 +840,8 @@ class PointBreak(Action):
 
 class WhosYourDaddy(Action):
 
+    __slots__ = ()
+
     id = 0x26
     size = 1
     apm = False
@@ -722,6 +851,8 @@ class WhosYourDaddy(Action):
 
 class KeyserSoze(Action):
 
+    __slots__ = ('gold',)
+
     id = 0x27
     size = 6
     apm = False
@@ -736,6 +867,8 @@ class KeyserSoze(Action):
 
 class LeafitToMe(Action):
 
+    __slots__ = ('lumber',)
+
     id = 0x28
     size = 6
     apm = False
@@ -750,6 +883,8 @@ class LeafitToMe(Action):
 
 class ThereIsNoSpoon(Action):
 
+    __slots__ = ()
+
     id = 0x2
     size = 1
     apm = False
@@ -759,6 +894,8 @@ class ThereIsNoSpoon(Action):
 
 class StrengthAndHonor(Action):
 
+    __slots__ = ()
+
     id = 0x2A
     size = 1
     apm = False
@@ -768,6 +905,8 @@ class StrengthAndHonor(Action):
 
 class ItVexesMe(Action):
 
+    __slots__ = ()
+
     id = 0x2B
     size = 1
     apm = False
@@ -777,6 +916,8 @@ class ItVexesMe(Action):
 
 class WhoIsJohnGalt(Action):
 
+    __slots__ = ()
+
     id = 0x2C
     size = 1
     apm = False
@@ -786,6 +927,8 @@ class WhoIsJohnGalt(Action):
 
 class GreedIsGood(Action):
 
+    __slots__ = ('gold', 'lumber')
+
     id = 0x2D
     size = 6
     apm = False
@@ -800,6 +943,8 @@ class GreedIsGood(Action):
 
 class DayLightSavings(Action):
 
+    __slots__ = ()
+
     id = 0x2E
     size = 5
     apm = False
@@ -810,6 +955,8 @@ class DayLightSavings(Action):
 
 class ISeeDeadPeople(Action):
 
+    __slots__ = ()
+
     id = 0x2F
     size = 1
     apm = False
@@ -819,6 +966,8 @@ class ISeeDeadPeople(Action):
 
 class Synergy(Action):
 
+    __slots__ = ()
+
     id = 0x30
     size = 1
     apm = False
@@ -828,6 +977,8 @@ class Synergy(Action):
 
 class SharpAndShiny(Action):
 
+    __slots__ = ()
+
     id = 0x31
     size = 1
     apm = False
@@ -837,6 +988,8 @@ class SharpAndShiny(Action):
 
 class AllYourBaseAreBelongToUs(Action):
 
+    __slots__ = ()
+
     id = 0x32
     size = 1
     apm = False
@@ -846,6 +999,8 @@ class AllYourBaseAreBelongToUs(Action):
 
 class ChangeAllyOptions(Action):
 
+    __slots__ = ('ally_id', 'flags_bits')
+
     id = 0x50
     size = 6
     apm = False
@@ -864,7 +1019,7 @@ class ChangeAllyOptions(Action):
             fs.append('shares vision')
         if b[6]:
             fs.append('shares unit control')
-        svi = 10 if self.f.build_num >= BUILD_1_07 else 9
+        svi = 10 if self.ctx.build_num >= BUILD_1_07 else 9
 
         if b[svi]:
             fs.append('shares victory')
@@ -874,11 +1029,13 @@ class ChangeAllyOptions(Action):
 
     def __str__(self):
         s = super(ChangeAllyOptions, self).__str__()
-        a = self.f.player_name(self.ally_id)
+        a = self.ctx.player_name(self.ally_id)
         return '{0} {1} with {2}'.format(s, self.flagstr(), a)
 
 class TransferResources(Action):
 
+    __slots__ = ('ally_id', 'gold', 'lumber')
+
     id = 0x51
     size = 10
     apm = False
@@ -893,12 +1050,14 @@ class TransferResources(Action):
 
     def __str__(self):
         s = super(TransferResources, self).__str__()
-        a = self.f.player_name(self.ally_id)
+        a = self.ctx.player_name(self.ally_id)
         return '{0} transfered {1} gold and {2} lumber to {3}'.format(s, self.gold, 
                                                                       self.lumber, a)
 
 class MapTriggerChatCommand(Action):
 
+    __slots__ = ('size',)
+
     id = 0x60
     apm = False
 
@@ -908,8 +1067,16 @@ class MapTriggerChatCommand(Action):
         s, i = nulltermstr(action_block[offset:])
         self.size = offset + i + 1
 
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        offset = 1 + 2*DWORD
+        _, i = nulltermstr(action_block[offset:])
+        return offset + i + 1
+
 class EscapePressed(Action):
 
+    __slots__ = ()
+
     id = 0x61
     size = 1
     apm = True
@@ -919,15 +1086,23 @@ class EscapePressed(Action):
 
 class ScenarioTrigger(Action):
 
+    __slots__ = ('size',)
+
     id = 0x62
     apm = False
 
     def __init__(self, f, player_id, action_block):
         super(ScenarioTrigger, self).__init__(f, player_id, action_block)
-        self.size = 13 if self.f.build_num >= BUILD_1_07 else 9
+        self.size = 13 if f.build_num >= BUILD_1_07 else 9
+
+    @classmethod
+    def block_size(cls, build_num, action_block):
+        return 13 if build_num >= BUILD_1_07 else 9
 
 class HeroSkillSubmenu(Action):
 
+    __slots__ = ()
+
     le = BUILD_1_06
     id = (0x65, 0x66)
     size = 1
@@ -938,6 +1113,8 @@ class HeroSkillSubmenu(Action):
 
 class BuildingSubmenu(Action):
 
+    __slots__ = ()
+
     le = BUILD_1_06
     id = (0x66, 0x67)
     size = 1
@@ -948,6 +1125,8 @@ class BuildingSubmenu(Action):
 
 class MinimapSignal(Action):
 
+    __slots__ = ('loc',)
+
     le = BUILD_1_06
     id = (0x67, 0x68)
     size = 13
@@ -969,6 +1148,8 @@ class MinimapSignal(Action):
 
 class ContinueGameB(Action):
 
+    __slots__ = ()
+
     le = BUILD_1_06
     id = (0x68, 0x69)
     size = 17
@@ -979,6 +1160,8 @@ class ContinueGameB(Action):
 
 class ContinueGameA(Action):
 
+    __slots__ = ()
+
     le = BUILD_1_06
     id = (0x69, 0x6A)
     size = 17
@@ -989,6 +1172,8 @@ class ContinueGameA(Action):
 
 class UnknownScenario(Action):
 
+    __slots__ = ()
+
     id = 0x75
     size = 2
     apm = False
@@ -1010,6 +1195,95 @@ ACTIONS_GT_1_14B = {a.id[1]: a for a in _locs.values() if hasattr(a, 'id') and \
                                     isinstance(a.id, tuple) and a.le == BUILD_1_14B}
 del _locs
 
+# merged dispatch tables, one per build number range
+_ACTION_TABLES = {}
+
+def action_table(build_num):
+    """Returns a 256 entry list mapping action ids to action classes (or None)
+    for the given build number. Tables are built once per build range.
+    """
+    key = (build_num <= BUILD_1_06, build_num <= BUILD_1_14B)
+    table = _ACTION_TABLES.get(key, None)
+    if table is None:
+        actions = dict(ACTIONS)
+        actions.update(ACTIONS_LE_1_06 if key[0] else ACTIONS_GT_1_06)
+        actions.update(ACTIONS_LE_1_14B if key[1] else ACTIONS_GT_1_14B)
+        table = [None] * 256
+        for aid, action in actions.items():
+            table[aid] = action
+        _ACTION_TABLES[key] = table
+    return table
+
+# actions whose raw bytes go to the payload side table of an EventTable
+VARIABLE_SIZE_ACTIONS = (SaveGame, ChangeSelection, AssignGroupHotkey, MapTriggerChatCommand)
+
+class EventTable(object):
+    """Columnar representation of the events of a replay, built directly by
+    the parser without creating event objects. Row i of each column belongs
+    to the i-th event.
+
+    Attributes
+    ----------
+    time : event time in ms
+    player_id : player id, 0 for events without a player (countdown)
+    block_id : id of the replay block the event came from (0x1F for actions)
+    action_id : action id, 0 for non-action events
+    apm : 1 if the event counts towards the APM
+    ability : ability / item id as uint32, 0 if the event has none
+    x, y : location, nan if the event has none
+    payload : index into payloads, -1 if the event has none
+    payloads : side table of variable-length data; raw bytes for variable
+        size actions and a tuple of the event fields for non-action events
+    """
+
+    def __init__(self):
+        self.time = array('I')
+        self.player_id = array('B')
+        self.block_id = array('B')
+        self.action_id = array('B')
+        self.apm = array('B')
+        self.ability = array('I')
+        self.x = array('f')
+        self.y = array('f')
+        self.payload = array('i')
+        self.payloads = []
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, time, player_id, block_id, action_id=0, apm=False, ability=0,
+               x=float('nan'), y=float('nan'), payload=None):
+        self.time.append(time)
+        self.player_id.append(player_id)
+        self.block_id.append(block_id)
+        self.action_id.append(action_id)
+        self.apm.append(apm)
+        self.ability.append(ability)
+        self.x.append(x)
+        self.y.append(y)
+        if payload is None:
+            self.payload.append(-1)
+        else:
+            self.payload.append(len(self.payloads))
+            self.payloads.append(payload)
+
+    def append_event(self, e):
+        """Appends a non-action event object."""
+        if isinstance(e, LeftGame):
+            self.append(e.time, e.player_id, 0x17, 
+                        payload=(e.closedby, e.resultflag, e.inc, e.unknownflag))
+        elif isinstance(e, Chat):
+            self.append(e.time, e.player_id, 0x20, payload=(e.mode, e.msg))
+        elif isinstance(e, Countdown):
+            self.append(e.time, 0, 0x2F, payload=(e.mode, e.secs))
+        else:
+            raise ValueError("cannot store event {0!r}".format(e))
+
+    def ability_id(self, i):
+        """Returns the ability of row i as bytes, as found in ITEMS."""
+        a = self.ability[i]
+        return None if a == 0 else struct.pack('<I', a)
+
 class File(object):
     """A class that represents w3g files.
 
@@ -1018,11 +1292,31 @@ class File(object):
     replay_length : game play time in ms
     """
 
-    def __init__(self, f):
+    def __init__(self, f, events=True, lazy=False, columnar=False, apm_only=False):
         """Parameters
         ----------
         f : file handle or str of path name
+        events : bool, optional
+            If False, only the header and the startup record (players, slot
+            records, map, game type, ...) are read. Just the first data
+            block(s) get decompressed and events stays empty.
+        lazy : bool, optional
+            If True, events are not materialized; events is None and
+            iter_events() decodes them on demand from the decompressed data.
+            clock stays 0 until iter_events() has been run to the end.
+        columnar : bool, optional
+            If True, events are stored in columns (an EventTable) instead of
+            event objects and events is None.
+        apm_only : bool, optional
+            If True, only the APM relevant actions per player are counted
+            (apm_counts) and the closing events needed by winner() are kept.
+            No action objects are created and events is None.
         """
+        self.lazy = lazy
+        self.columnar = columnar
+        self.apm_only = apm_only
+        self.apm_counts = None
+        self._data = None
         # init
         opened_here = False
         if isinstance(f, str):
@@ -1033,7 +1327,10 @@ class File(object):
 
         # read in
         self._read_header()
-        self._read_blocks()
+        if events:
+            self._read_blocks()
+        else:
+            self._read_startup()
 
         # clean up 
         if opened_here:
@@ -1080,6 +1377,7 @@ class File(object):
         else:
             raise ValueError("Header must be either v0 or v1, got v{0}".format(hv))
         self.build_num = b2i(f.read(WORD))
+        self._actions = action_table(self.build_num)
         self.flags = f.read(WORD)
         iflags = b2i(self.flags)
         self.singleplayer = (iflags == 0)
@@ -1087,10 +1385,10 @@ class File(object):
         self.replay_length = b2i(f.read(DWORD))
         self.header_checksum = b2i(f.read(DWORD))
 
-    def _read_blocks(self):
+    def _iter_blocks(self):
+        """Yields the decompressed data blocks one at a time."""
         f = self.f
         self.loc = self.header_size
-        data = b''
         for n in range(self.nblocks):
             block_size = b2i(f.read(WORD))
             block_size_decomp = b2i(f.read(WORD))
@@ -1103,32 +1401,253 @@ class File(object):
             dat = d.decompress(raw, block_size_decomp)
             if len(dat) != block_size_decomp:
                 raise zlib.error("Decompressed data size does not match expected size.")
+            yield dat
+
+    def _read_blocks(self):
+        # Decompress straight into one preallocated buffer rather than
+        # concatenating blocks, which copied the whole replay for every block.
+        data = bytearray(self.file_size_decompressed)
+        pos = 0
+        for dat in self._iter_blocks():
+            block_size_decomp = len(dat)
+            if pos + block_size_decomp > len(data):
+                # header size was too small, grow the buffer in place
+                data.extend(bytes(pos + block_size_decomp - len(data)))
+            data[pos:pos+block_size_decomp] = dat
+            pos += block_size_decomp
+        self._parse_blocks(memoryview(data)[:pos])
+
+    def _read_startup(self):
+        data = b''
+        error = None
+        for dat in self._iter_blocks():
             data += dat
-        self._parse_blocks(data)
+            try:
+                self._parse_startup(memoryview(data))
+            except (IndexError, KeyError, ValueError, AssertionError) as e:
+                # a slice past the end of the data is just short, the fields
+                # read from it fail in any of these ways while the startup
+                # record continues in the next block
+                error = e
+                continue
+            break
+        else:
+            if error is not None:
+                raise error
+            raise ValueError("Startup record is truncated.")
+        self.events = []
+        self.clock = 0
 
     def _parse_blocks(self, data):
-        self.events = []
+        # Walk a single memoryview with an integer cursor; slicing the view
+        # is zero-copy so parsing stays linear in the replay size.
+        self._data = memoryview(data)
+        self._events_offset = self._parse_startup(self._data)
         self.clock = 0
-        self._lastleft = None
-        _parsers = {
+        self._full_clock = 0
+        if self.columnar:
+            self.events = None
+            self.columns = self._scan_columns()
+            self._data = None
+        elif self.apm_only:
+            self.events = None
+            self._scan_apm()
+            self._data = None
+        elif self.lazy:
+            self.events = None
+        else:
+            self.events = list(self._iter_parse())
+            self._data = None
+
+    def _iter_parse(self):
+        """Decodes and yields the events following the startup record, one
+        block at a time. The parsing state (clock, last event, last
+        LeftGame) is kept in locals so that several iterations may be
+        interleaved. Between two blocks self.clock is the game length once
+        an iteration has run to the end and 0 before, a partial iteration
+        (e.g. by _guess_player_race) does not leave its clock behind.
+        """
+        data = self._data
+        _parsers = self._block_parsers()
+        clock, lastevent, lastleft = 0, None, None
+        offset = self._events_offset
+        blockid = data[offset]
+        while blockid != 0:
+            self.clock, self._lastevent, self._lastleft = clock, lastevent, lastleft
+            self._pending = pending = []
+            offset += _parsers[blockid](data, offset)
+            clock, lastevent, lastleft = self.clock, self._lastevent, self._lastleft
+            self.clock = self._full_clock
+            for e in pending:
+                yield e
+            blockid = data[offset]
+        self.clock = self._full_clock = clock
+
+    def _block_parsers(self):
+        return {
             0x17: self._parse_leave_game,
-            0x1A: lambda data: 5,
-            0x1B: lambda data: 5,
-            0x1C: lambda data: 5,
+            0x1A: lambda data, offset: 5,
+            0x1B: lambda data, offset: 5,
+            0x1C: lambda data, offset: 5,
             0x1E: self._parse_time_slot,  # old blockid
             0x1F: self._parse_time_slot,  # new blockid
             0x20: self._parse_chat,
-            0x22: lambda data: 6,
-            0x23: lambda data: 11,
+            0x22: lambda data, offset: 6,
+            0x23: lambda data, offset: 11,
             0x2F: self._parse_countdown,
             }
-        offset = self._parse_startup(data)
-        data = data[offset:]
-        blockid = b2i(data[0])
+
+    def _scan(self, scan_actions, add_event):
+        """Walks the blocks following the startup record without creating
+        action objects. scan_actions(player_id, action_block) is called for
+        every command of a time slot and add_event(e) for every other event.
+        """
+        data = self._data
+        _parsers = self._block_parsers()
+        self.clock, self._lastevent, self._lastleft = 0, None, None
+        self._last_deselect = None
+        offset = self._events_offset
+        blockid = data[offset]
         while blockid != 0:
-            offset = _parsers[blockid](data)
-            data = data[offset:]
-            blockid = b2i(data[0])
+            if blockid == 0x1E or blockid == 0x1F:
+                offset += self._parse_time_slot(data, offset, scan_actions)
+            else:
+                self._pending = pending = []
+                offset += _parsers[blockid](data, offset)
+                for e in pending:
+                    add_event(e)
+                    self._last_deselect = None
+            blockid = data[offset]
+
+    def _iter_raw_actions(self, action_block):
+        """Yields (action class, action bytes, size, apm) for every action of
+        a command without instantiating the actions.
+        """
+        actions = self._actions
+        build_num = self.build_num
+        player_id = self._scan_player_id
+        offset = 0
+        n = len(action_block)
+        while offset < n:
+            action = actions[action_block[offset]]
+            if action is None:
+                return
+            block = action_block[offset:]
+            size = action.block_size(build_num, block)
+            deselect = None
+            if action is ChangeSelection:
+                # a select right after a deselect of the same player is one action
+                apm = True
+                if block[1] == 0x02:
+                    deselect = player_id
+                elif self._last_deselect == player_id:
+                    apm = False
+            elif action is SelectSubgroup:
+                apm = build_num < BUILD_1_14B and block[1] != 0x00 and block[1] != 0xFF
+            else:
+                apm = action.apm
+            self._last_deselect = deselect
+            yield action, block, size, apm
+            offset += size
+
+    def _scan_columns(self):
+        """Decodes the events following the startup record into an
+        EventTable. Actions are read straight from the bytes.
+        """
+        table = EventTable()
+        scan_actions = lambda player_id, action_block: \
+                            self._scan_actions(table, player_id, action_block)
+        self._scan(scan_actions, table.append_event)
+        return table
+
+    def _scan_actions(self, table, player_id, action_block):
+        build_num = self.build_num
+        clock = self.clock
+        self._scan_player_id = player_id
+        for action, block, size, apm in self._iter_raw_actions(action_block):
+            ability = 0
+            x = y = float('nan')
+            payload = None
+            if issubclass(action, Ability):
+                o = 1 + (1 if build_num < BUILD_1_13 else WORD)
+                a = bytes(block[o:o+DWORD])
+                if a[-2:] != NUMERIC_ITEM:
+                    a = a[::-1]
+                ability = b2i(a)
+                if issubclass(action, AbilityPosition):
+                    o = Ability.block_size(build_num, block)
+                    x = b2f(block[o:o+DWORD])
+                    y = b2f(block[o+DWORD:o+2*DWORD])
+            elif action is SelectSubgroup and build_num >= BUILD_1_14B:
+                a = bytes(block[1:1+DWORD])
+                if a[-2:] != NUMERIC_ITEM:
+                    a = a[::-1]
+                ability = b2i(a)
+            elif action is MinimapSignal:
+                x = b2f(block[1:1+DWORD])
+                y = b2f(block[1+DWORD:1+2*DWORD])
+            if action in VARIABLE_SIZE_ACTIONS:
+                payload = bytes(block[:size])
+            table.append(clock, player_id, 0x1F, block[0], apm, ability, x, y, payload)
+
+    def _scan_apm(self):
+        """Counts the APM relevant actions per player straight from the bytes
+        and keeps the non-action events that winner() may look at.
+        """
+        counts = {p.id: 0 for p in self.players}
+        tail = deque(maxlen=300)
+        self._nevents = 0
+        def scan_actions(player_id, action_block):
+            self._scan_player_id = player_id
+            for action, block, size, apm in self._iter_raw_actions(action_block):
+                if apm:
+                    counts[player_id] += 1
+                self._nevents += 1
+        def add_event(e):
+            tail.append((self._nevents, e))
+            self._nevents += 1
+        self._scan(scan_actions, add_event)
+        self.apm_counts = counts
+        self._tail = list(tail)
+
+    def iter_events(self, count=False):
+        """Yields the events of the replay. For lazy files these are decoded
+        on demand, so only the event currently being looked at is kept alive.
+        Note that the result() of a LeftGame event is final only once the
+        next LeftGame event (or the end of the replay) has been reached.
+
+        With count the APM relevant actions per player and the last events
+        are collected on the way. Once the iteration has run to the end,
+        print_apm(), player_apm() and winner() use them instead of going
+        over the events again.
+        """
+        if self._data is None:
+            if self.events is None:
+                raise ValueError("Events are not kept for columnar or apm_only files.")
+            events = iter(self.events)
+        else:
+            events = self._iter_parse()
+        if count:
+            return self._iter_counted(events)
+        return events
+
+    def _iter_counted(self, events):
+        counts = {p.id: 0 for p in self.players}
+        tail = deque(maxlen=300)
+        n = 0
+        for e in events:
+            if e.apm:
+                counts[e.player_id] += 1
+            tail.append((n, e))
+            n += 1
+            yield e
+        self.apm_counts = counts
+        self._nevents = n
+        self._tail = list(tail)
+
+    def _emit(self, e):
+        self._pending.append(e)
+        self._lastevent = e
 
     def _parse_startup(self, data):
         offset = 4  # first four bytes have unknown meaning
@@ -1168,7 +1687,7 @@ class File(object):
         self.ispublic = (priv == 0x00)
         self.isprivate = (priv == 0x08)
         offset += WORD  # more buffer space
-        self.language_id = data[offset:offset+4]
+        self.language_id = bytes(data[offset:offset+4])
         offset += 4
         while b2i(data[offset]) == 0x16:
             self.players.append(Player.from_raw(data[offset:]))
@@ -1186,16 +1705,27 @@ class File(object):
         offset += recsize*nrecs
         self.slot_records = [SlotRecord.from_raw(rawrecs[n*recsize:(n+1)*recsize]) \
                              for n in range(nrecs)]
-        self.random_seed = data[offset:offset+DWORD]
+        self.random_seed = bytes(data[offset:offset+DWORD])
         offset += DWORD
         #self.select_mode = SELECT_MODES[b2i(data[offset])]
         offset += 1
         self.num_start_positions = b2i(data[offset])
         offset += 1
+        # per replay lookup tables, the first record of an id wins
+        self._players_by_id = {}
+        for p in self.players:
+            self._players_by_id.setdefault(p.id, p)
+        self._slot_records_by_id = {}
+        for sr in self.slot_records:
+            self._slot_records_by_id.setdefault(sr.player_id, sr)
+        self._player_races = {}
+        names = {pid: 'observer' for pid in self._slot_records_by_id}
+        names.update((pid, p.name) for pid, p in self._players_by_id.items())
+        self.context = EventContext(self.build_num, names)
         return offset
 
-    def _parse_leave_game(self, data):
-        offset = 1
+    def _parse_leave_game(self, data, offset):
+        offset += 1
         reason = b2i(data[offset:offset+DWORD])
         offset += DWORD
         player_id = b2i(data[offset])
@@ -1217,31 +1747,33 @@ class File(object):
         else: 
             closedby = 'unknown'
         e = LeftGame(self, player_id, closedby, res, inc, unknownflag)
-        self.events.append(e)
+        self._emit(e)
         if self._lastleft is not None:
             self._lastleft.next = e
         self._lastleft = e
         return 14
 
-    def _parse_time_slot(self, data):
-        n = b2i(data[1:1+WORD])
-        offset = 1 + WORD
+    def _parse_time_slot(self, data, offset, parse_actions=None):
+        if parse_actions is None:
+            parse_actions = self._parse_actions
+        n = b2i(data[offset+1:offset+1+WORD])
+        end = offset + n + 3
+        offset += 1 + WORD
         dt = b2i(data[offset:offset+WORD])
         offset += WORD
-        cmddata = data[offset:n+3]
-        while len(cmddata) > 0:
-            player_id = b2i(cmddata[0])
-            i = b2i(cmddata[1:1+WORD])
-            action_block = cmddata[1+WORD:i+1+WORD]
-            self._parse_actions(player_id, action_block)
-            cmddata = cmddata[i+1+WORD:]
+        while offset < end:
+            player_id = data[offset]
+            i = b2i(data[offset+1:offset+1+WORD])
+            offset += 1 + WORD
+            parse_actions(player_id, data[offset:offset+i])
+            offset += i
         self.clock += dt
         return n + 3
 
-    def _parse_chat(self, data):
-        player_id = b2i(data[1])
-        n = b2i(data[2:2+WORD])
-        offset = 2 + WORD
+    def _parse_chat(self, data, offset):
+        player_id = b2i(data[offset+1])
+        n = b2i(data[offset+2:offset+2+WORD])
+        offset += 2 + WORD
         flags = b2i(data[offset])
         offset += 1
         if flags == 0x10:
@@ -1253,88 +1785,77 @@ class File(object):
             if mode is None:
                 mode = 'player{0}'.format(m - 0x3)
         msg, _ = nulltermstr(data[offset:])
-        self.events.append(Chat(self, player_id, mode, msg))
+        self._emit(Chat(self, player_id, mode, msg))
         return n + 4
 
-    def _parse_countdown(self, data):
-        offset = 1
+    def _parse_countdown(self, data, offset):
+        offset += 1
         m = b2i(data[offset:offset+DWORD])
         offset += DWORD
         mode = 'running' if m == 0x00 else 'over'
         secs = b2i(data[offset:offset+DWORD])
         offset += DWORD
         e = Countdown(self, mode, secs)
-        self.events.append(e)
+        self._emit(e)
         return 9
 
     def _parse_actions(self, player_id, action_block):
-        actions = dict(ACTIONS)
-        actions.update(ACTIONS_LE_1_06 if self.build_num <= BUILD_1_06 \
-                       else ACTIONS_GT_1_06)
-        actions.update(ACTIONS_LE_1_14B if self.build_num <= BUILD_1_14B \
-                       else ACTIONS_GT_1_14B)
-        while len(action_block) > 0:
-            aid = b2i(action_block[0])
-            action = actions.get(aid, None)
+        actions = self._actions
+        offset = 0
+        n = len(action_block)
+        while offset < n:
+            action = actions[action_block[offset]]
             if action is None:
                 return 
-            e = action(self, player_id, action_block)
-            self.events.append(e)
-            action_block = action_block[e.size:]
+            e = action(self, player_id, action_block[offset:])
+            self._emit(e)
+            offset += e.size
 
-    @lru_cache(13)
     def slot_record(self, pid):
-        records = self.slot_records
-        for sr in records:
-            if sr.player_id == pid:
-                break
-        else:
+        sr = self._slot_records_by_id.get(pid, None)
+        if sr is None:
             raise ValueError("could not find slot record for player ID {0}".format(pid))
         return sr
 
-    @lru_cache(13)
     def player(self, pid):
-        players = self.players
-        if pid < len(players):
-            p = players[pid]
-            if p.id == pid:
-                return p
-        for p in players:
-            if p.id == pid:
-                break
-        else:
+        p = self._players_by_id.get(pid, None)
+        if p is None:
             p = self.slot_record(pid)
         return p
 
-    @lru_cache(13)
     def player_name(self, pid):
-        try:
-            p = self.player(pid)
-        except ValueError:
-            return "unknown"
-        if isinstance(p, SlotRecord):
-            return 'observer'
-        return p.name
-
-    @lru_cache(13)
+        return self.context.player_name(pid)
+
     def player_race(self, pid):
+        race = self._player_races.get(pid, None)
+        if race is None:
+            race = self._player_races[pid] = self._guess_player_race(pid)
+        return race
+
+    def _guess_player_race(self, pid):
         p = self.player(pid)
         if p.race == 'none' and isinstance(p, Player):
             p = self.slot_record(pid)
         if p.race == 'none':
             # guess race from the units used durring the first few seconds
-            for e in self.events[:50]:
+            for e in itertools.islice(self.iter_events(), 50):
                 if e.player_id != pid:
                     continue
                 if hasattr(e, 'ability') and e.ability in ITEMS_TO_RACE:
                     return ITEMS_TO_RACE[e.ability]
         return p.race
 
-    def print_apm(self):
+    def _apm_counts(self):
+        if self.apm_counts is not None:
+            return dict(self.apm_counts)
         acts = {p.id: 0 for p in self.players}
-        for e in self.events:
+        for e in self.iter_events():
             if e.apm:
                 acts[e.player_id] += 1
+        return acts
+
+    def print_apm(self):
+        acts = self._apm_counts()
         mins = self.clock / (60 * 1000.0)
         m = "Actions per minute over {0:.3} min".format(mins)
         print('-' * len(m))
@@ -1346,10 +1867,7 @@ class File(object):
 
     def player_apm(self):
         player_apm = {}
-        acts = {p.id: 0 for p in self.players}
-        for e in self.events:
-            if e.apm:
-                acts[e.player_id] += 1
+        acts = self._apm_counts()
         mins = self.clock / (60 * 1000.0)
         for pid, act in sorted(acts.items()):
             if act == 0:
@@ -1362,7 +1880,7 @@ class File(object):
         by actions per minute. 
         """
         acts = {p.id: ([0], [0]) for p in self.players}
-        for e in self.events:
+        for e in self.iter_events():
             if not e.apm:
                 continue
             t, a = acts[e.player_id]
@@ -1381,7 +1899,7 @@ class File(object):
         """
         nsteps = (dur//dt) + 1
         acts = {p.id: [0, 0] for p in self.players}
-        for e in self.events:
+        for e in self.iter_events():
             if not e.apm:
                 continue
             a = acts[e.player_id]
@@ -1393,8 +1911,21 @@ class File(object):
                                                   if len(a) > 2}
         return acts
 
+    def _event_tail(self):
+        """Returns the number of events and (index, event) pairs for the
+        last 300 events. For apm_only files the actions are left out.
+        """
+        if self.apm_counts is not None:
+            return self._nevents, self._tail
+        tail = deque(enumerate(self.iter_events()), 300)
+        n = tail[-1][0] + 1 if tail else 0
+        return n, list(tail)
+
     def winner(self):
-        for e in self.events[-1:-300:-1]:
+        # only the tail of the replay is needed
+        n, tail = self._event_tail()
+        last = [e for i, e in reversed(tail) if i >= n - 299]
+        for e in last:
             if not isinstance(e, LeftGame):
                 continue
             result = e.result()
@@ -1408,15 +1939,15 @@ class File(object):
         # if no one won or lost, find out who said gg and left
         players = {sr.player_id for sr in self.slot_records \
                    if sr.team < 12 and sr.player_id > 0}
-        for e in self.events[-1:-300:-1]:
+        for e in last:
             if not isinstance(e, LeftGame):
                 continue
             if e.player_id not in players:
                 continue
             if e.result() != 'left':
                 continue
-            chats = {c.msg.lower() for c in self.events[-300:] \
-                        if isinstance(c, Chat) and c.player_id == e.player_id}
+            chats = {c.msg.lower() for i, c in tail if i >= n - 300 \
+                        and isinstance(c, Chat) and c.player_id == e.player_id}
             if 'g' in chats or 'gg' in chats:
                 # is loser
                 winner = [pid for pid in players if pid != e.player_id][0]
@@ -1424,9 +1955,20 @@ class File(object):
         raise RuntimeError("Winner could not be found")
 
 def main():
-    f = File(sys.argv[1])
-    for event in f.events:
-        print(event)
+    # the result of a LeftGame is only final once the next LeftGame has been
+    # read, so each LeftGame is printed when the next one (or the end of the
+    # replay) is reached and every other event right away
+    f = File(sys.argv[1], lazy=True)
+    left = None
+    for event in f.iter_events(count=True):
+        if isinstance(event, LeftGame):
+            if left is not None:
+                print(left)
+            left = event
+        else:
+            print(event)
+    if left is not None:
+        print(left)
     f.print_apm()
     print('-' * 10)
     print('The winner is {0}'.format(f.player_name(f.winner())))
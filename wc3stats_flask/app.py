@@ -1,10 +1,12 @@
 import os
 import datetime
 import json
+import uuid
 from flask import Flask, request, session, g, redirect, url_for, abort, render_template, flash, jsonify
 from flask_assets import Bundle, Environment
 from dotenv import load_dotenv
-from .replay_handler import load_replay, get_statistics
+from .replay_handler import start_replay_job, get_statistics, load_session, save_session
+from .replay_jobs import get_job
 from .stats_layouter import get_stats_content
 from .exceptions import ImproperlyConfigured
 app = Flask(__name__)
@@ -40,23 +42,56 @@ def home():
 def upload():
     if request.method == 'POST':
         replay_files = request.files.getlist("replays")
-        session['dates'] = json.loads(request.form['dates'])
-        session['playerName'] = request.form['playerName']
+        dates = json.loads(request.form['dates'])
 
-        g.replays = []
-
-        for replay_file in replay_files:
-            if replay_file.filename in session['dates']:
-                timestamp = session['dates'][replay_file.filename]
-                replay = load_replay(replay_file, replay_file.filename, timestamp/1000.0)
-                g.replays.append(replay)
-                (g.stats_raw, g.rep_list) = get_statistics(g.replays, [session['playerName']])
-
-        g.stats_content = get_stats_content(g.stats_raw,g.rep_list)
-        return render_template("stats_only.html")
+        # the cookie only holds the id, the rest of the session is kept server side
+        session_id = session.setdefault('id', uuid.uuid4().hex)
+        job = start_replay_job(replay_files, dates)
+        if not save_session(session_id, {
+            'player_name': request.form['playerName'],
+            'dates': dates,
+            'job': job.id,
+            'replays': None,
+        }):
+            # the result could not be found again, let the client retry
+            abort(503)
+        return jsonify(job.status()), 202
     else:
         return redirect(url_for('home'))
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.status())
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = get_job(job_id)
+    data = load_session(session.get('id', ''))
+    if job is None or data is None or data['job'] != job_id:
+        abort(404)
+    if not job.done:
+        abort(409)
+    if data['replays'] is None:
+        # kept for /stats, which shows them again without an upload
+        data['replays'] = job.replays
+        save_session(session['id'], data)
+    (g.stats_raw, g.rep_list) = get_statistics(data['replays'], [data['player_name']])
+
+    g.stats_content = get_stats_content(g.stats_raw,g.rep_list)
+    return render_template("stats_only.html")
+
 @app.route('/stats')
 def stats():
-    return render_template("stats.html")
\ No newline at end of file
+    data = load_session(session.get('id', ''))
+    if data is not None and data['replays'] is not None:
+        # the statistics of the last upload, for another player if asked to
+        player_name = request.args.get('playerName', data['player_name'])
+        if player_name != data['player_name']:
+            data['player_name'] = player_name
+            save_session(session['id'], data)
+        (g.stats_raw, g.rep_list) = get_statistics(data['replays'], [player_name])
+        g.stats_content = get_stats_content(g.stats_raw,g.rep_list)
+    return render_template("stats.html")
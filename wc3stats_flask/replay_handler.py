@@ -1,16 +1,69 @@
-from .replay_helper import enrich_replay_data, compute_stats, stats_post_processing, load_single_replay, get_replay_list
-import base64
-import io
-import re
+from .replay_helper import enrich_single_replay, StatsAggregator, stats_post_processing, get_replay_list
+from .replay_table import ReplayTable
+from .replay_jobs import create_job
+from .session_store import SessionStore
+import os
+import datetime
+
+SESSION_STORE_PATH = os.path.join(os.path.expanduser('~'), '.wc3stats', 'sessions.sqlite')
+SESSION_STORE_SIZE = 200  # MB
 
 def get_statistics(replays, aliases):
-    replays = [r for r in replays if r is not None]
+    # replays can be a generator; the enriched replays go into a ReplayTable
+    # and the stats are grouped from its columns instead of replay by replay
+    er = []
+    for rep in replays:
+        if rep is not None:
+            new_rep = enrich_single_replay(rep, aliases)
+            if new_rep is not None:
+                er.append(new_rep)
 
-    er = enrich_replay_data(replays,aliases)
     rep_list = get_replay_list(er)
-    stats = compute_stats(er)
+    stats = StatsAggregator.from_table(ReplayTable(rep_list)).to_dict()
     stats_post_processing(stats)
     return (stats, rep_list)
 
-def load_replay(file, filename, date):
-    return load_single_replay(file, filename, date)
+def start_replay_job(files, dates):
+    # the replays are parsed in the background, the client polls the job
+    job = create_job()
+    for f in files:
+        if f.filename in dates:
+            job.add(f.read(), f.filename, dates[f.filename]/1000.0)
+    job.close()
+    return job
+
+_session_store = None
+
+def get_session_store():
+    """Returns the SessionStore of this process.
+
+    The location and size cap can be set with the SESSION_STORE_PATH and
+    SESSION_STORE_SIZE (in MB) environment variables.
+    """
+    global _session_store
+    # sqlite connections must not be shared with forked worker processes
+    if _session_store is None or _session_store[0] != os.getpid():
+        path = os.environ.get('SESSION_STORE_PATH') or SESSION_STORE_PATH
+        max_size = int(float(os.environ.get('SESSION_STORE_SIZE', SESSION_STORE_SIZE)) * 1024 * 1024)
+        _session_store = (os.getpid(), SessionStore(path, max_size))
+    return _session_store[1]
+
+def load_session(session_id):
+    # the session's data with its parsed replays, None if it is unknown
+    try:
+        data = get_session_store().get(session_id)
+    except KeyError:
+        return None
+    if data.get('replays') is not None:
+        for rep in data['replays']:
+            rep['datetime'] = datetime.datetime.fromtimestamp(rep['datetime'])
+            # json turns the player ids into strings
+            rep['apm_all'] = {int(k): v for k, v in rep['apm_all'].items()}
+    return data
+
+def save_session(session_id, data):
+    # False if the store could not write it, e.g. while the database is locked
+    if data.get('replays') is not None:
+        data = dict(data)
+        data['replays'] = [dict(rep, datetime=rep['datetime'].timestamp()) for rep in data['replays']]
+    return get_session_store().put(session_id, data)
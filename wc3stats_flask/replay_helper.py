@@ -1,6 +1,13 @@
 import os
+import io
 import datetime
+from array import array
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from .w3g import File
+from .replay_cache import ReplayCache
+from .replay_table import ReplayTable, length_bucket
 import json
 
 path_to_replays = '/Users/hen/Boxcryptor/Google Drive/W3'
@@ -18,6 +25,13 @@ modes = {
     'team': 'ladder team game' 
 }
 
+# bump whenever File or parse_single_replay change their results, cached
+# records of older versions are thrown away
+PARSER_VERSION = 1
+
+REPLAY_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.wc3stats', 'replay_cache.sqlite')
+REPLAY_CACHE_SIZE = 100  # MB
+
 def yieldFiles(p):
     if isinstance(p, str):
         for dirpath,_,filenames in os.walk(p):
@@ -70,28 +84,163 @@ def format_length(ms):
         hours = "0" + str(hours)
     return str(hours) + ":" + str(minutes) + ":" + str(seconds)
 
-def load_single_replay(file, filename, date):
+_replay_cache = None
+
+def get_replay_cache():
+    """Returns the parse cache of this process or None if it is disabled.
+
+    The location and size cap can be set with the REPLAY_CACHE_PATH and
+    REPLAY_CACHE_SIZE (in MB) environment variables, an empty
+    REPLAY_CACHE_PATH turns the cache off.
+    """
+    global _replay_cache
+    path = os.environ.get('REPLAY_CACHE_PATH', REPLAY_CACHE_PATH)
+    if not path:
+        return None
+    # sqlite connections must not be shared with forked worker processes
+    if _replay_cache is None or _replay_cache[0] != os.getpid():
+        max_size = int(float(os.environ.get('REPLAY_CACHE_SIZE', REPLAY_CACHE_SIZE)) * 1024 * 1024)
+        _replay_cache = (os.getpid(), ReplayCache(path, PARSER_VERSION, max_size))
+    return _replay_cache[1]
+
+def read_replay(file):
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            return f.read()
+    file.seek(0)
+    return file.read()
+
+def parse_single_replay(file):
+    # read the startup record only, most replays are filtered out by it
+    rep = File(file, events=False)
+    if rep.game_type == modes['1on1'] and rep.game_name == 'BNet':
+        # apm and winner are the only event data needed
+        rep = File(file, apm_only=True)
+        slots = parse_slot_records(rep.slot_records)
+        return {
+            'game_name': rep.game_name,
+            'players': parse_players(rep.players, slots),
+            'player_count': rep.player_count,
+            'length_formatted': format_length(rep.replay_length),
+            'length': rep.replay_length,
+            'game_type': rep.game_type,
+            'map_file_name': rep.map_name,
+            'map': format_map(rep.map_name),
+            'apm_all': rep.player_apm(),
+            'winner': rep.winner(),
+            'winning_team': slots[rep.winner()].team
+        }
+
+def get_cached_replay(cache, key):
+    rep = cache.get(key)
+    if rep is not None:
+        # json turns the player ids into strings
+        rep['apm_all'] = {int(k): v for k, v in rep['apm_all'].items()}
+    return rep
+
+def load_single_replay(file, filename, date, key=None):
+    # key is the content hash if it is already known, then a cached
+    # replay is not even read
     try:
-        rep = File(file)
-        if rep.game_type == modes['1on1'] and rep.game_name == 'BNet':
-            slots = parse_slot_records(rep.slot_records)
-            return {
-                'game_name': rep.game_name,
-                'players': parse_players(rep.players, slots),
-                'player_count': rep.player_count,
-                'length_formatted': format_length(rep.replay_length),
-                'length': rep.replay_length,
-                'game_type': rep.game_type,
-                'map_file_name': rep.map_name,
-                'map': format_map(rep.map_name),
-                'apm_all': rep.player_apm(),
-                'winner': rep.winner(),
-                'winning_team': slots[rep.winner()].team,
-                'filename': filename,
-                'datetime': datetime.datetime.fromtimestamp(date)
-            }
+        cache = get_replay_cache()
+        if cache is None:
+            rep = parse_single_replay(file)
+        else:
+            data = None
+            if key is None:
+                data = read_replay(file)
+                key = cache.key(data)
+            try:
+                rep = get_cached_replay(cache, key)
+            except KeyError:
+                if data is None:
+                    data = read_replay(file)
+                rep = parse_single_replay(io.BytesIO(data))
+                cache.put(key, rep)
+        if rep is not None:
+            rep['filename'] = filename
+            rep['datetime'] = datetime.datetime.fromtimestamp(date)
+            return rep
     except (IndexError, KeyError, ValueError, RuntimeError):
-         print(filename)
+        # RuntimeError: the winner could not be found
+        print(filename)
+
+def load_replay_isolated(source):
+    # runs in the worker processes of parse_many and the upload jobs, one
+    # bad replay must not take down the whole batch; source is an item of
+    # the sources of parse_many, the result None if it failed
+    file, filename, date = source[:3]
+    if isinstance(file, bytes):
+        file = io.BytesIO(file)
+    try:
+        return load_single_replay(file, filename, date, *source[3:])
+    except Exception:
+        print(filename)
+
+# the parse pool is shared by all upload jobs
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_workers():
+    """Returns the number of processes parsing replays, REPLAY_WORKERS sets it.
+
+    It defaults to the number of CPUs. The variable is read when it is
+    needed, so it may come from a .env loaded after this module.
+    """
+    return int(os.environ.get('REPLAY_WORKERS') or os.cpu_count() or 1)
+
+def get_parse_pool(broken=None):
+    """Returns the process pool parsing replays, started on first use.
+
+    Pass the pool that raised BrokenProcessPool as broken to get a new one.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None or _parse_pool is broken:
+            _parse_pool = ProcessPoolExecutor(max_workers=get_parse_workers())
+        return _parse_pool
+
+def iter_parse_many(sources, workers=None, chunksize=None):
+    """Like parse_many, but yields each result as soon as it is ready."""
+    sources = list(sources)
+    shared = workers is None
+    if shared:
+        workers = get_parse_workers()
+    workers = min(workers, len(sources))
+    if workers <= 1:
+        for s in sources:
+            yield load_replay_isolated(s)
+        return
+    if chunksize is None:
+        chunksize = max(1, len(sources) // (workers * 4))
+    if not shared:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(load_replay_isolated, sources, chunksize=chunksize)
+        return
+    pool = get_parse_pool()
+    try:
+        try:
+            results = pool.map(load_replay_isolated, sources, chunksize=chunksize)
+        except BrokenProcessPool:
+            # a worker died earlier, e.g. killed for its memory, start over
+            pool = get_parse_pool(pool)
+            results = pool.map(load_replay_isolated, sources, chunksize=chunksize)
+        yield from results
+    except BrokenProcessPool:
+        # the next call gets a new pool
+        get_parse_pool(pool)
+        raise
+
+def parse_many(sources, workers=None, chunksize=None):
+    """Parses replays with load_single_replay in a process pool.
+
+    sources is an iterable of (file, filename, date) tuples where file is a
+    path or the raw bytes of a replay, a content hash may be added as fourth
+    item. The results are returned in the order of sources, None for replays
+    that were skipped or could not be parsed. The pool of get_parse_pool is
+    used unless the number of workers is given.
+    """
+    return list(iter_parse_many(sources, workers, chunksize))
 
 # def load_replays(p):
 #     replays = []
@@ -150,54 +299,58 @@ def get_other_race(replay, player, bAlliedRace=None):
 def enrich_replay_data(replays, player_aliases):
     enriched_replays = []
     for rep in replays:
-        if rep['game_name'] == 'BNet':
-            player = get_player(rep, player_aliases)
-            if player is not None:
-                new_rep = {
-                    'game_name': rep['game_name'],
-                    'players': rep['players'],
-                    'player_count': rep['player_count'],
-                    'length_formatted': rep['length_formatted'],
-                    'length': rep['length'],
-                    'game_type': rep['game_type'],
-                    'map_file_name': rep['map_file_name'],
-                    'map': rep['map'],
-                    'apm_all': rep['apm_all'],
-                    'winner': rep['winner'],
-                    'winning_team': rep['winning_team'],
-                    'filename': rep['filename'],
-                    'datetime': rep['datetime'],
-                    'hour': rep['datetime'].hour,
-                    'weekday': rep['datetime'].weekday()
-                }
-                
-                if player['id'] in rep['apm_all']:
-                    new_rep['apm'] = rep['apm_all'][player['id']]
-                else:
-                    new_rep['apm'] = 0
-                
-                new_rep['won'] = True if rep['winning_team'] == player['team'] else False
-                new_rep['race'] = player['race']
-                new_rep['ally_race'] = get_other_race(rep, player, True)
-                new_rep['enemy_race'] = get_other_race(rep, player, False)
-                new_rep['enemy_players'] = get_enemy_players(rep, player['team'])
-                for p in list(new_rep['enemy_players'].values()):
-                    if p['id'] in rep['apm_all']:
-                        new_rep['enemy_players'][p['id']]['apm'] = rep['apm_all'][p['id']]
-                    else:
-                        new_rep['enemy_players'][p['id']]['apm'] = 0
-                
-                enriched_replays.append(new_rep)
-                
+        new_rep = enrich_single_replay(rep, player_aliases)
+        if new_rep is not None:
+            enriched_replays.append(new_rep)
     return enriched_replays
 
+def enrich_single_replay(rep, player_aliases):
+    if rep['game_name'] == 'BNet':
+        player = get_player(rep, player_aliases)
+        if player is not None:
+            new_rep = {
+                'game_name': rep['game_name'],
+                'players': rep['players'],
+                'player_count': rep['player_count'],
+                'length_formatted': rep['length_formatted'],
+                'length': rep['length'],
+                'game_type': rep['game_type'],
+                'map_file_name': rep['map_file_name'],
+                'map': rep['map'],
+                'apm_all': rep['apm_all'],
+                'winner': rep['winner'],
+                'winning_team': rep['winning_team'],
+                'filename': rep['filename'],
+                'datetime': rep['datetime'],
+                'hour': rep['datetime'].hour,
+                'weekday': rep['datetime'].weekday()
+            }
+            
+            if player['id'] in rep['apm_all']:
+                new_rep['apm'] = rep['apm_all'][player['id']]
+            else:
+                new_rep['apm'] = 0
+            
+            new_rep['won'] = True if rep['winning_team'] == player['team'] else False
+            new_rep['race'] = player['race']
+            new_rep['ally_race'] = get_other_race(rep, player, True)
+            new_rep['enemy_race'] = get_other_race(rep, player, False)
+            new_rep['enemy_players'] = get_enemy_players(rep, player['team'])
+            for p in list(new_rep['enemy_players'].values()):
+                if p['id'] in rep['apm_all']:
+                    new_rep['enemy_players'][p['id']]['apm'] = rep['apm_all'][p['id']]
+                else:
+                    new_rep['enemy_players'][p['id']]['apm'] = 0
+            
+            return new_rep
+
 def replay_match(rep, race, maps, ally_race, enemy_race, won):
     if race is not None and rep['race'] not in race:
         return False
     
     if maps is not None and rep['map'] not in maps:
         return False
-
+    
     if ally_race is not None and len(ally_race - set(rep['ally_race'])) > 0:
         return False
         
@@ -434,98 +587,151 @@ def get_empty_stats_dict(dont_add_dicts=False):
         stats['race_on_map'] = {}
     return stats
 
-def compute_stats_single_replay(rep, stats):
-    # compute temp values
-    temp_length = stats['avg_len'] * (stats['w']+stats['l'])
-    temp_length = temp_length + rep['length']
-    temp_apm = stats['apm'] * (stats['w']+stats['l'])
-    temp_apm = temp_apm + rep['apm']        
-    temp_apm_hour = stats['hours'][str(rep['hour'])]['apm'] * (stats['hours'][str(rep['hour'])]['w']+stats['hours'][str(rep['hour'])]['l'])
-    temp_apm_hour = temp_apm_hour + rep['apm'] 
-    temp_apm_day = stats['days'][str(rep['weekday'])]['apm'] * (stats['days'][str(rep['weekday'])]['w']+stats['days'][str(rep['weekday'])]['l'])
-    temp_apm_day = temp_apm_day + rep['apm']
-    
-    # update wins/losses
-    if rep['won']:
-        wl_string = 'w'
-    else:
-        wl_string = 'l'
-
-    stats[wl_string] += 1
-    stats['hours'][str(rep['hour'])][wl_string] +=1
-    stats['days'][str(rep['weekday'])][wl_string] +=1
-    if rep['length']<600000:
-        stats['0to10'][wl_string] +=1
-        stats['0to10']['p'] = round(stats['0to10']['w'] / (stats['0to10']['w']+stats['0to10']['l']), 2)
-    elif rep['length']<1200000:
-        stats['10to20'][wl_string] +=1
-        stats['10to20']['p'] = round(stats['10to20']['w'] / (stats['10to20']['w']+stats['10to20']['l']), 2)
-    elif rep['length']<1800000:
-        stats['20to30'][wl_string] +=1
-        stats['20to30']['p'] = round(stats['20to30']['w'] / (stats['20to30']['w']+stats['20to30']['l']), 2)
-    else:
-        stats['30up'][wl_string] +=1
-        stats['30up']['p'] = round(stats['30up']['w'] / (stats['30up']['w']+stats['30up']['l']), 2)
-        
-    # replay length
-    stats['avg_len'] = temp_length // (stats['w']+stats['l'])
-    stats['avg_length'] = format_length(stats['avg_len'])
-    
-    # win %
-    stats['p'] = round(stats['w'] / (stats['w']+stats['l']), 2)
-    stats['hours'][str(rep['hour'])]['p'] = round(stats['hours'][str(rep['hour'])]['w'] / (stats['hours'][str(rep['hour'])]['w']+stats['hours'][str(rep['hour'])]['l']), 2)
-    stats['days'][str(rep['weekday'])]['p'] = round(stats['days'][str(rep['weekday'])]['w'] / (stats['days'][str(rep['weekday'])]['w']+stats['days'][str(rep['weekday'])]['l']), 2)    
-        
-    # apm
-    stats['apm'] = temp_apm // (stats['w']+stats['l'])
-    stats['hours'][str(rep['hour'])]['apm'] = temp_apm_hour // (stats['hours'][str(rep['hour'])]['w']+stats['hours'][str(rep['hour'])]['l'])
-    stats['days'][str(rep['weekday'])]['apm'] = temp_apm_day // (stats['days'][str(rep['weekday'])]['w']+stats['days'][str(rep['weekday'])]['l'])
-    
-    enemy_race_string = ', '.join(rep['enemy_race'])
-    
-    if 'race' in stats:
-        if enemy_race_string not in stats['race']:
-            stats['race'][enemy_race_string] = get_empty_stats_dict(True)
-            stats['race'][enemy_race_string]['enemy_race'] = rep['enemy_race']
-        compute_stats_single_replay(rep, stats['race'][enemy_race_string])
-    
-    if 'map' in stats and not isinstance(stats['map'],str):
-        if rep['map'] not in stats['map']:
-            stats['map'][rep['map']] = get_empty_stats_dict(True)
-        compute_stats_single_replay(rep, stats['map'][rep['map']])
-    
-    if 'race_on_map' in stats:
-        race_on_map_string = enemy_race_string + " on " + rep['map']
-        if race_on_map_string not in stats['race_on_map']:
-            stats['race_on_map'][race_on_map_string] = get_empty_stats_dict(True)
-            stats['race_on_map'][race_on_map_string]['map'] = rep['map']
-            stats['race_on_map'][race_on_map_string]['enemy_race'] = rep['enemy_race']
-        compute_stats_single_replay(rep, stats['race_on_map'][race_on_map_string])
+# layout of the counters behind one stats dict of StatsAggregator
+LENGTH_BUCKETS = ('0to10', '10to20', '20to30', '30up')
+_W, _L, _LENGTH, _APM = 0, 1, 2, 3
+_BUCKET = 4                                 # w, l per length bucket
+_HOUR = _BUCKET + 2 * len(LENGTH_BUCKETS)   # w, l, apm per hour
+_DAY = _HOUR + 3 * 24                       # w, l, apm per weekday
+_NCOUNTERS = _DAY + 3 * 7
+
+def _percentage(w, l):
+    return round(w / (w+l), 2) if w+l else 0.0
+
+class StatsAggregator(object):
+    """Accumulates the statistics of compute_stats in fixed-size counters.
+
+    Every stats dict of the result (one per race, and below it one per
+    enemy race, map and enemy race on map) is backed by an array of wins,
+    losses, length and apm sums, split by length bucket, hour and weekday.
+    Aggregators of different replays can be combined with merge(), e.g.
+    partial results of worker processes, and to_dict() builds the nested
+    dict of compute_stats once at the end.
+    """
+
+    def __init__(self):
+        # (race, kind, key) -> counters, kind is None for the race itself
+        self.counters = {}
+        # extra fields of the race and race_on_map dicts
+        self.info = {}
+
+    @classmethod
+    def from_table(cls, table, rows=None):
+        """Aggregates the given rows of a ReplayTable, all rows by default."""
+        agg = cls()
+        columns = ('race', 'enemy_race', 'map', 'won', 'length_bucket', 'hour', 'weekday')
+        groups = table.group_by(columns, rows)
+        for (race, enemy_race, mapname, won, bucket, hour, weekday), (n, length, apm) in groups.items():
+            agg._add(race, enemy_race, mapname, won, bucket, hour, weekday, n, length, apm)
+        return agg
+
+    def add(self, rep):
+        self._add(rep['race'], rep['enemy_race'], rep['map'], rep['won'], length_bucket(rep['length']),
+                  rep['hour'], rep['weekday'], 1, rep['length'], rep['apm'])
+
+    def remove(self, rep):
+        """Takes a replay that was added before out of the stats again."""
+        self._add(rep['race'], rep['enemy_race'], rep['map'], rep['won'], length_bucket(rep['length']),
+                  rep['hour'], rep['weekday'], -1, -rep['length'], -rep['apm'])
+
+    def _add(self, race, enemy_race, mapname, won, bucket, hour, weekday, n, length, apm):
+        # adds n replays with the given length and apm sums; the races are
+        # sorted, equal sets may iterate in another order, in another
+        # process in particular
+        enemy_race_string = ', '.join(sorted(enemy_race))
+        race_on_map_string = enemy_race_string + " on " + mapname
+        keys = (
+            ((race, None, None), None),
+            ((race, 'race', enemy_race_string), {'enemy_race': set(enemy_race)}),
+            ((race, 'map', mapname), None),
+            ((race, 'race_on_map', race_on_map_string), {'map': mapname, 'enemy_race': set(enemy_race)}),
+        )
+        wl = _W if won else _L
+        bucket = _BUCKET + 2 * bucket + wl
+        hour = _HOUR + 3 * hour
+        day = _DAY + 3 * weekday
+        for key, info in keys:
+            c = self.counters.get(key)
+            if c is None:
+                c = self.counters[key] = array('d', bytes(8 * _NCOUNTERS))
+                if info is not None:
+                    self.info[key] = info
+            c[wl] += n
+            c[_LENGTH] += length
+            c[_APM] += apm
+            c[bucket] += n
+            c[hour + wl] += n
+            c[hour + 2] += apm
+            c[day + wl] += n
+            c[day + 2] += apm
+
+    def merge(self, other):
+        """Adds the counts of other to this aggregator and returns it."""
+        for key, c in other.counters.items():
+            mine = self.counters.get(key)
+            if mine is None:
+                self.counters[key] = array('d', c)
+                if key in other.info:
+                    self.info[key] = other.info[key]
+            else:
+                for i, v in enumerate(c):
+                    mine[i] += v
+        return self
+
+    def to_dict(self):
+        stats = {}
+        for key, c in self.counters.items():
+            if c[_W] + c[_L] == 0:
+                # every replay of it was removed again
+                continue
+            race, kind, name = key
+            if kind is None:
+                stats[race] = self._stats_dict(c, get_empty_stats_dict())
+            else:
+                d = self._stats_dict(c, get_empty_stats_dict(True))
+                d.update(self.info.get(key, ()))
+                stats[race][kind][name] = d
+        return stats
+
+    @staticmethod
+    def _stats_dict(c, stats):
+        # the counters are doubles since apm is fractional, counts and
+        # length sums stay exact far beyond any number of replays
+        w, l = int(c[_W]), int(c[_L])
+        stats['w'] = w
+        stats['l'] = l
+        stats['p'] = _percentage(w, l)
+        stats['avg_len'] = int(c[_LENGTH]) // (w+l)
+        stats['avg_length'] = format_length(stats['avg_len'])
+        stats['apm'] = c[_APM] // (w+l)
+        for i, name in enumerate(LENGTH_BUCKETS):
+            w, l = int(c[_BUCKET + 2*i]), int(c[_BUCKET + 2*i + 1])
+            stats[name].update(w=w, l=l, p=_percentage(w, l))
+        for period, offset, count in (('hours', _HOUR, 24), ('days', _DAY, 7)):
+            for i in range(count):
+                w, l, apm = c[offset + 3*i:offset + 3*i + 3]
+                w, l = int(w), int(l)
+                stats[period][str(i)].update(w=w, l=l, p=_percentage(w, l), apm=apm // (w+l) if w+l else 0)
+        return stats
 
 def compute_stats(replays, race=None, maps=None, ally_race=None, enemy_race=None, won=None):
-    stats = {}
-    for rep in replays:
-        if replay_match(rep, race, maps, ally_race, enemy_race, won):
-            if rep['race'] not in stats:
-                stats[rep['race']] = get_empty_stats_dict()
-            compute_stats_single_replay(rep, stats[rep['race']])
-    return stats
+    # pass a ReplayTable to query the same replays with different filters
+    table = replays if isinstance(replays, ReplayTable) else ReplayTable(replays)
+    rows = table.select(race, maps, ally_race, enemy_race, won)
+    return StatsAggregator.from_table(table, rows).to_dict()
 
 def get_replay_list(replays):
     return sorted(replays, key=lambda k: k['datetime'], reverse=True) 
 
 def list_replay_names(replays, race=None, maps=None, ally_race=None, enemy_race=None, won=None):
-    filenames = []
-    for rep in replays:
-        if replay_match(rep, race, maps, ally_race, enemy_race, won):
-            filenames.append(rep['filename'])
-    return filenames
+    table = replays if isinstance(replays, ReplayTable) else ReplayTable(replays)
+    return [table.filename[i] for i in table.select(race, maps, ally_race, enemy_race, won)]
 
 def stats_post_processing(stats):
     for race in stats.keys():
         for rom in stats[race]['race_on_map'].keys():
             race_on_map = stats[race]['race_on_map'][rom]
-            enemy_race_string = ', '.join(race_on_map['enemy_race'])
+            enemy_race_string = ', '.join(sorted(race_on_map['enemy_race']))
             if enemy_race_string in stats[race]['race']:
                 if not 'maps' in stats[race]['race'][enemy_race_string]:
                      stats[race]['race'][enemy_race_string]['maps'] = {}
@@ -0,0 +1,27 @@
+"""Server side store of the data of a browser session.
+
+The cookie of a session only carries its id. What belongs to the session
+(the player name, the upload metadata and the parsed replays) lives in a
+SQLiteStore, so later requests can show the statistics again, for another
+player name too, without uploading or parsing the replays again. The
+least recently used sessions are evicted once the database grows over its
+size cap.
+"""
+from .sqlite_store import SQLiteStore
+
+
+class SessionStore(SQLiteStore):
+    """Maps session ids to JSON serializable dicts.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database, created if it does not exist.
+    max_size : int, optional
+        Size cap of the stored sessions in bytes.
+    """
+
+    def __init__(self, path, max_size=200 * 1024 * 1024):
+        # version 1 is the table of SQLiteStore, the sessions of the table
+        # before it are dropped
+        super(SessionStore, self).__init__(path, 'sessions', max_size, 1)
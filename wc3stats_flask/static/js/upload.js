@@ -104,11 +104,37 @@ $(document).ready(function() {
 			data : formData,
 			processData : false,
 			contentType : false,
-			success : function(response) {
-				$("#bodyContainer").html(response);
-				convertDataTables();
-				addHandlers();
+			success : function(job) {
+				pollJob(job);
 			}
 		});
 	});
+
+	function showProgress(job){
+		var percent = job.total > 0 ? Math.round((job.parsed / job.total) * 100) : 0;
+		var text = job.parsed + ' of ' + job.total + ' replays parsed';
+		if(job.failed > 0){
+			text += ', ' + job.failed + ' failed';
+		}
+		if(job.eta){
+			text += ', about ' + (Math.floor(job.eta) + 1) + 's left';
+		}
+		$('#progressBar').attr('aria-valuenow', percent).css('width', percent + '%').text(text);
+	}
+
+	// the replays are parsed in the background, ask for the job until it is done
+	function pollJob(job){
+		showProgress(job);
+		if(!job.done){
+			setTimeout(function(){
+				$.getJSON('/jobs/' + job.id, pollJob);
+			}, 1000);
+			return;
+		}
+		$.get('/jobs/' + job.id + '/result', function(response){
+			$("#bodyContainer").html(response);
+			convertDataTables();
+			addHandlers();
+		});
+	}
 });
\ No newline at end of file
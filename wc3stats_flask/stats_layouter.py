@@ -1,6 +1,7 @@
 import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objs as go
+from .fragment_cache import FragmentCache
 
 ALL_RACES = {
     'random': {
@@ -63,6 +64,10 @@ WEEKDAYS = {
     '6': 'Sun'
 }
 
+# bump whenever the output of the memoized layout functions changes
+LAYOUT_VERSION = 1
+fragments = FragmentCache(LAYOUT_VERSION)
+
 def get_stats_content(stats, rep_list):
     # overall_pane, overall_tab = get_overall_content(stats)
     race_panes, race_tabs = get_by_race_content(stats)
@@ -100,6 +105,7 @@ def get_by_race_content(stats):
             tabs.append(race_tab)
     return (panes, tabs)
 
+@fragments.memoize
 def _get_race_content(stats, racekey):
     html = f"<div class='card m-3'>{_get_race_content_race_header(stats,racekey)}<div>" + _get_race_content_race_body(stats, racekey) + "</div></div>"
     html = html + f"<div class='card m-3'>{_get_race_content_map_header(stats,racekey)}<div>" + _get_race_content_map_body(stats, racekey) + "</div></div>"
@@ -177,6 +183,7 @@ def _get_map_content(stats, mapname):
         "href": f"map-{mapname}",
         "text": ALL_MAPS[mapname],
     })
+@fragments.memoize
 def _get_table_by_map(stats, table_id):
     html = f"<table id='{table_id}' class='table table-striped table-hover table-sm datatable' style='width:100%'><thead><tr><th>Map</th><th>Wins</th><th>Losses</th><th>Win %</th><th>Avg. Length</th><th>Avg. APM</th></tr></thead><tbody>"
 
@@ -194,6 +201,7 @@ def _get_table_by_map(stats, table_id):
     html = html + "</tbody></table>"
     return html
 
+@fragments.memoize
 def _get_table_by_race(stats, table_id):
     html = f"<table id='{table_id}' class='table table-striped table-hover table-sm datatable' style='width:100%'><thead><tr><th>vs</th><th>Wins</th><th>Losses</th><th>Win %</th><th>Avg. Length</th><th>Avg. APM</th></tr></thead><tbody>"
 